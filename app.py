@@ -1,12 +1,24 @@
 import streamlit as st
-from fpdf import FPDF
-import qrcode
-import tempfile
+from streamlit.errors import StreamlitAPIException
 import os
-from datetime import datetime
-import yaml
-from yaml.loader import SafeLoader
+import time
 import streamlit_authenticator as stauth
+from topoguia.almacen_pdf import almacen_pdfs
+from topoguia.cache import hash_contenido
+from topoguia.credenciales import (
+    almacen_configurado, cargar_config, config_por_defecto, emitir_token, guardar_config,
+    validar_token, verificar_credenciales,
+)
+from topoguia import metricas
+from topoguia.imagenes import DPI_POR_DEFECTO, cache_imagenes, miniatura_cacheada
+from topoguia.mapa import hay_teselas
+from topoguia.modelo import (
+    CAMPOS_OBLIGATORIOS, IMAGENES_OBLIGATORIAS, DatosRuta, cargar_plantilla, sustituto_imagen, validar_campo,
+)
+from topoguia.pdf import clave_resultado, crear_pdf_topoguia, nombre_archivo_pdf
+from topoguia.trabajos import ERROR, ColaLlena, cola_trabajos
+from topoguia.traza import ficha_tecnica, leer_traza_cacheada
+from topoguia.vista_previa import renderizar_vista_previa
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(
@@ -16,62 +28,92 @@ st.set_page_config(
 )
 
 # --- SISTEMA DE AUTENTICACIÓN ---
-# Crear config.yaml si no existe
-if not os.path.exists('config.yaml'):
-    st.warning("⚙️ Creando archivo de configuración por primera vez...")
-    
-    # Generar hashes correctos para las contraseñas
-    import streamlit_authenticator as stauth
-    hashed_passwords = stauth.Hasher(['admin123', 'demo123']).generate()
-    
-    config_default = f"""credentials:
-  usernames:
-    admin:
-      email: admin@topoguias.es
-      name: Administrador
-      password: {hashed_passwords[0]}
-    usuario1:
-      email: usuario1@example.com
-      name: Usuario Demo
-      password: {hashed_passwords[1]}
-
-cookie:
-  expiry_days: 30
-  key: some_signature_key_cambiar_en_produccion_12345
-  name: topoguias_auth_cookie
-
-preauthorized:
-  emails: []
-"""
-    with open('config.yaml', 'w', encoding='utf-8') as f:
-        f.write(config_default)
-    st.success("✅ Archivo de configuración creado")
-
-# Cargar configuración de usuarios
-try:
-    with open('config.yaml', encoding='utf-8') as file:
-        config = yaml.load(file, Loader=SafeLoader)
-except FileNotFoundError:
-    st.error("❌ No se encuentra el archivo config.yaml")
-    st.stop()
-except Exception as e:
-    st.error(f"❌ Error al cargar config.yaml: {e}")
-    st.stop()
-
-authenticator = stauth.Authenticate(
-    config['credentials'],
-    config['cookie']['name'],
-    config['cookie']['key'],
-    config['cookie']['expiry_days']
-)
-
-# Widget de login (API actualizado)
-try:
-    # Intentar con el nuevo API (v0.3.0+)
-    authenticator.login()
-except TypeError:
-    # Fallback al API antiguo
-    authenticator.login('Login', 'main')
+# Con TOPOGUIA_CREDENCIALES (p. ej. sqlite://usuarios.db) los usuarios se leen
+# de un almacén indexado; si no, de config.yaml con streamlit-authenticator.
+almacen = almacen_configurado()
+
+
+def login_con_almacen(almacen):
+    """Formulario de login contra el almacén de credenciales
+
+    Tras un login correcto la sesión guarda un token firmado: los reruns solo
+    comprueban la firma y que el usuario siga existiendo, sin bcrypt.
+    """
+    clave = almacen.clave_sesion()
+    usuario = validar_token(st.session_state.get('token_sesion'), clave)
+    if usuario and almacen.obtener_usuario(usuario) is not None:
+        return
+    # Sin token válido (o usuario eliminado) no queda nada de la sesión anterior;
+    # un intento fallido conserva el False para seguir mostrando el error
+    for estado in ('token_sesion', 'name', 'username', 'roles'):
+        st.session_state.pop(estado, None)
+    if st.session_state.get('authentication_status') is not False:
+        st.session_state.authentication_status = None
+    
+    with st.form('login'):
+        st.subheader('Login')
+        usuario = st.text_input('Usuario')
+        password = st.text_input('Contraseña', type='password')
+        entrar = st.form_submit_button('Entrar')
+    if entrar:
+        datos = verificar_credenciales(almacen, usuario.strip(), password)
+        if datos is None:
+            st.session_state.authentication_status = False
+        else:
+            st.session_state.update(
+                authentication_status=True,
+                name=datos['nombre'] or datos['usuario'],
+                username=datos['usuario'],
+                roles=datos['roles'],
+                token_sesion=emitir_token(datos['usuario'], clave),
+            )
+            st.rerun()
+
+
+if almacen is not None:
+    login_con_almacen(almacen)
+else:
+    # La configuración se lee una vez por proceso y solo se relee si config.yaml
+    # cambia. Si no existe se crea con los usuarios de demostración, cuyos hashes
+    # vienen precalculados: bcrypt no se ejecuta nunca en una petición.
+    try:
+        try:
+            config = cargar_config()
+        except FileNotFoundError:
+            guardar_config(config_por_defecto())
+            st.success("✅ Archivo de configuración creado con los usuarios de prueba")
+            config = cargar_config()
+    except Exception as e:
+        st.error(f"❌ Error al cargar config.yaml: {e}")
+        st.stop()
+    
+    # El autenticador no se comparte entre reruns: su constructor dibuja el
+    # componente de cookies de este navegador. Con la configuración ya validada
+    # construirlo es barato (auto_hash=False evita revisar cada contraseña).
+    try:
+        authenticator = stauth.Authenticate(
+            config['credentials'],
+            config['cookie']['name'],
+            config['cookie']['key'],
+            config['cookie']['expiry_days'],
+            auto_hash=False
+        )
+    except TypeError:
+        # Versiones anteriores sin el parámetro auto_hash
+        authenticator = stauth.Authenticate(
+            config['credentials'],
+            config['cookie']['name'],
+            config['cookie']['key'],
+            config['cookie']['expiry_days']
+        )
+    
+    # Widget de login (API actualizado)
+    try:
+        # Intentar con el nuevo API (v0.3.0+)
+        authenticator.login()
+    except TypeError:
+        # Fallback al API antiguo
+        authenticator.login('Login', 'main')
 
 name = st.session_state.get("name")
 authentication_status = st.session_state.get("authentication_status")
@@ -83,18 +125,25 @@ if authentication_status == False:
     st.stop()
 elif authentication_status == None:
     st.warning('Por favor, introduce tu usuario y contraseña')
-    st.info("""
-    **Usuarios de prueba:**
-    - Usuario: `admin` | Contraseña: `admin123`
-    - Usuario: `usuario1` | Contraseña: `demo123`
-    """)
+    if almacen is None:
+        st.info("""
+        **Usuarios de prueba:**
+        - Usuario: `admin` | Contraseña: `admin123`
+        - Usuario: `usuario1` | Contraseña: `demo123`
+        """)
     st.stop()
 
 # Si está autenticado, mostrar la aplicación
-try:
-    authenticator.logout('Cerrar Sesión', 'sidebar')
-except:
-    authenticator.logout(location='sidebar')
+if almacen is not None:
+    if st.sidebar.button('Cerrar Sesión'):
+        for estado in ('token_sesion', 'name', 'username', 'roles', 'authentication_status'):
+            st.session_state.pop(estado, None)
+        st.rerun()
+else:
+    try:
+        authenticator.logout('Cerrar Sesión', 'sidebar')
+    except:
+        authenticator.logout(location='sidebar')
     
 st.sidebar.write(f'Bienvenido/a *{name}*')
 st.sidebar.divider()
@@ -148,145 +197,283 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- FUNCIONES AUXILIARES ---
-def cargar_plantilla():
-    """Carga datos de plantilla por defecto"""
-    return {
-        'entidad_promotora': 'Junta de Comunidades de Castilla-La Mancha',
-        'red_senderos': 'Red de Senderos de Guadalajara',
-        'parque': 'Parque Natural Sierra Norte de Guadalajara',
-        'telefono_parque': '949 88 53 00',
-        'telefono_emergencias': '112',
-        'web_institucional': 'http://areasprotegidas.castillalamancha.es'
-    }
-
-def validar_campos(datos, imagenes):
-    """Valida que los campos obligatorios estén completos"""
-    errores = []
-    
-    if not datos.get('codigo_ruta'):
-        errores.append("Código de Ruta")
-    if not datos.get('nombre_sendero'):
-        errores.append("Nombre del Sendero")
-    if not datos.get('distancia'):
-        errores.append("Distancia")
-    if not datos.get('tiempo'):
-        errores.append("Tiempo Estimado")
-    if not imagenes.get('mapa'):
-        errores.append("Imagen del Mapa")
-    if not imagenes.get('perfil'):
-        errores.append("Imagen del Perfil")
-    if not imagenes.get('mide'):
-        errores.append("Imagen de Tabla MIDE")
-    
-    return errores
+def vista_previa(archivo):
+    """Miniatura de una subida: el contenido completo solo se lee y hashea la primera vez"""
+    huellas = st.session_state.setdefault('huellas_subidas', {})
+    if archivo.file_id not in huellas:
+        huellas[archivo.file_id] = hash_contenido(archivo.getvalue())
+    return miniatura_cacheada(huellas[archivo.file_id], archivo.getvalue)
 
 # --- SESSION STATE INIT ---
 if 'plantilla' not in st.session_state:
     st.session_state.plantilla = cargar_plantilla()
 
-if 'form_data' not in st.session_state:
-    st.session_state.form_data = {}
+# Cada widget guarda su valor en la sesión con su propia clave (los campos de
+# DatosRuta usan el nombre del campo). Así cada pestaña puede ejecutarse sola
+# como fragmento y el resto de la página lee los valores sin volver a dibujarla.
+VALORES_INICIALES = {
+    # Datos básicos
+    'codigo_ruta': "PR-GU 08",
+    'punto_inicio': "Centro de Interpretación",
+    'lugares_interes': "Pico Ocejón, Castillo de Atienza",
+    'nombre_sendero': "MANDAYONA-MIRABUENO-ARAGOSA",
+    'municipio': "Mandayona",
+    'mirador_nombre': "MIRADOR DEL PICO",
+    # Ficha técnica y MIDE
+    'distancia': "11,0 Km",
+    'desnivel_subida': "167 m",
+    'tiempo': "2h 35m",
+    'desnivel_bajada': "167 m",
+    'tipo_ruta': "Circular",
+    'altitud_rango': "900-1100 m",
+    'mide_severidad': 1,
+    'mide_orientacion': 2,
+    'mide_desplazamiento': 2,
+    'mide_esfuerzo': 2,
+    # Descripción
+    'parrafo1': "Este sendero circular comienza en el Centro de Interpretación...",
+    'parrafo2': "El recorrido transcurre por caminos vecinales y sendas entre campos de cultivo...",
+    'parrafo3': "La vegetación predominante son las encinas, con miradores panorámicos...",
+    'parrafo4': "En cuanto a fauna, es posible avistar buitres leonados y mirlo acuático...",
+    'recomendaciones': "Se recomienda evitar los meses de verano por las altas temperaturas. Precaución al cruzar la carretera CM-1003.",
+    'hito1': "INICIO DE RUTA (C.I.N.)",
+    'hito2': "MIRABUENO",
+    'hito3': "ARAGOSA",
+    'hito4': "FINAL DE RUTA",
+    # Configuración
+    'url_qr': st.session_state.plantilla['web_institucional'],
+    'telefono_emergencias': st.session_state.plantilla['telefono_emergencias'],
+    'entidad_promotora': st.session_state.plantilla['entidad_promotora'],
+    'parque_natural': st.session_state.plantilla['parque'],
+    'telefono_parque': st.session_state.plantilla['telefono_parque'],
+    'red_senderos': st.session_state.plantilla['red_senderos'],
+    'dpi_impresion': DPI_POR_DEFECTO,
+    'consejos_disfruta': "• Lleva prismáticos para observar fauna\n• Respeta el silencio del entorno\n• No enciendas fuego\n• Llévate toda tu basura",
+}
+for clave, valor in VALORES_INICIALES.items():
+    st.session_state.setdefault(clave, valor)
+
+# Archivos que llegan al PDF: las imágenes y el track del perfil vectorial
+CLAVES_SUBIDAS = ('banner', 'mapa', 'perfil', 'mide', 'logo', 'track')
+CAMPOS_VALIDADOS = (*CAMPOS_OBLIGATORIOS, *IMAGENES_OBLIGATORIAS)
+
+
+def imagenes_subidas():
+    """Subidas actuales por clave (solo las que hay)"""
+    return {clave: st.session_state[clave] for clave in CLAVES_SUBIDAS if st.session_state.get(clave)}
+
+
+def datos_de_sesion():
+    """DatosRuta con los valores actuales de los widgets"""
+    return DatosRuta.desde_dict(st.session_state.to_dict())
+
+
+def revalidar(campos):
+    """Valida de nuevo solo los `campos` cuyo valor ha cambiado desde la última vez
+    
+    Guarda en la sesión el error de cada campo; las subidas se comparan por su
+    file_id, no por contenido.
+    """
+    validados = st.session_state.setdefault('validados', {})
+    for campo in campos:
+        valor = st.session_state.get(campo)
+        sustituto = st.session_state.get(sustituto_imagen(campo))
+        huella = (getattr(valor, 'file_id', valor), getattr(sustituto, 'file_id', sustituto))
+        if campo not in validados or validados[campo][0] != huella:
+            validados[campo] = (huella, validar_campo(campo, valor, sustituto))
+    return [validados[campo][1] for campo in CAMPOS_VALIDADOS if campo in validados and validados[campo][1]]
+
+
+def resumen_barra():
+    """Lo que muestra la barra lateral del formulario: ruta, nombre y campos que faltan"""
+    return (
+        st.session_state.get('codigo_ruta'),
+        st.session_state.get('nombre_sendero'),
+        tuple(revalidar(())),
+    )
+
+
+def actualizar_barra(campos):
+    """Final de cada pestaña: revalida sus campos y, si cambia el resumen de la barra, la redibuja
+    
+    Una pestaña es un fragmento y solo se redibuja ella; la barra lateral (y
+    la página entera) solo se vuelve a ejecutar cuando hay algo nuevo que enseñar.
+    """
+    revalidar(campos)
+    if resumen_barra() != st.session_state.get('resumen_mostrado'):
+        st.rerun()
+
+
+def maqueta_actual():
+    """Vista previa de los datos actuales; se reutiliza mientras no cambien datos ni imágenes"""
+    datos = datos_de_sesion()
+    subidas = imagenes_subidas()
+    clave = (tuple(datos.a_dict().items()), tuple((c, a.file_id) for c, a in subidas.items()))
+    guardada = st.session_state.get('vista_previa_cacheada')
+    if guardada is None or guardada[0] != clave:
+        inicio_vista = time.perf_counter()
+        # Las imágenes van en miniatura; el track, entero (su perfil queda en caché)
+        proxies = {c: archivo.getvalue() if c == 'track' else vista_previa(archivo) for c, archivo in subidas.items()}
+        maqueta = renderizar_vista_previa(datos, proxies)
+        guardada = (clave, maqueta, time.perf_counter() - inicio_vista)
+        st.session_state.vista_previa_cacheada = guardada
+    return guardada[1], guardada[2]
+
+
+# ==================== BARRA LATERAL: RESUMEN Y VALIDACIÓN ====================
+# Se dibuja antes que las pestañas, a partir de los valores de la sesión: en
+# una ejecución completa ya están actualizados y las pestañas no necesitan
+# volver a pedirla.
+st.sidebar.header("🎯 Acciones")
+
+codigo_ruta = st.session_state.codigo_ruta
+nombre_sendero = st.session_state.nombre_sendero
+errores = revalidar(CAMPOS_VALIDADOS)
+st.session_state.resumen_mostrado = resumen_barra()
+
+st.sidebar.subheader("📊 Resumen")
+st.sidebar.write(f"**Usuario:** {username}")
+st.sidebar.write(f"**Ruta:** {codigo_ruta or 'Sin definir'}")
+st.sidebar.write(f"**Nombre:** {nombre_sendero[:25] if nombre_sendero else 'Sin definir'}...")
+
+if errores:
+    st.sidebar.error(f"⚠️ Faltan {len(errores)} campo(s):")
+    for error in errores[:5]:  # Mostrar máximo 5
+        st.sidebar.write(f"• {error}")
+else:
+    st.sidebar.success("✅ Todos los campos completos")
+
+maqueta, duracion_vista = maqueta_actual()
+st.session_state.avisos_mostrados = len(maqueta.avisos)
+if maqueta.avisos:
+    st.sidebar.warning(f"📐 {len(maqueta.avisos)} aviso(s) de maquetación: revisa la Vista Previa")
 
 # --- TABS PRINCIPALES ---
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
     "📋 Datos Básicos",
     "📊 Ficha Técnica y MIDE",
     "📝 Descripción",
     "🖼️ Imágenes",
-    "⚙️ Configuración"
+    "⚙️ Configuración",
+    "👁️ Vista Previa"
 ])
 
-# Diccionario para almacenar todas las imágenes
-imagenes = {}
-
 # ==================== TAB 1: DATOS BÁSICOS ====================
-with tab1:
+@st.fragment
+def pestana_datos_basicos():
     st.header("Información General del Sendero")
     
     col1, col2 = st.columns(2)
     
     with col1:
-        codigo_ruta = st.text_input(
+        st.text_input(
             "Código de Ruta *",
-            value="PR-GU 08",
+            key="codigo_ruta",
             help="Código identificador de la ruta (ej: PR-GU 08)"
         )
-        
-        punto_inicio = st.text_input(
+    
+        st.text_input(
             "Punto de Inicio",
-            value="Centro de Interpretación",
+            key="punto_inicio",
             placeholder="Mandayona",
             help="Localidad o punto donde comienza el sendero"
         )
-        
-        lugares_interes = st.text_input(
+    
+        st.text_input(
             "Lugares de Interés (separados por coma)",
-            value="Pico Ocejón, Castillo de Atienza",
+            key="lugares_interes",
             help="Lugares destacados que aparecerán etiquetados en la imagen panorámica"
         )
     
     with col2:
-        nombre_sendero = st.text_input(
+        st.text_input(
             "Nombre del Sendero *",
-            value="MANDAYONA-MIRABUENO-ARAGOSA",
+            key="nombre_sendero",
             help="Nombre descriptivo de la ruta"
         )
-        
-        municipio = st.text_input(
+    
+        st.text_input(
             "Municipio(s)",
-            value="Mandayona",
+            key="municipio",
             placeholder="Mandayona",
             help="Municipios por los que transcurre la ruta"
         )
-        
-        mirador_nombre = st.text_input(
+    
+        st.text_input(
             "Nombre del Mirador (opcional)",
-            value="MIRADOR DEL PICO",
+            key="mirador_nombre",
             help="Si hay un mirador principal, ponle nombre"
         )
+    
+    actualizar_barra(('codigo_ruta', 'nombre_sendero'))
+
+with tab1:
+    pestana_datos_basicos()
 
 # ==================== TAB 2: FICHA TÉCNICA Y MIDE ====================
-with tab2:
+@st.fragment
+def pestana_ficha_tecnica():
     st.header("Características Técnicas")
     
+    # Un track nuevo rellena la ficha antes de dibujar sus campos; después se
+    # pueden corregir a mano sin que el track los vuelva a pisar
+    track = st.file_uploader(
+        "📍 Track de la ruta (GPX o GeoJSON, opcional)",
+        type=['gpx', 'geojson', 'json'],
+        key="track",
+        help="Calcula distancia, desniveles, rango de altitud, tipo de ruta y horario MIDE a partir del track"
+    )
+    if track is not None and track.file_id != st.session_state.get('track_aplicado'):
+        st.session_state.track_aplicado = track.file_id
+        try:
+            traza = leer_traza_cacheada(track.getvalue())
+            st.session_state.update(ficha_tecnica(traza))
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        else:
+            st.success(f"✅ Ficha técnica calculada a partir de {track.name}. Puedes corregir los valores a mano.")
+            if not traza.tiene_altitud:
+                st.warning("⚠️ El track no tiene altitudes: el perfil de elevación tendrá que ser una imagen")
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        distancia = st.text_input(
+        st.text_input(
             "Distancia Total *",
-            value="11,0 Km",
+            key="distancia",
             help="Distancia total del recorrido"
         )
-        
-        desnivel_subida = st.text_input(
+    
+        st.text_input(
             "Desnivel Subida",
-            value="167 m",
+            key="desnivel_subida",
             help="Metros de subida acumulada"
         )
     
     with col2:
-        tiempo = st.text_input(
+        st.text_input(
             "Tiempo Estimado (Horario) *",
-            value="2h 35m",
+            key="tiempo",
             help="Tiempo estimado para completar la ruta"
         )
-        
-        desnivel_bajada = st.text_input(
+    
+        st.text_input(
             "Desnivel Bajada",
-            value="167 m",
+            key="desnivel_bajada",
             help="Metros de bajada acumulada"
         )
     
     with col3:
-        tipo_ruta = st.selectbox(
+        st.selectbox(
             "Tipo de Ruta *",
             ["Circular", "Lineal", "Semi-circular"],
+            key="tipo_ruta",
             help="Tipo de recorrido"
         )
-        
-        altitud_rango = st.text_input(
+    
+        st.text_input(
             "Rango Altitud",
-            value="900-1100 m",
+            key="altitud_rango",
             help="Altitud mínima y máxima (ej: 900-1100 m)"
         )
     
@@ -297,72 +484,78 @@ with tab2:
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        mide_severidad = st.number_input(
+        st.number_input(
             "Severidad del Medio",
             min_value=1,
             max_value=5,
-            value=1,
+            key="mide_severidad",
             help="Condiciones ambientales adversas"
         )
     
     with col2:
-        mide_orientacion = st.number_input(
+        st.number_input(
             "Orientación",
             min_value=1,
             max_value=5,
-            value=2,
+            key="mide_orientacion",
             help="Dificultad para orientarse"
         )
     
     with col3:
-        mide_desplazamiento = st.number_input(
+        st.number_input(
             "Dificultad Desplazamiento",
             min_value=1,
             max_value=5,
-            value=2,
+            key="mide_desplazamiento",
             help="Dificultad del terreno"
         )
     
     with col4:
-        mide_esfuerzo = st.number_input(
+        st.number_input(
             "Esfuerzo Necesario",
             min_value=1,
             max_value=5,
-            value=2,
+            key="mide_esfuerzo",
             help="Esfuerzo físico requerido"
         )
+    
+    actualizar_barra(('distancia', 'tiempo', 'perfil', 'mapa'))
+
+with tab2:
+    pestana_ficha_tecnica()
 
 # ==================== TAB 3: DESCRIPCIÓN ====================
-with tab3:
+@st.fragment
+def pestana_descripcion():
     st.header("Descripción y Contenidos")
     
     st.subheader("Descripción del Sendero")
     st.caption("Escribe 3-4 párrafos describiendo la ruta")
     
-    parrafo1 = st.text_area(
+    st.text_area(
         "Párrafo 1: Introducción",
-        value="Este sendero circular comienza en el Centro de Interpretación...",
+        key="parrafo1",
         height=100,
         help="Introduce la ruta, distancia, tipo y punto de inicio"
     )
     
-    parrafo2 = st.text_area(
+    st.text_area(
         "Párrafo 2: Descripción del recorrido",
-        value="El recorrido transcurre por caminos vecinales y sendas entre campos de cultivo...",
+        key="parrafo2",
         height=100,
         help="Describe el trazado, paisajes y elementos arquitectónicos"
     )
     
-    parrafo3 = st.text_area(
+    st.text_area(
         "Párrafo 3: Vegetación y vistas",
-        value="La vegetación predominante son las encinas, con miradores panorámicos...",
+        key="parrafo3",
         height=100,
         help="Menciona la flora y los puntos con mejores vistas"
     )
     
-    parrafo4 = st.text_area(
+    st.text_area(
         "Párrafo 4: Fauna",
-        value="En cuanto a fauna, es posible avistar buitres leonados y mirlo acuático...",
+        key="parrafo4",
         height=100,
         help="Describe la fauna característica de la zona"
     )
@@ -370,9 +563,9 @@ with tab3:
     st.divider()
     st.subheader("Recomendaciones")
     
-    recomendaciones = st.text_area(
+    st.text_area(
         "Texto de Recomendaciones",
-        value="Se recomienda evitar los meses de verano por las altas temperaturas. Precaución al cruzar la carretera CM-1003.",
+        key="recomendaciones",
         height=80,
         help="Advertencias importantes para los senderistas"
     )
@@ -383,14 +576,18 @@ with tab3:
     
     col1, col2 = st.columns(2)
     with col1:
-        hito1 = st.text_input("Hito 1", value="INICIO DE RUTA (C.I.N.)")
-        hito2 = st.text_input("Hito 2", value="MIRABUENO")
+        st.text_input("Hito 1", key="hito1")
+        st.text_input("Hito 2", key="hito2")
     with col2:
-        hito3 = st.text_input("Hito 3", value="ARAGOSA")
-        hito4 = st.text_input("Hito 4", value="FINAL DE RUTA")
+        st.text_input("Hito 3", key="hito3")
+        st.text_input("Hito 4", key="hito4")
+
+with tab3:
+    pestana_descripcion()
 
 # ==================== TAB 4: IMÁGENES ====================
-with tab4:
+@st.fragment
+def pestana_imagenes():
     st.header("Imágenes y Mapas")
     
     st.markdown("""
@@ -410,8 +607,7 @@ with tab4:
         help="Imagen panorámica del paisaje. Se añadirán etiquetas automáticamente."
     )
     if img_banner:
-        st.image(img_banner, caption="Vista previa - Banner", use_container_width=True)
-        imagenes['banner'] = img_banner
+        st.image(vista_previa(img_banner), caption="Vista previa - Banner", use_container_width=True)
     
     st.divider()
     
@@ -420,7 +616,8 @@ with tab4:
     
     with col1:
         st.subheader("🗺️ Mapa Topográfico *")
-        st.caption("Mapa con el trazado de la ruta (aparece en PÁGINA 2)")
+        st.caption("Mapa con el trazado de la ruta (aparece en PÁGINA 2)" + (
+            ". Con un track en Ficha Técnica se compone con las teselas locales" if hay_teselas() else ""))
         img_mapa = st.file_uploader(
             "Sube el mapa de la ruta",
             type=['png', 'jpg', 'jpeg'],
@@ -428,14 +625,16 @@ with tab4:
             help="Mapa topográfico con el recorrido marcado"
         )
         if img_mapa:
-            st.image(img_mapa, caption="Vista previa - Mapa", use_container_width=True)
-            imagenes['mapa'] = img_mapa
+            st.image(vista_previa(img_mapa), caption="Vista previa - Mapa", use_container_width=True)
+        elif st.session_state.get('track') and hay_teselas():
+            st.info("📍 Se compondrá con las teselas locales a partir del track")
         else:
             st.warning("⚠️ Imagen obligatoria")
     
     with col2:
         st.subheader("📈 Perfil de Elevación *")
-        st.caption("Gráfica del perfil altimétrico (aparece en PÁGINA 2)")
+        st.caption("Gráfica del perfil altimétrico (aparece en PÁGINA 2). "
+                   "Con un track en Ficha Técnica se dibuja automáticamente")
         img_perfil = st.file_uploader(
             "Sube el perfil de elevación",
             type=['png', 'jpg', 'jpeg'],
@@ -443,16 +642,18 @@ with tab4:
             help="Gráfico de área mostrando las variaciones de altitud"
         )
         if img_perfil:
-            st.image(img_perfil, caption="Vista previa - Perfil", use_container_width=True)
-            imagenes['perfil'] = img_perfil
+            st.image(vista_previa(img_perfil), caption="Vista previa - Perfil", use_container_width=True)
+        elif st.session_state.get('track'):
+            st.info("📍 Se dibujará a partir del track")
         else:
-            st.warning("⚠️ Imagen obligatoria")
+            st.warning("⚠️ Imagen obligatoria (o sube un track en Ficha Técnica)")
     
     st.divider()
     
     # Tabla MIDE
-    st.subheader("📊 Tabla MIDE *")
-    st.caption("Imagen de la matriz MIDE con valores de dificultad")
+    st.subheader("📊 Tabla MIDE (Opcional)")
+    st.caption("Por defecto se dibuja con los valores MIDE de Ficha Técnica; "
+               "una imagen subida aquí la sustituye")
     img_mide = st.file_uploader(
         "Sube la tabla MIDE",
         type=['png', 'jpg', 'jpeg'],
@@ -462,10 +663,7 @@ with tab4:
     if img_mide:
         col1, col2, col3 = st.columns([1,2,1])
         with col2:
-            st.image(img_mide, caption="Vista previa - MIDE", use_container_width=True)
-        imagenes['mide'] = img_mide
-    else:
-        st.warning("⚠️ Imagen obligatoria")
+            st.image(vista_previa(img_mide), caption="Vista previa - MIDE", use_container_width=True)
     
     st.divider()
     
@@ -480,11 +678,16 @@ with tab4:
     if img_logo:
         col1, col2, col3 = st.columns([1,2,1])
         with col2:
-            st.image(img_logo, caption="Vista previa - Logo", width=200)
-        imagenes['logo'] = img_logo
+            st.image(vista_previa(img_logo), caption="Vista previa - Logo", width=200)
+    
+    actualizar_barra(tuple(IMAGENES_OBLIGATORIAS))
+
+with tab4:
+    pestana_imagenes()
 
 # ==================== TAB 5: CONFIGURACIÓN ====================
-with tab5:
+@st.fragment
+def pestana_configuracion():
     st.header("Configuración y Datos Institucionales")
     
     st.subheader("🌐 Enlaces Web")
@@ -493,14 +696,14 @@ with tab5:
     with col1:
         url_qr = st.text_input(
             "URL para Código QR",
-            value=st.session_state.plantilla['web_institucional'],
+            key="url_qr",
             help="URL que se mostrará en el código QR del folleto"
         )
     
     with col2:
         telefono_emergencias = st.text_input(
             "Teléfono Emergencias",
-            value=st.session_state.plantilla['telefono_emergencias']
+            key="telefono_emergencias"
         )
     
     st.divider()
@@ -512,33 +715,43 @@ with tab5:
     with col1:
         entidad_promotora = st.text_input(
             "Entidad Promotora",
-            value=st.session_state.plantilla['entidad_promotora']
+            key="entidad_promotora"
         )
-        
+    
         parque_natural = st.text_input(
             "Parque Natural",
-            value=st.session_state.plantilla['parque']
+            key="parque_natural"
         )
     
     with col2:
         telefono_parque = st.text_input(
             "Teléfono del Parque",
-            value=st.session_state.plantilla['telefono_parque']
+            key="telefono_parque"
         )
-        
+    
         red_senderos = st.text_input(
             "Red de Senderos",
-            value=st.session_state.plantilla['red_senderos']
+            key="red_senderos"
         )
     
     st.divider()
     
+    st.subheader("🖨️ Calidad de Impresión")
+    st.select_slider(
+        "Resolución de las imágenes (ppp)",
+        options=[100, 150, 200, 300],
+        key="dpi_impresion",
+        help="Las imágenes se reducen a esta resolución para su tamaño impreso. Más ppp = más calidad y PDF más pesado"
+    )
+    
+    st.divider()
+    
     st.subheader("📋 Consejos para 'Disfruta del Parque'")
     st.caption("Aparecerán en la sección inferior de la PÁGINA 2")
     
-    consejos_predefinidos = st.text_area(
+    st.text_area(
         "Consejos",
-        value="• Lleva prismáticos para observar fauna\n• Respeta el silencio del entorno\n• No enciendas fuego\n• Llévate toda tu basura",
+        key="consejos_disfruta",
         height=120
     )
     
@@ -553,317 +766,184 @@ with tab5:
         }
         st.success("✅ Configuración guardada correctamente")
 
-# ==================== GENERACIÓN DEL PDF (LANDSCAPE - 2 PÁGINAS) ====================
-class PDF_Landscape(FPDF):
-    def __init__(self, datos):
-        super().__init__(orientation='L', unit='mm', format='A4')  # Landscape
-        self.datos = datos
-        self.set_auto_page_break(False)
-    
-    def pagina_1_informativa(self, imgs):
-        """PÁGINA 1: Cara informativa con descripción y foto panorámica"""
-        self.add_page()
-        
-        # Color verde corporativo
-        verde = (0, 122, 51)  # #007A33
-        
-        # 1. CABECERA CON LOGO (si existe)
-        if imgs.get('logo'):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                tmp.write(imgs['logo'].getvalue())
-                self.image(tmp.name, x=10, y=5, h=15)
-                os.remove(tmp.name)
-        
-        # Texto institucional en cabecera
-        self.set_font('Helvetica', 'I', 8)
-        self.set_text_color(100, 100, 100)
-        self.set_xy(200, 8)
-        self.cell(0, 4, self.datos.get('entidad_promotora', ''), align='R')
-        self.set_xy(200, 12)
-        self.cell(0, 4, self.datos.get('parque_natural', ''), align='R')
-        
-        # 2. FOTO PANORÁMICA CON ETIQUETA VERTICAL
-        y_banner = 25
-        if imgs.get('banner'):
-            # Etiqueta vertical izquierda
-            mirador = self.datos.get('mirador_nombre', 'MIRADOR DEL PICO')
-            if mirador:
-                self.set_fill_color(*verde)
-                self.rect(10, y_banner, 15, 80, 'F')
-                self.set_font('Helvetica', 'B', 10)
-                self.set_text_color(255, 255, 255)
-                self.set_xy(10, y_banner + 40)
-                self.rotate(90, 17.5, y_banner + 40)
-                self.cell(0, 0, mirador, align='C')
-                self.rotate(0)
-            
-            # Imagen panorámica
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-                tmp.write(imgs['banner'].getvalue())
-                self.image(tmp.name, x=28, y=y_banner, w=259, h=80)
-                os.remove(tmp.name)
-            
-            # Etiquetas de lugares de interés (simuladas como texto sobre la imagen)
-            self.set_font('Helvetica', 'B', 7)
-            self.set_text_color(255, 255, 255)
-            lugares = self.datos.get('lugares_interes', '').split(',')
-            x_pos = 40
-            for lugar in lugares[:3]:  # Máximo 3 etiquetas
-                self.set_xy(x_pos, y_banner + 5)
-                self.set_fill_color(0, 0, 0, 150)  # Fondo semi-transparente
-                self.cell(0, 5, lugar.strip(), fill=False)
-                x_pos += 80
-        
-        # 3. TÍTULO PRINCIPAL
-        y_titulo = 110
-        self.set_font('Helvetica', 'B', 28)
-        self.set_text_color(*verde)
-        self.set_xy(15, y_titulo)
-        self.cell(0, 10, self.datos.get('codigo_ruta', ''))
-        
-        self.set_font('Helvetica', 'B', 14)
-        self.set_xy(15, y_titulo + 12)
-        self.cell(0, 7, f"SENDERO {self.datos.get('nombre_sendero', '')}")
-        
-        # 4. COLUMNA DE TEXTO - DESCRIPCIÓN (4 párrafos)
-        y_texto = y_titulo + 25
-        self.set_font('Helvetica', '', 9)
-        self.set_text_color(0, 0, 0)
-        
-        ancho_columna = 180
-        
-        for i, parrafo in enumerate([
-            self.datos.get('parrafo1', ''),
-            self.datos.get('parrafo2', ''),
-            self.datos.get('parrafo3', ''),
-            self.datos.get('parrafo4', '')
-        ]):
-            self.set_xy(15, y_texto)
-            self.multi_cell(ancho_columna, 4, parrafo, align='J')
-            y_texto = self.get_y() + 2
-        
-        # 5. BLOQUE DE RECOMENDACIONES (Inferior)
-        y_recom = 185
-        self.set_fill_color(255, 243, 205)  # Fondo amarillo claro
-        self.rect(15, y_recom, ancho_columna, 15, 'F')
-        
-        self.set_font('Helvetica', 'B', 10)
-        self.set_text_color(*verde)
-        self.set_xy(17, y_recom + 2)
-        self.cell(0, 5, 'RECOMENDACIONES')
-        
-        self.set_font('Helvetica', '', 8)
-        self.set_text_color(0, 0, 0)
-        self.set_xy(17, y_recom + 7)
-        self.multi_cell(ancho_columna - 4, 3.5, self.datos.get('recomendaciones', ''))
-        
-        # PIE DE PÁGINA
-        self.set_y(-10)
-        self.set_font('Helvetica', 'I', 7)
-        self.set_text_color(100, 100, 100)
-        self.cell(0, 5, f'Generado el {datetime.now().strftime("%d/%m/%Y")}', align='C')
-    
-    def pagina_2_tecnica(self, imgs):
-        """PÁGINA 2: Mapa, perfil, ficha técnica y datos adicionales"""
-        self.add_page()
-        
-        verde = (0, 122, 51)
-        
-        # 1. MAPA TOPOGRÁFICO (Superior Izquierdo - 60% del ancho)
-        if imgs.get('mapa'):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-                tmp.write(imgs['mapa'].getvalue())
-                self.image(tmp.name, x=10, y=10, w=180, h=110)
-                os.remove(tmp.name)
-        
-        # 2. PERFIL DE ELEVACIÓN (Centro - Debajo del mapa)
-        y_perfil = 125
-        if imgs.get('perfil'):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-                tmp.write(imgs['perfil'].getvalue())
-                self.image(tmp.name, x=10, y=y_perfil, w=180, h=45)
-                os.remove(tmp.name)
-        
-        # 3. PANEL LATERAL DERECHO - FICHA TÉCNICA
-        x_panel = 195
-        y_panel = 10
-        ancho_panel = 92
-        
-        # Título del panel
-        self.set_fill_color(*verde)
-        self.rect(x_panel, y_panel, ancho_panel, 8, 'F')
-        self.set_font('Helvetica', 'B', 11)
-        self.set_text_color(255, 255, 255)
-        self.set_xy(x_panel, y_panel + 2)
-        self.cell(ancho_panel, 5, 'FICHA TÉCNICA', align='C')
-        
-        # Datos técnicos en tabla
-        y_datos = y_panel + 12
-        self.set_fill_color(245, 245, 245)
-        self.rect(x_panel, y_datos, ancho_panel, 35, 'F')
-        
-        self.set_font('Helvetica', 'B', 9)
-        self.set_text_color(0, 0, 0)
-        
-        datos_lista = [
-            ('Horario:', self.datos.get('tiempo', '')),
-            ('Distancia:', self.datos.get('distancia', '')),
-            ('Desnivel Subida:', self.datos.get('desnivel_subida', '')),
-            ('Desnivel Bajada:', self.datos.get('desnivel_bajada', '')),
-            ('Tipo:', self.datos.get('tipo_ruta', ''))
-        ]
-        
-        y_item = y_datos + 3
-        for etiqueta, valor in datos_lista:
-            self.set_xy(x_panel + 3, y_item)
-            self.set_font('Helvetica', 'B', 8)
-            self.cell(35, 5, etiqueta, align='L')
-            self.set_font('Helvetica', '', 8)
-            self.cell(0, 5, valor, align='L')
-            y_item += 6
-        
-        # 4. IMAGEN MIDE
-        y_mide = y_datos + 40
-        if imgs.get('mide'):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                tmp.write(imgs['mide'].getvalue())
-                self.image(tmp.name, x=x_panel, y=y_mide, w=ancho_panel)
-                os.remove(tmp.name)
-            y_mide += 35
-        
-        # 5. SECCIÓN SEÑALIZACIÓN
-        self.set_font('Helvetica', 'B', 9)
-        self.set_text_color(*verde)
-        self.set_xy(x_panel, y_mide + 5)
-        self.cell(0, 5, 'SEÑALIZACIÓN')
-        
-        self.set_font('Helvetica', '', 7)
-        self.set_text_color(0, 0, 0)
-        self.set_xy(x_panel, y_mide + 11)
-        self.multi_cell(ancho_panel, 3, 'Marcas blancas y amarillas:\n• Continuidad\n• Cambio de dirección\n• Dirección equivocada')
-        
-        # 6. SECCIÓN DISFRUTA DEL PARQUE
-        y_consejos = y_mide + 28
-        self.set_font('Helvetica', 'B', 9)
-        self.set_text_color(*verde)
-        self.set_xy(x_panel, y_consejos)
-        self.cell(0, 5, 'DISFRUTA DEL PARQUE')
-        
-        self.set_font('Helvetica', '', 7)
-        self.set_text_color(0, 0, 0)
-        self.set_xy(x_panel, y_consejos + 6)
-        self.multi_cell(ancho_panel, 3, self.datos.get('consejos_disfruta', ''))
-        
-        # 7. TELÉFONOS DE INTERÉS Y QR
-        y_telefonos = y_consejos + 28
-        self.set_font('Helvetica', 'B', 9)
-        self.set_text_color(*verde)
-        self.set_xy(x_panel, y_telefonos)
-        self.cell(0, 5, 'TELÉFONOS DE INTERÉS')
-        
-        self.set_font('Helvetica', '', 8)
-        self.set_text_color(0, 0, 0)
-        self.set_xy(x_panel, y_telefonos + 6)
-        self.cell(0, 4, f"Emergencias: {self.datos.get('telefono_emergencias', '112')}")
-        self.set_xy(x_panel, y_telefonos + 11)
-        self.cell(0, 4, f"Parque: {self.datos.get('telefono_parque', '')}")
-        
-        # Código QR
-        if self.datos.get('url_qr'):
-            qr = qrcode.QRCode(box_size=8, border=1)
-            qr.add_data(self.datos['url_qr'])
-            qr.make(fit=True)
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            qr_path = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-            qr_img.save(qr_path.name)
-            
-            self.image(qr_path.name, x=x_panel + 30, y=y_telefonos + 18, w=25)
-            os.remove(qr_path.name)
-            
-            self.set_font('Helvetica', 'I', 6)
-            self.set_xy(x_panel, y_telefonos + 45)
-            self.multi_cell(ancho_panel, 2.5, self.datos.get('url_qr', ''), align='C')
-
-def crear_pdf_topoguia(datos, imgs):
-    """Genera el PDF de la topoguía en formato landscape de 2 páginas"""
-    pdf = PDF_Landscape(datos)
-    
-    # Página 1: Informativa
-    pdf.pagina_1_informativa(imgs)
-    
-    # Página 2: Técnica
-    pdf.pagina_2_tecnica(imgs)
-    
-    return pdf.output()
-
-# ==================== BARRA LATERAL Y GENERACIÓN ====================
-st.sidebar.header("🎯 Acciones")
-
-# Resumen
-st.sidebar.subheader("📊 Resumen")
-st.sidebar.write(f"**Usuario:** {username}")
-st.sidebar.write(f"**Ruta:** {codigo_ruta if 'codigo_ruta' in locals() else 'Sin definir'}")
-st.sidebar.write(f"**Nombre:** {nombre_sendero[:25] if 'nombre_sendero' in locals() and nombre_sendero else 'Sin definir'}...")
-
-# Validación
-datos_formulario = {
-    'codigo_ruta': codigo_ruta if 'codigo_ruta' in locals() else '',
-    'nombre_sendero': nombre_sendero if 'nombre_sendero' in locals() else '',
-    'distancia': distancia if 'distancia' in locals() else '',
-    'tiempo': tiempo if 'tiempo' in locals() else '',
-    'desnivel_subida': desnivel_subida if 'desnivel_subida' in locals() else '',
-    'desnivel_bajada': desnivel_bajada if 'desnivel_bajada' in locals() else '',
-    'tipo_ruta': tipo_ruta if 'tipo_ruta' in locals() else '',
-    'lugares_interes': lugares_interes if 'lugares_interes' in locals() else '',
-    'mirador_nombre': mirador_nombre if 'mirador_nombre' in locals() else '',
-    'parrafo1': parrafo1 if 'parrafo1' in locals() else '',
-    'parrafo2': parrafo2 if 'parrafo2' in locals() else '',
-    'parrafo3': parrafo3 if 'parrafo3' in locals() else '',
-    'parrafo4': parrafo4 if 'parrafo4' in locals() else '',
-    'recomendaciones': recomendaciones if 'recomendaciones' in locals() else '',
-    'consejos_disfruta': consejos_predefinidos if 'consejos_predefinidos' in locals() else '',
-    'url_qr': url_qr if 'url_qr' in locals() else '',
-    'telefono_emergencias': telefono_emergencias if 'telefono_emergencias' in locals() else '',
-    'telefono_parque': telefono_parque if 'telefono_parque' in locals() else '',
-    'entidad_promotora': entidad_promotora if 'entidad_promotora' in locals() else '',
-    'parque_natural': parque_natural if 'parque_natural' in locals() else '',
-}
+with tab5:
+    pestana_configuracion()
+
+# ==================== TAB 6: VISTA PREVIA ====================
+# Las pestañas de edición no la redibujan: se actualiza en cada ejecución
+# completa o con su botón, y solo se vuelve a pintar si los datos han cambiado
+@st.fragment
+def pestana_vista_previa():
+    st.header("Vista Previa de la Maqueta")
+    st.caption("Borrador rápido con las imágenes en miniatura. Los saltos de línea son los mismos que en el PDF final.")
+    
+    st.button("🔄 Actualizar vista previa", help="Aplica los últimos cambios de las demás pestañas")
+    maqueta, duracion_vista = maqueta_actual()
+    if len(maqueta.avisos) != st.session_state.get('avisos_mostrados'):
+        st.rerun()  # el aviso de la barra lateral ha cambiado
+    
+    if maqueta.avisos:
+        st.warning("⚠️ Hay textos que no caben en su sitio (resaltados en rojo):\n\n" +
+                   "\n".join(f"• Página {a.pagina} - {a.mensaje}" for a in maqueta.avisos))
+    else:
+        st.success("✅ Todos los textos caben en su hueco")
+    
+    st.image(maqueta.paginas[0], caption="Página 1 - Informativa", use_container_width=True)
+    st.image(maqueta.paginas[1], caption="Página 2 - Técnica", use_container_width=True)
+    st.caption(f"Vista previa generada en {duracion_vista * 1000:.0f} ms")
 
-errores = validar_campos(datos_formulario, imagenes)
+with tab6:
+    pestana_vista_previa()
 
-if errores:
-    st.sidebar.error(f"⚠️ Faltan {len(errores)} campo(s):")
-    for error in errores[:5]:  # Mostrar máximo 5
-        st.sidebar.write(f"• {error}")
-else:
-    st.sidebar.success("✅ Todos los campos completos")
+# Valores para la generación, leídos de la sesión
+datos_formulario = datos_de_sesion()
+imagenes = imagenes_subidas()
+dpi_impresion = st.session_state.dpi_impresion
 
 st.sidebar.divider()
 
-# Botón de generación
+
+def generar_pdf_en_segundo_plano(datos, imgs, dpi, nombre_archivo, progreso):
+    """Trabajo de la cola: genera el PDF en el almacén en disco y devuelve su referencia
+    
+    Si ya hay un PDF para los mismos datos, imágenes y ppp se devuelve su
+    referencia sin generar nada; en ese caso el informe queda vacío. Si el
+    almacén no se puede escribir (directorio de solo lectura o lleno), el
+    resultado lleva los bytes del PDF en lugar de la referencia.
+    """
+    informe = {}
+    resultado = {'referencia': None, 'pdf': None, 'nombre_archivo': nombre_archivo, 'informe': informe}
+    # Cada imagen se hashea una sola vez para la clave y para la generación
+    huellas = {}
+    clave = clave_resultado(datos, imgs, dpi, huellas=huellas)
+    try:
+        resultado['referencia'] = almacen_pdfs.referencia_de(clave)
+    except OSError:
+        pass
+    if resultado['referencia'] is None:
+        pdf_bytes = bytes(crear_pdf_topoguia(datos, imgs, dpi=dpi, informe=informe, progreso=progreso,
+                                             huellas=huellas))
+        try:
+            resultado['referencia'] = almacen_pdfs.guardar(pdf_bytes, clave=clave)
+        except OSError:
+            resultado['pdf'] = pdf_bytes
+    return resultado
+
+
+def mostrar_resultado_pdf(trabajo):
+    """Resultado de un trabajo terminado: error o botón de descarga con el informe"""
+    if trabajo.estado == ERROR:
+        st.error(f"❌ Error al generar el PDF: {trabajo.error}")
+        return
+    
+    resultado = trabajo.resultado
+    referencia = resultado['referencia']
+    pdf_bytes = resultado.get('pdf')
+    if pdf_bytes is not None:
+        # Sin almacén en disco utilizable el PDF viene en el propio resultado
+        tamano = len(pdf_bytes)
+        leer_pdf = lambda: pdf_bytes
+    elif almacen_pdfs.ruta(referencia) is None:
+        st.warning("⌛ El PDF ya no está disponible en el servidor. Vuelve a generarlo.")
+        return
+    else:
+        tamano = almacen_pdfs.tamano(referencia)
+        leer_pdf = lambda: almacen_pdfs.leer(referencia) or b''
+    st.success(f"✅ ¡PDF generado correctamente! ({tamano / 1024 / 1024:.1f} MB)")
+    
+    # La sesión solo guarda la referencia: el PDF se lee de disco al pulsar
+    # el botón, no queda en memoria mientras se sigue editando
+    try:
+        st.download_button(
+            label="⬇️ Descargar PDF",
+            data=leer_pdf,
+            file_name=resultado['nombre_archivo'],
+            mime="application/pdf",
+            use_container_width=True
+        )
+    except StreamlitAPIException:
+        # Versiones de Streamlit sin descarga diferida
+        st.download_button(
+            label="⬇️ Descargar PDF",
+            data=leer_pdf(),
+            file_name=resultado['nombre_archivo'],
+            mime="application/pdf",
+            use_container_width=True
+        )
+    
+    st.info("📄 El PDF tiene 2 páginas:\n- **Página 1**: Descripción y foto panorámica\n- **Página 2**: Mapa, perfil y ficha técnica")
+    
+    informe_imagenes = resultado['informe']
+    if informe_imagenes:
+        ahorro_total = sum(p.bytes_ahorrados for p in informe_imagenes.values())
+        with st.expander(f"🗜️ Optimización de imágenes: {ahorro_total / 1024 / 1024:.1f} MB ahorrados"):
+            for clave, preparada in informe_imagenes.items():
+                st.write(f"**{clave.capitalize()}:** {preparada.resumen()}")
+            stats = cache_imagenes.estadisticas()
+            st.caption(
+                f"Caché de imágenes: {stats['aciertos']} aciertos, {stats['fallos']} fallos, "
+                f"{stats['bytes_usados'] / 1024 / 1024:.1f} de {stats['max_bytes'] / 1024 / 1024:.0f} MB"
+            )
+
+
+# Botón de generación: encola el trabajo y guarda su id en la sesión
 if st.sidebar.button("🚀 GENERAR PDF", type="primary", use_container_width=True):
     if errores:
         st.error(f"❌ No se puede generar el PDF. Faltan los siguientes campos obligatorios:\n\n" + 
                 "\n".join([f"• {e}" for e in errores]))
     else:
+        # Copia de los bytes: el trabajo no depende de los widgets de subida
+        imagenes_trabajo = {clave: archivo.getvalue() for clave, archivo in imagenes.items()}
         try:
-            with st.spinner("Generando PDF en formato horizontal (2 páginas)..."):
-                pdf_bytes = crear_pdf_topoguia(datos_formulario, imagenes)
-                
-                st.success("✅ ¡PDF generado correctamente!")
-                
-                nombre_archivo = f"Topoguia_{codigo_ruta.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.pdf"
-                
-                st.download_button(
-                    label="⬇️ Descargar PDF",
-                    data=pdf_bytes,
-                    file_name=nombre_archivo,
-                    mime="application/pdf",
-                    use_container_width=True
-                )
-                
-                st.info("📄 El PDF tiene 2 páginas:\n- **Página 1**: Descripción y foto panorámica\n- **Página 2**: Mapa, perfil y ficha técnica")
-        except Exception as e:
-            st.error(f"❌ Error al generar el PDF: {str(e)}")
-            st.exception(e)
+            trabajo = cola_trabajos.enviar(
+                generar_pdf_en_segundo_plano,
+                datos_formulario,
+                imagenes_trabajo,
+                dpi_impresion,
+                nombre_archivo_pdf(codigo_ruta),
+            )
+            st.session_state.trabajo_pdf = trabajo.id
+        except ColaLlena:
+            st.error("⏳ El servidor está generando demasiados PDFs ahora mismo. Inténtalo de nuevo en unos segundos.")
+
+# Estado del trabajo: sobrevive a los reruns mientras se sigue editando el formulario
+trabajo_pdf = cola_trabajos.obtener(st.session_state.get('trabajo_pdf'))
+if trabajo_pdf is not None:
+    sondeando = trabajo_pdf.activo
+    
+    @st.fragment(run_every=1.0 if sondeando else None)
+    def panel_trabajo_pdf():
+        trabajo = cola_trabajos.obtener(st.session_state.get('trabajo_pdf'))
+        if trabajo is None:
+            return
+        if trabajo.activo:
+            st.progress(trabajo.progreso, text=f"⏳ {trabajo.mensaje}")
+        elif sondeando:
+            # Acaba de terminar: rerun completo para dejar de consultar el estado
+            st.rerun()
+        else:
+            mostrar_resultado_pdf(trabajo)
+    
+    panel_trabajo_pdf()
+
+# Panel de métricas: solo para administradores (TOPOGUIA_ADMINS, por defecto "admin")
+administradores = {u.strip() for u in os.environ.get('TOPOGUIA_ADMINS', 'admin').split(',') if u.strip()}
+es_admin = username in administradores or 'admin' in (st.session_state.get('roles') or [])
+if es_admin:
+    with st.sidebar.expander("📈 Métricas de generación"):
+        if not metricas.ACTIVADAS:
+            st.caption("Desactivadas. Arranca la aplicación con `TOPOGUIA_METRICAS=1` para medir cada etapa.")
+        elif not metricas.ultimas_mediciones:
+            st.caption("Aún no se ha generado ningún PDF en este proceso.")
+        else:
+            ultima = metricas.ultimas_mediciones[-1]
+            # Los cuadernillos no tienen un único código: se identifican por su número de rutas
+            etiqueta = ultima.get('codigo_ruta') or (
+                f"cuadernillo de {ultima['rutas']} rutas" if 'rutas' in ultima else '—'
+            )
+            st.write(f"**Última:** {etiqueta} a {ultima.get('dpi', '—')} ppp, "
+                     f"{ultima['segundos']:.2f} s (pico {ultima['rss_pico_mb'] or 0:.0f} MB)")
+            st.dataframe(ultima['etapas'], hide_index=True, use_container_width=True)
+            tiempos = [m['segundos'] for m in metricas.ultimas_mediciones]
+            st.caption(f"{len(tiempos)} generaciones recientes: media {sum(tiempos) / len(tiempos):.2f} s, "
+                       f"máximo {max(tiempos):.2f} s")
@@ -0,0 +1,383 @@
+"""
+Benchmark reproducible de la generación de topoguías.
+
+Genera imágenes sintéticas deterministas (siempre los mismos píxeles para la
+misma semilla) y mide cada escenario en un proceso nuevo, para que las cachés
+en memoria empiecen vacías y el pico de memoria sea el del escenario:
+
+- tamaño: imágenes de 1 a 40 megapíxeles, en JPEG y en PNG
+- elementos: con y sin banner, logo y código QR
+- texto: párrafos cortos y largos
+- lote: muchas rutas con `generar_lote` en paralelo
+
+De cada escenario se guarda el tiempo (mediana de las repeticiones), el pico
+de memoria residente (RSS) y el tamaño del PDF, en JSON y CSV. Con --comparar
+se contrasta con un resultado anterior (p. ej. de otra rama) y se sale con
+código 1 si algún escenario empeora más del umbral.
+
+Uso:
+    python benchmark.py --etiqueta main
+    python benchmark.py --rapido --comparar resultados_benchmark/main.json
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime
+
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows: sin getrusage no se mide la memoria
+    resource = None
+
+from topoguia.imagenes import DPI_POR_DEFECTO
+
+# Medidas que se vigilan al comparar (más es peor en todas)
+MEDIDAS_COMPARADAS = ('segundos', 'rss_pico_mb', 'bytes_pdf')
+
+PARRAFO_CORTO = "Sendero circular que recorre el valle entre pinares y sabinas."
+PARRAFO_LARGO = (
+    "El sendero parte de la plaza del pueblo y asciende por una antigua vereda "
+    "ganadera entre muros de piedra seca, campos de cereal y manchas de encina. "
+    "Tras cruzar el arroyo por un puente de un solo ojo, el camino se adentra en "
+    "el pinar y gana altura en suaves lazadas hasta alcanzar el collado, desde "
+    "donde se divisan las parameras y, en días claros, las cumbres de la sierra. "
+) * 3
+
+
+@dataclass(frozen=True)
+class Escenario:
+    nombre: str
+    grupo: str
+    megapixeles: float = 5
+    formato: str = 'jpeg'
+    banner: bool = True
+    logo: bool = True
+    qr: bool = True
+    parrafos: str = 'cortos'
+    rutas: int = 1
+
+
+def escenarios(rapido=False, rutas_lote=20):
+    """Matriz de escenarios de la suite (reducida con `rapido`)"""
+    tamanos = (1, 12) if rapido else (1, 5, 12, 24, 40)
+    lista = [
+        Escenario(f'{formato}_{mp}mp', 'tamaño', megapixeles=mp, formato=formato)
+        for formato in ('jpeg', 'png')
+        for mp in tamanos
+    ]
+    completo = Escenario('completo', 'elementos')
+    lista += [
+        completo,
+        replace(completo, nombre='sin_banner', banner=False),
+        replace(completo, nombre='sin_logo', logo=False),
+        replace(completo, nombre='sin_qr', qr=False),
+        replace(completo, nombre='minimo', banner=False, logo=False, qr=False),
+        Escenario('parrafos_cortos', 'texto', megapixeles=1),
+        Escenario('parrafos_largos', 'texto', megapixeles=1, parrafos='largos'),
+        Escenario(f'lote_{rutas_lote}', 'lote', megapixeles=2, rutas=rutas_lote),
+    ]
+    return lista
+
+
+# --- Imágenes sintéticas ---
+
+def imagen_sintetica(megapixeles, semilla, proporcion=1.5):
+    """Imagen RGB determinista con aspecto de foto: degradados suaves más detalle fino"""
+    rnd = random.Random(semilla)
+    ancho = round(math.sqrt(megapixeles * 1_000_000 * proporcion))
+    alto = round(ancho / proporcion)
+
+    canales = []
+    for _ in range(3):
+        grueso = Image.frombytes('L', (16, 16), rnd.randbytes(256)).resize((ancho, alto), Image.Resampling.BICUBIC)
+        # Un mosaico de ruido de 256 px aporta la textura que cuesta comprimir
+        tesela = Image.frombytes('L', (256, 256), rnd.randbytes(256 * 256))
+        fino = Image.new('L', (ancho, alto))
+        for x in range(0, ancho, 256):
+            for y in range(0, alto, 256):
+                fino.paste(tesela, (x, y))
+        canales.append(Image.blend(grueso, fino, 0.25))
+    return Image.merge('RGB', canales)
+
+
+def imagen_lineal(ancho=800, alto=480):
+    """Tabla tipo MIDE: pocos colores planos, como un dibujo lineal"""
+    img = Image.new('P', (ancho, alto), 0)
+    img.putpalette([255, 255, 255, 0, 0, 0, 0, 122, 51, 230, 230, 230] + [0] * 756)
+    for fila in range(4):
+        for columna in range(5):
+            img.paste(2 if (fila + columna) % 2 else 3, (columna * 160 + 4, fila * 120 + 4, columna * 160 + 156, fila * 120 + 116))
+    return img
+
+
+def _guardar(img, ruta, formato):
+    if formato == 'jpeg':
+        img.save(ruta, 'JPEG', quality=90)
+    else:
+        img.save(ruta, 'PNG', compress_level=1)
+
+
+def preparar_imagenes(escenario, carpeta):
+    """Escribe (o reutiliza) las imágenes de un escenario y devuelve sus rutas por clave"""
+    extension = 'jpg' if escenario.formato == 'jpeg' else 'png'
+
+    def ruta_sintetica(nombre, semilla, proporcion=1.5):
+        ruta = os.path.join(carpeta, f'{nombre}_{escenario.megapixeles}mp_{semilla}.{extension}')
+        if not os.path.exists(ruta):
+            _guardar(imagen_sintetica(escenario.megapixeles, semilla, proporcion), ruta, escenario.formato)
+        return ruta
+
+    comunes = {
+        'perfil': ruta_sintetica('perfil', 2, proporcion=4),
+        'mide': os.path.join(carpeta, 'mide.png'),
+    }
+    if not os.path.exists(comunes['mide']):
+        imagen_lineal().save(comunes['mide'])
+    if escenario.banner:
+        comunes['banner'] = ruta_sintetica('banner', 3, proporcion=3.2)
+    if escenario.logo:
+        comunes['logo'] = os.path.join(carpeta, 'logo.png')
+        if not os.path.exists(comunes['logo']):
+            Image.new('RGBA', (400, 400), (0, 122, 51, 255)).save(comunes['logo'])
+
+    # En un lote cada ruta tiene su propio mapa; el resto se comparte como en una red real
+    return [
+        {**comunes, 'mapa': ruta_sintetica('mapa', 100 + indice)}
+        for indice in range(escenario.rutas)
+    ]
+
+
+def datos_ruta(escenario, indice=0):
+    parrafo = PARRAFO_LARGO if escenario.parrafos == 'largos' else PARRAFO_CORTO
+    return {
+        'codigo_ruta': f'PR-GU {indice + 1:02d}',
+        'nombre_sendero': 'MANDAYONA-MIRABUENO-ARAGOSA',
+        'lugares_interes': 'Mirabueno, Aragosa, Río Dulce',
+        'distancia': '11,4 km',
+        'tiempo': '3 h 30 min',
+        'desnivel_subida': '320 m',
+        'desnivel_bajada': '320 m',
+        'tipo_ruta': 'Circular',
+        'parrafo1': parrafo,
+        'parrafo2': parrafo,
+        'parrafo3': parrafo,
+        'parrafo4': parrafo,
+        'recomendaciones': 'Lleva agua y calzado adecuado. Respeta la señalización.',
+        'consejos_disfruta': '• Respeta la flora y la fauna\n• No dejes basura',
+        'url_qr': 'http://areasprotegidas.castillalamancha.es' if escenario.qr else '',
+        'entidad_promotora': 'Junta de Comunidades de Castilla-La Mancha',
+        'parque_natural': 'Parque Natural Sierra Norte de Guadalajara',
+        'telefono_parque': '949 88 53 00',
+    }
+
+
+# --- Medición (en un proceso nuevo por repetición) ---
+
+def _rss_pico_mb(quien=None):
+    if quien is None:
+        # En Linux, ru_maxrss de un proceso recién lanzado arrastra el pico del
+        # padre; VmHWM es solo de este proceso
+        try:
+            with open('/proc/self/status') as f:
+                for linea in f:
+                    if linea.startswith('VmHWM:'):
+                        return round(int(linea.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF if quien is None else quien).ru_maxrss
+    # Linux informa en KB y macOS en bytes
+    return round(pico / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def _medir(escenario, rutas_imagenes, carpeta_salida, dpi, procesos):
+    from generar_lote import generar_lote
+    from topoguia.pdf import crear_pdf_topoguia
+
+    if escenario.rutas == 1:
+        imgs = {}
+        for clave, ruta in rutas_imagenes[0].items():
+            with open(ruta, 'rb') as f:
+                imgs[clave] = f.read()
+        datos = datos_ruta(escenario)
+        rss_base = _rss_pico_mb()
+        inicio = time.perf_counter()
+        bytes_pdf = len(crear_pdf_topoguia(datos, imgs, dpi=dpi))
+    else:
+        rutas = [{**datos_ruta(escenario, i), **imagenes} for i, imagenes in enumerate(rutas_imagenes)]
+        rss_base = _rss_pico_mb()
+        inicio = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            filas = generar_lote(rutas, carpeta_salida, procesos=procesos, dpi=dpi)
+        errores = [f['error'] for f in filas if f['estado'] != 'ok']
+        if errores:
+            raise RuntimeError(f"{len(errores)} rutas del lote fallaron: {errores[0]}")
+        bytes_pdf = sum(f['bytes'] for f in filas)
+    segundos = time.perf_counter() - inicio
+
+    rss_pico = _rss_pico_mb()
+    if rss_pico is not None and escenario.rutas > 1:
+        # En un lote cuenta el proceso hijo que más memoria ha usado
+        rss_pico = max(rss_pico, _rss_pico_mb(resource.RUSAGE_CHILDREN))
+    return {'segundos': segundos, 'rss_pico_mb': rss_pico, 'rss_base_mb': rss_base, 'bytes_pdf': bytes_pdf}
+
+
+def ejecutar_escenario(escenario, carpeta_imagenes, repeticiones=3, dpi=DPI_POR_DEFECTO, procesos=None):
+    rutas_imagenes = preparar_imagenes(escenario, carpeta_imagenes)
+    contexto = multiprocessing.get_context('spawn')
+    medidas = []
+    for _ in range(repeticiones):
+        with tempfile.TemporaryDirectory() as carpeta_salida:
+            with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+                medidas.append(pool.submit(
+                    _medir, escenario, rutas_imagenes, carpeta_salida, dpi, procesos
+                ).result())
+
+    tiempos = [m['segundos'] for m in medidas]
+    picos = [m['rss_pico_mb'] for m in medidas if m['rss_pico_mb'] is not None]
+    bases = [m['rss_base_mb'] for m in medidas if m['rss_base_mb'] is not None]
+    return {
+        **asdict(escenario),
+        'segundos': round(statistics.median(tiempos), 3),
+        'segundos_min': round(min(tiempos), 3),
+        'rss_pico_mb': max(picos) if picos else None,
+        'rss_base_mb': max(bases) if bases else None,
+        'bytes_pdf': medidas[-1]['bytes_pdf'],
+    }
+
+
+# --- Resultados ---
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def metadatos(args):
+    import fpdf
+    import PIL
+
+    return {
+        'etiqueta': args.etiqueta,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'fpdf2': fpdf.__version__,
+        'pillow': PIL.__version__,
+        'dpi': args.dpi,
+        'repeticiones': args.repeticiones,
+    }
+
+
+def guardar_resultados(resultados, meta, carpeta):
+    """Escribe <etiqueta>.json (con metadatos) y <etiqueta>.csv y devuelve la ruta del JSON"""
+    os.makedirs(carpeta, exist_ok=True)
+    base = os.path.join(carpeta, meta['etiqueta'])
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'metadatos': meta, 'resultados': resultados}, f, ensure_ascii=False, indent=2)
+    with open(base + '.csv', 'w', encoding='utf-8', newline='') as f:
+        escritor = csv.DictWriter(f, fieldnames=list(resultados[0]))
+        escritor.writeheader()
+        escritor.writerows(resultados)
+    return base + '.json'
+
+
+def comparar(resultados, ruta_base, umbral):
+    """Imprime la variación frente a un resultado anterior y devuelve las regresiones"""
+    with open(ruta_base, encoding='utf-8') as f:
+        base = {r['nombre']: r for r in json.load(f)['resultados']}
+
+    regresiones = []
+    print(f"\n{'escenario':<20}" + ''.join(f"{m:>16}" for m in MEDIDAS_COMPARADAS))
+    for resultado in resultados:
+        anterior = base.get(resultado['nombre'])
+        if anterior is None:
+            continue
+        columnas = []
+        for medida in MEDIDAS_COMPARADAS:
+            antes, ahora = anterior.get(medida), resultado.get(medida)
+            if not antes or ahora is None:
+                columnas.append(f"{'-':>16}")
+                continue
+            variacion = ahora / antes - 1
+            marca = ' ⚠️' if variacion > umbral else ''
+            columnas.append(f"{variacion:>+13.1%}{marca:<3}")
+            if variacion > umbral:
+                regresiones.append((resultado['nombre'], medida, antes, ahora))
+        print(f"{resultado['nombre']:<20}" + ''.join(columnas))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de la generación de topoguías")
+    parser.add_argument('--rapido', action='store_true', help="Suite reducida (1 y 12 MP) para pruebas rápidas")
+    parser.add_argument('--solo', default='', help="Ejecuta solo los escenarios cuyo nombre o grupo contenga este texto")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Repeticiones por escenario (por defecto: 3)")
+    parser.add_argument('--rutas-lote', type=int, default=20, help="Rutas del escenario de lote (por defecto: 20)")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos del lote (por defecto: núcleos de la CPU)")
+    parser.add_argument('--dpi', type=int, default=DPI_POR_DEFECTO, help=f"Resolución de las imágenes (por defecto: {DPI_POR_DEFECTO})")
+    parser.add_argument('--etiqueta', default=None, help="Nombre de los archivos de resultados (por defecto: commit y fecha)")
+    parser.add_argument('--salida', default='resultados_benchmark', help="Carpeta de resultados (por defecto: resultados_benchmark)")
+    parser.add_argument('--imagenes', default=None, help="Carpeta donde guardar y reutilizar las imágenes sintéticas")
+    parser.add_argument('--comparar', default=None, help="JSON de un benchmark anterior con el que comparar")
+    parser.add_argument('--umbral', type=float, default=0.10, help="Empeoramiento tolerado al comparar (por defecto: 0.10 = 10%%)")
+    args = parser.parse_args(argv)
+    args.etiqueta = args.etiqueta or f"{_commit_actual() or 'local'}_{datetime.now():%Y%m%d_%H%M%S}"
+
+    seleccion = [
+        e for e in escenarios(args.rapido, args.rutas_lote)
+        if args.solo in e.nombre or args.solo in e.grupo
+    ]
+    carpeta_imagenes = args.imagenes or os.path.join(tempfile.gettempdir(), 'topoguia_benchmark')
+    os.makedirs(carpeta_imagenes, exist_ok=True)
+    print(f"⏱️  {len(seleccion)} escenarios, {args.repeticiones} repeticiones cada uno")
+
+    resultados = []
+    for numero, escenario in enumerate(seleccion, 1):
+        resultado = ejecutar_escenario(escenario, carpeta_imagenes, args.repeticiones, args.dpi, args.procesos)
+        resultados.append(resultado)
+        rss = f"{resultado['rss_pico_mb']:.0f} MB" if resultado['rss_pico_mb'] is not None else 'n/d'
+        print(f"[{numero}/{len(seleccion)}] {escenario.nombre:<20} {resultado['segundos']:>7.2f} s  "
+              f"RSS {rss:>8}  PDF {resultado['bytes_pdf'] / 1024:>8.0f} KB")
+
+    ruta_json = guardar_resultados(resultados, metadatos(args), args.salida)
+    print(f"📄 Resultados: {ruta_json} (y .csv)")
+
+    if args.comparar:
+        regresiones = comparar(resultados, args.comparar, args.umbral)
+        if regresiones:
+            print(f"\n❌ {len(regresiones)} regresiones por encima del {args.umbral:.0%}:")
+            for nombre, medida, antes, ahora in regresiones:
+                print(f"   {nombre}: {medida} {antes} → {ahora}")
+            return 1
+        print(f"\n✅ Sin regresiones por encima del {args.umbral:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Generador por lotes de topoguías, sin interfaz web.
+
+Lee un manifiesto (YAML o CSV) con una ruta por entrada, usando las mismas
+claves que el formulario de la aplicación (codigo_ruta, nombre_sendero,
+distancia, mide_severidad, ...) más las rutas a las imágenes (banner, mapa,
+perfil, logo y, si no se dibuja con los valores, mide), y genera todos los PDF
+en paralelo con un pool de procesos.
+
+Con la clave `track` (GPX o GeoJSON) la distancia, los desniveles, el tipo de
+ruta y el horario que falten en el manifiesto se calculan a partir del track,
+y el perfil de elevación se dibuja como vector sin necesidad de la imagen
+`perfil`; los hitos `hito1`-`hito4` se etiquetan en él. Con --mbtiles (o
+TOPOGUIA_MBTILES) tampoco hace falta la imagen `mapa`: se compone con las
+teselas locales y el recorrido del track. Cada proceso decodifica una sola vez
+las teselas que comparten las rutas de una misma sierra.
+
+Manifiesto YAML:
+
+    comun:                      # opcional, se aplica a todas las rutas
+      entidad_promotora: Junta de Comunidades de Castilla-La Mancha
+      logo: logos/jccm.png
+    rutas:
+      - codigo_ruta: PR-GU 08
+        nombre_sendero: MANDAYONA-MIRABUENO-ARAGOSA
+        mapa: mapas/prgu08.jpg
+        ...
+
+En CSV cada fila es una ruta y cada columna una clave. Las rutas de imagen
+relativas se resuelven desde la carpeta del manifiesto.
+
+Con --cuadernillo todas las rutas se unen en un solo PDF con índice, en el
+orden del manifiesto; las imágenes comunes (logo, tablas MIDE repetidas) se
+incrustan una sola vez.
+
+Uso:
+    python generar_lote.py red_senderos.yaml --salida pdfs/ --procesos 4
+    python generar_lote.py red_senderos.yaml --cuadernillo sierra_norte.pdf
+    python generar_lote.py red_senderos.yaml --mbtiles teselas/guadalajara.mbtiles
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import yaml
+
+from topoguia.cache import CacheLRU
+from topoguia.imagenes import DPI_POR_DEFECTO
+from topoguia.modelo import DatosRuta, validar_campos
+from topoguia.pdf import crear_cuadernillo, crear_pdf_topoguia, nombre_archivo_pdf
+from topoguia.traza import ficha_tecnica, leer_traza_cacheada
+
+CLAVES_IMAGEN = ('banner', 'mapa', 'perfil', 'mide', 'logo', 'track')
+CAMPOS_RESUMEN = ['indice', 'codigo_ruta', 'estado', 'segundos', 'bytes', 'archivo', 'error']
+
+# Imágenes ya leídas en este proceso, limitadas en bytes: los logos comunes se
+# repiten en todas las rutas, los mapas y fotos de cada una se van expulsando
+IMAGENES_LEIDAS_MB = 32
+_imagenes_leidas = CacheLRU(IMAGENES_LEIDAS_MB * 1024 * 1024)
+
+
+def leer_manifiesto(ruta_manifiesto):
+    """Devuelve la lista de rutas del manifiesto con las imágenes como rutas absolutas"""
+    base = os.path.dirname(os.path.abspath(ruta_manifiesto))
+
+    if ruta_manifiesto.lower().endswith('.csv'):
+        with open(ruta_manifiesto, encoding='utf-8', newline='') as f:
+            comun, rutas = {}, list(csv.DictReader(f))
+    else:
+        with open(ruta_manifiesto, encoding='utf-8') as f:
+            contenido = yaml.safe_load(f) or {}
+        if isinstance(contenido, list):
+            comun, rutas = {}, contenido
+        else:
+            comun, rutas = contenido.get('comun') or {}, contenido.get('rutas') or []
+
+    resultado = []
+    for ruta in rutas:
+        datos = {**comun, **{k: v for k, v in ruta.items() if v not in (None, '')}}
+        for clave in CLAVES_IMAGEN:
+            if datos.get(clave):
+                datos[clave] = os.path.join(base, datos[clave])
+        resultado.append(datos)
+    return resultado
+
+
+def completar_con_track(ruta):
+    """Ruta con la ficha técnica que le falte calculada de su track (los valores del manifiesto mandan)
+
+    El track se lee con la misma caché que las imágenes y se analiza con la de
+    trazas: el perfil y el mapa del PDF reutilizan ese mismo análisis.
+    """
+    if not ruta.get('track'):
+        return ruta
+    return {**ficha_tecnica(leer_traza_cacheada(_leer_imagen(ruta['track']))), **ruta}
+
+
+def _leer_imagen(ruta):
+    """Lee una imagen, reutilizando las recientes: los logos comunes se comparten entre rutas"""
+    def leer():
+        with open(ruta, 'rb') as f:
+            return f.read()
+    return _imagenes_leidas.obtener_o_calcular(ruta, leer)
+
+
+def _codigo(indice, ruta):
+    return str(ruta.get('codigo_ruta') or f'ruta_{indice}')
+
+
+def codigos_repetidos(rutas):
+    """Códigos de ruta que darían el mismo nombre de PDF (uno pisaría al otro)"""
+    nombres = Counter(nombre_archivo_pdf(_codigo(indice, ruta)) for indice, ruta in enumerate(rutas, 1))
+    return sorted({
+        _codigo(indice, ruta) for indice, ruta in enumerate(rutas, 1)
+        if nombres[nombre_archivo_pdf(_codigo(indice, ruta))] > 1
+    })
+
+
+def _fila(indice, ruta):
+    return {'indice': indice, 'codigo_ruta': _codigo(indice, ruta), 'archivo': '', 'bytes': 0, 'error': ''}
+
+
+def generar_ruta(indice, ruta, carpeta_salida, dpi=DPI_POR_DEFECTO):
+    """Genera el PDF de una ruta y devuelve una fila del resumen (nunca lanza excepciones)"""
+    inicio = time.perf_counter()
+    fila = _fila(indice, ruta)
+    codigo = fila['codigo_ruta']
+    try:
+        ruta = completar_con_track(ruta)
+        datos = DatosRuta.desde_dict(ruta)
+        imgs = {k: _leer_imagen(ruta[k]) for k in CLAVES_IMAGEN if ruta.get(k)}
+        errores = validar_campos(datos, imgs)
+        if errores:
+            raise ValueError(f"faltan campos obligatorios: {', '.join(errores)}")
+        pdf_bytes = crear_pdf_topoguia(datos, imgs, dpi=dpi)
+
+        archivo = os.path.join(carpeta_salida, nombre_archivo_pdf(codigo))
+        with open(archivo, 'wb') as f:
+            f.write(pdf_bytes)
+        fila.update(estado='ok', archivo=archivo, bytes=len(pdf_bytes))
+    except Exception as e:
+        fila.update(estado='error', error=f"{type(e).__name__}: {e}")
+    fila['segundos'] = round(time.perf_counter() - inicio, 3)
+    return fila
+
+
+def _fila_error(indice, ruta, error):
+    return {**_fila(indice, ruta), 'estado': 'error', 'segundos': 0, 'error': f"{type(error).__name__}: {error}"}
+
+
+def _generar_aislada(indice, ruta, carpeta_salida, dpi):
+    """`generar_ruta` en un proceso propio: si muere, solo se pierde esta ruta"""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(generar_ruta, indice, ruta, carpeta_salida, dpi).result()
+        except Exception as e:
+            return _fila_error(indice, ruta, e)
+
+
+def generar_lote(rutas, carpeta_salida, procesos=None, dpi=DPI_POR_DEFECTO):
+    """Genera todas las rutas en un pool de procesos mostrando el progreso"""
+    os.makedirs(carpeta_salida, exist_ok=True)
+    total = len(rutas)
+    filas = []
+
+    def informar(fila):
+        filas.append(fila)
+        if fila['estado'] == 'ok':
+            print(f"[{len(filas)}/{total}] ✅ {fila['codigo_ruta']}: "
+                  f"{fila['segundos']:.2f} s, {fila['bytes'] / 1024:.0f} KB")
+        else:
+            print(f"[{len(filas)}/{total}] ❌ {fila['codigo_ruta']}: {fila['error']}")
+
+    if procesos == 1:
+        for indice, ruta in enumerate(rutas, 1):
+            informar(generar_ruta(indice, ruta, carpeta_salida, dpi))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = {
+                pool.submit(generar_ruta, indice, ruta, carpeta_salida, dpi): (indice, ruta)
+                for indice, ruta in enumerate(rutas, 1)
+            }
+            afectadas = []
+            for futuro in as_completed(futuros):
+                try:
+                    informar(futuro.result())
+                except BrokenProcessPool:
+                    afectadas.append(futuros[futuro])
+                except Exception as e:
+                    informar(_fila_error(*futuros[futuro], e))
+        # Si un proceso muere (p. ej. sin memoria con una foto enorme) el pool
+        # entero se rompe: cada ruta afectada se repite en su propio proceso
+        # y solo la que vuelve a tumbarlo queda con error
+        for indice, ruta in sorted(afectadas, key=lambda par: par[0]):
+            informar(_generar_aislada(indice, ruta, carpeta_salida, dpi))
+
+    return sorted(filas, key=lambda f: f['indice'])
+
+
+def generar_cuadernillo(rutas, archivo, titulo=None, dpi=DPI_POR_DEFECTO):
+    """Une en un PDF las rutas válidas del manifiesto; devuelve (incluidas, errores)"""
+    incluidas, errores = [], []
+    for indice, ruta in enumerate(rutas, 1):
+        codigo = _codigo(indice, ruta)
+        try:
+            ruta = completar_con_track(ruta)
+            datos = DatosRuta.desde_dict(ruta)
+            imgs = {k: _leer_imagen(ruta[k]) for k in CLAVES_IMAGEN if ruta.get(k)}
+            faltan = validar_campos(datos, imgs)
+            if faltan:
+                raise ValueError(f"faltan campos obligatorios: {', '.join(faltan)}")
+        except Exception as e:
+            errores.append((codigo, f"{type(e).__name__}: {e}"))
+            print(f"❌ {codigo}: {errores[-1][1]}")
+            continue
+        incluidas.append((datos, imgs))
+
+    if not incluidas:
+        return incluidas, errores
+    if titulo is None:
+        titulo = incluidas[0][0].parque_natural
+
+    def progreso(fraccion, mensaje=''):
+        print(f"[{fraccion:4.0%}] {mensaje}")
+
+    pdf_bytes = crear_cuadernillo(incluidas, titulo=titulo, dpi=dpi, progreso=progreso)
+    carpeta = os.path.dirname(os.path.abspath(archivo))
+    os.makedirs(carpeta, exist_ok=True)
+    with open(archivo, 'wb') as f:
+        f.write(pdf_bytes)
+    return incluidas, errores
+
+
+def escribir_resumen(filas, ruta_resumen):
+    with open(ruta_resumen, 'w', encoding='utf-8', newline='') as f:
+        escritor = csv.DictWriter(f, fieldnames=CAMPOS_RESUMEN)
+        escritor.writeheader()
+        escritor.writerows(filas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera las topoguías de un manifiesto YAML/CSV")
+    parser.add_argument('manifiesto', help="Archivo .yaml/.yml o .csv con una ruta por entrada")
+    parser.add_argument('--salida', default='topoguias_pdf', help="Carpeta de salida (por defecto: topoguias_pdf)")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos en paralelo (por defecto: núcleos de la CPU)")
+    parser.add_argument('--cuadernillo', metavar='ARCHIVO.pdf',
+                        help="Une todas las rutas en un solo PDF con índice en lugar de un PDF por ruta")
+    parser.add_argument('--titulo', help="Título del índice del cuadernillo (por defecto: el parque de la primera ruta)")
+    parser.add_argument('--dpi', type=int, default=DPI_POR_DEFECTO, help=f"Resolución de las imágenes (por defecto: {DPI_POR_DEFECTO})")
+    parser.add_argument('--mbtiles', help="Teselas MBTiles para componer el mapa de las rutas con track y sin imagen de mapa")
+    args = parser.parse_args(argv)
+
+    if args.mbtiles:
+        if not os.path.isfile(args.mbtiles):
+            parser.error(f"no existe el archivo de teselas {args.mbtiles}")
+        # Por el entorno llega también a los procesos del pool
+        os.environ['TOPOGUIA_MBTILES'] = os.path.abspath(args.mbtiles)
+
+    rutas = leer_manifiesto(args.manifiesto)
+    print(f"📚 {len(rutas)} rutas en {args.manifiesto}")
+
+    if args.cuadernillo:
+        inicio = time.perf_counter()
+        incluidas, errores = generar_cuadernillo(rutas, args.cuadernillo, titulo=args.titulo, dpi=args.dpi)
+        print("\n" + "=" * 60)
+        if incluidas:
+            print(f"📖 Cuadernillo: {args.cuadernillo} ({len(incluidas)} rutas, "
+                  f"{os.path.getsize(args.cuadernillo) / 1024 / 1024:.1f} MB)")
+        print(f"⏱️  {time.perf_counter() - inicio:.1f} s, ❌ {len(errores)} rutas con errores")
+        print("=" * 60)
+        return 0 if incluidas and not errores else 1
+
+    repetidos = codigos_repetidos(rutas)
+    if repetidos:
+        print(f"❌ Códigos de ruta repetidos (sus PDF se pisarían): {', '.join(repetidos)}")
+        return 1
+
+    inicio = time.perf_counter()
+    filas = generar_lote(rutas, args.salida, procesos=args.procesos, dpi=args.dpi)
+    duracion = time.perf_counter() - inicio
+
+    ruta_resumen = os.path.join(args.salida, 'resumen_lote.csv')
+    escribir_resumen(filas, ruta_resumen)
+
+    correctas = [f for f in filas if f['estado'] == 'ok']
+    print("\n" + "=" * 60)
+    print(f"✅ {len(correctas)} generadas, ❌ {len(filas) - len(correctas)} con errores")
+    print(f"⏱️  {duracion:.1f} s en total, {sum(f['bytes'] for f in correctas) / 1024 / 1024:.1f} MB escritos")
+    print(f"📄 Resumen: {ruta_resumen}")
+    print("=" * 60)
+    return 0 if len(correctas) == len(filas) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
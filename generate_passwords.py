@@ -3,11 +3,11 @@ Script para generar contraseñas hasheadas para el sistema de autenticación.
 Ejecuta este script para crear nuevas contraseñas hasheadas que puedas añadir a config.yaml
 """
 
-import streamlit_authenticator as stauth
+from topoguia.credenciales import hashear_password
 
 def generar_password_hash(password):
     """Genera un hash bcrypt de la contraseña"""
-    return stauth.Hasher([password]).generate()[0]
+    return hashear_password(password)
 
 if __name__ == "__main__":
     print("=== Generador de Contraseñas Hasheadas ===\n")
@@ -35,4 +35,4 @@ if __name__ == "__main__":
         print(f"Hash: {custom_hash}")
         print("\nCopia este hash al archivo config.yaml")
     
-    print("\n=== Fin ===\")
+    print("\n=== Fin ===")
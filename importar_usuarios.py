@@ -0,0 +1,50 @@
+"""
+Importa los usuarios de un config.yaml a un almacén de credenciales.
+
+    python importar_usuarios.py config.yaml sqlite://usuarios.db [--hashear]
+
+Después arranca la aplicación con TOPOGUIA_CREDENCIALES apuntando al mismo
+almacén. Los usuarios que ya existan se actualizan con los datos del YAML.
+"""
+
+import argparse
+import sys
+
+import yaml
+
+from topoguia.credenciales import abrir_almacen, hashear_password, sin_hashear
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa los usuarios de config.yaml a un almacén de credenciales")
+    parser.add_argument('config', help="Archivo YAML con la sección credentials")
+    parser.add_argument('destino', help="URL del almacén, p. ej. sqlite://usuarios.db")
+    parser.add_argument('--hashear', action='store_true',
+                        help="Hashea antes las contraseñas que estén en texto plano")
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    pendientes = sin_hashear(config)
+    if pendientes and not args.hashear:
+        print(f"❌ Contraseñas sin hashear: {', '.join(pendientes)}. Usa --hashear")
+        return 1
+    usuarios = config['credentials']['usernames']
+    for usuario in pendientes:
+        usuarios[usuario]['password'] = hashear_password(str(usuarios[usuario]['password']))
+        print(f"🔒 Contraseña de '{usuario}' hasheada")
+
+    try:
+        almacen = abrir_almacen(args.destino)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    importados = almacen.importar_config(config)
+    print(f"✅ {importados} usuario(s) importados; el almacén tiene {almacen.contar_usuarios()}")
+    print(f"\n   Arranca con: TOPOGUIA_CREDENCIALES={args.destino} streamlit run app.py")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
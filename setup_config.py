@@ -1,68 +1,98 @@
 """
 Script para crear el archivo config.yaml con contraseñas hasheadas correctamente.
 Ejecuta este script ANTES de iniciar la aplicación por primera vez.
+
+Es el único paso que ejecuta bcrypt: la aplicación solo lee config.yaml y
+rechaza contraseñas en texto plano. Si has escrito alguna a mano en
+config.yaml, hashéalas con:
+
+    python setup_config.py --hashear
 """
 
-import streamlit_authenticator as stauth
+import argparse
+import os
+import sys
+
 import yaml
 
-print("=" * 60)
-print("GENERADOR DE CONFIG.YAML PARA TOPOGUÍAS")
-print("=" * 60)
-
-# Generar hashes para las contraseñas por defecto
-print("\n📝 Generando hashes para contraseñas por defecto...")
-passwords = ['admin123', 'demo123']
-hashed_passwords = stauth.Hasher(passwords).generate()
-
-print(f"✅ Hash para 'admin123': {hashed_passwords[0][:50]}...")
-print(f"✅ Hash para 'demo123': {hashed_passwords[1][:50]}...")
-
-# Crear estructura del config
-config = {
-    'credentials': {
-        'usernames': {
-            'admin': {
-                'email': 'admin@topoguias.es',
-                'name': 'Administrador',
-                'password': hashed_passwords[0]
-            },
-            'usuario1': {
-                'email': 'usuario1@example.com',
-                'name': 'Usuario Demo',
-                'password': hashed_passwords[1]
-            }
-        }
-    },
-    'cookie': {
-        'expiry_days': 30,
-        'key': 'cambiar_esta_clave_en_produccion_por_una_unica_12345',
-        'name': 'topoguias_auth_cookie'
-    },
-    'preauthorized': {
-        'emails': []
-    }
-}
-
-# Guardar a archivo
-print("\n💾 Guardando config.yaml...")
-with open('config.yaml', 'w', encoding='utf-8') as file:
-    yaml.dump(config, file, default_flow_style=False, allow_unicode=True)
-
-print("✅ Archivo config.yaml creado exitosamente!")
-print("\n" + "=" * 60)
-print("CREDENCIALES DE ACCESO:")
-print("=" * 60)
-print("\n👤 Usuario 1:")
-print("   Usuario: admin")
-print("   Contraseña: admin123")
-print("\n👤 Usuario 2:")
-print("   Usuario: usuario1")
-print("   Contraseña: demo123")
-print("\n" + "=" * 60)
-print("\n⚠️  IMPORTANTE:")
-print("   1. Cambia estas contraseñas en producción")
-print("   2. Cambia la 'key' del cookie por una única")
-print("   3. Ejecuta: python generate_passwords.py para nuevas contraseñas")
-print("\n✅ Ya puedes ejecutar: streamlit run app.py")
-print("=" * 60)
+from topoguia.credenciales import (
+    RUTA_CONFIG, config_por_defecto, guardar_config, hashear_password, sin_hashear,
+)
+
+
+def crear_config():
+    """Crea config.yaml con los usuarios por defecto y una clave de cookie aleatoria"""
+    # Generar hashes para las contraseñas por defecto
+    print("\n📝 Generando hashes para contraseñas por defecto...")
+    passwords = {'admin': 'admin123', 'usuario1': 'demo123'}
+    config = config_por_defecto()
+    for usuario, password in passwords.items():
+        config['credentials']['usernames'][usuario]['password'] = hashear_password(password)
+        print(f"✅ Hash para '{password}': {config['credentials']['usernames'][usuario]['password'][:50]}...")
+
+    # Guardar a archivo
+    print(f"\n💾 Guardando {RUTA_CONFIG}...")
+    guardar_config(config)
+    print(f"✅ Archivo {RUTA_CONFIG} creado exitosamente!")
+    print("\n" + "=" * 60)
+    print("CREDENCIALES DE ACCESO:")
+    print("=" * 60)
+    print("\n👤 Usuario 1:")
+    print("   Usuario: admin")
+    print("   Contraseña: admin123")
+    print("\n👤 Usuario 2:")
+    print("   Usuario: usuario1")
+    print("   Contraseña: demo123")
+    print("\n" + "=" * 60)
+    print("\n⚠️  IMPORTANTE:")
+    print("   1. Cambia estas contraseñas en producción")
+    print("   2. La 'key' del cookie se ha generado aleatoriamente: no la compartas")
+    print("   3. Ejecuta: python generate_passwords.py para nuevas contraseñas")
+
+
+def hashear_config():
+    """Sustituye las contraseñas en texto plano de config.yaml por su hash bcrypt"""
+    with open(RUTA_CONFIG, encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    pendientes = sin_hashear(config)
+    if not pendientes:
+        print(f"✅ Todas las contraseñas de {RUTA_CONFIG} ya están hasheadas")
+        return
+
+    usuarios = config['credentials']['usernames']
+    for usuario in pendientes:
+        password = str(usuarios[usuario]['password'])
+        usuarios[usuario]['password'] = hashear_password(password)
+        print(f"🔒 Contraseña de '{usuario}' hasheada")
+    guardar_config(config)
+    print(f"✅ {RUTA_CONFIG} actualizado ({len(pendientes)} contraseña(s))")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=f"Crea {RUTA_CONFIG} o hashea sus contraseñas")
+    parser.add_argument('--hashear', action='store_true',
+                        help=f"Hashea las contraseñas en texto plano de un {RUTA_CONFIG} existente")
+    parser.add_argument('--forzar', action='store_true', help=f"Sobrescribe {RUTA_CONFIG} si ya existe")
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("GENERADOR DE CONFIG.YAML PARA TOPOGUÍAS")
+    print("=" * 60)
+
+    if args.hashear:
+        hashear_config()
+    elif os.path.exists(RUTA_CONFIG) and not args.forzar:
+        print(f"\n⚠️  {RUTA_CONFIG} ya existe. Usa --forzar para sobrescribirlo o --hashear")
+        print("   para hashear las contraseñas que hayas escrito en texto plano.")
+        return 1
+    else:
+        crear_config()
+
+    print("\n✅ Ya puedes ejecutar: streamlit run app.py")
+    print("=" * 60)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+Núcleo de generación de topoguías PR-GU.
+
+Módulos reutilizables por la aplicación Streamlit (`app.py`) y por otros
+puntos de entrada. Ninguno de ellos importa Streamlit.
+"""
@@ -0,0 +1,155 @@
+"""
+Almacén en disco de los PDFs generados, direccionado por contenido.
+
+Cada PDF se guarda una vez con el SHA-256 de sus bytes como nombre y la sesión
+solo conserva esa referencia: los bytes no viven en la memoria del servidor
+mientras el usuario sigue editando, y se leen de disco cuando pulsa descargar.
+Además, la clave de los datos de entrada (`pdf.clave_resultado`) apunta a la
+referencia, así que repetir una generación idéntica no vuelve a maquetar nada.
+
+El directorio se limita por tamaño y por antigüedad: se borran primero los
+PDFs que llevan más tiempo sin usarse. Leer un PDF renueva su fecha. Los
+directorios se crean al guardar el primer PDF, no al importar el módulo: un
+directorio inaccesible solo falla al generar, no al arrancar.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+
+from .cache import hash_contenido
+
+DIRECTORIO_ALMACEN = (
+    os.environ.get('TOPOGUIA_ALMACEN_PDF_DIR')
+    or os.environ.get('TOPOGUIA_CACHE_PDF_DIR')  # nombre anterior de la opción
+    or os.path.join(tempfile.gettempdir(), 'topoguias_pdf')
+)
+# Unos 50 PDFs de 2-3 MB: en contenedores el directorio temporal suele ser un tmpfs (RAM)
+ALMACEN_PDF_MB = int(os.environ.get('TOPOGUIA_ALMACEN_PDF_MB', '128'))
+ALMACEN_PDF_HORAS = float(os.environ.get('TOPOGUIA_ALMACEN_PDF_HORAS', '24'))
+
+_PATRON_REFERENCIA = re.compile(r'^[0-9a-f]{64}$')
+
+
+class AlmacenPDF:
+    """PDFs en `directorio/objetos/<ab>/<sha256>.pdf` y alias `directorio/claves/<clave>`"""
+
+    def __init__(self, directorio, max_bytes, max_edad):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.max_edad = max_edad
+        self._objetos = os.path.join(directorio, 'objetos')
+        self._claves = os.path.join(directorio, 'claves')
+        self._lock = threading.Lock()
+
+    def ruta(self, referencia):
+        """Ruta del PDF de `referencia`, o None si la referencia no es válida o ya no existe"""
+        if not isinstance(referencia, str) or not _PATRON_REFERENCIA.match(referencia):
+            return None
+        ruta = os.path.join(self._objetos, referencia[:2], f'{referencia}.pdf')
+        return ruta if os.path.exists(ruta) else None
+
+    def guardar(self, datos, clave=None):
+        """Guarda `datos` (si no estaban ya) y devuelve su referencia; `clave` queda como alias"""
+        referencia = hash_contenido(datos)
+        ruta = os.path.join(self._objetos, referencia[:2], f'{referencia}.pdf')
+        if os.path.exists(ruta):
+            os.utime(ruta)
+        else:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            _escribir_atomico(ruta, datos)
+        if clave:
+            os.makedirs(self._claves, exist_ok=True)
+            _escribir_atomico(os.path.join(self._claves, clave), referencia.encode('ascii'))
+        self.recortar(conservar=ruta)
+        return referencia
+
+    def referencia_de(self, clave):
+        """Referencia guardada para la clave de entrada, si su PDF sigue en el almacén"""
+        try:
+            with open(os.path.join(self._claves, clave), encoding='ascii') as f:
+                referencia = f.read().strip()
+        except (FileNotFoundError, ValueError):
+            return None
+        return referencia if self.ruta(referencia) else None
+
+    def leer(self, referencia):
+        """Bytes del PDF (renovando su fecha de uso), o None si ya no está"""
+        ruta = self.ruta(referencia)
+        if ruta is None:
+            return None
+        try:
+            with open(ruta, 'rb') as f:
+                datos = f.read()
+            os.utime(ruta)
+        except FileNotFoundError:  # recortado por otra sesión entre medias
+            return None
+        return datos
+
+    def tamano(self, referencia):
+        ruta = self.ruta(referencia)
+        return os.path.getsize(ruta) if ruta else 0
+
+    def recortar(self, conservar=None):
+        """Borra los PDFs caducados y, si aún se pasa de tamaño, los usados hace más tiempo
+
+        `conservar` es la ruta de un PDF recién guardado, que nunca se borra.
+        """
+        with self._lock:
+            limite = time.time() - self.max_edad
+            objetos = []
+            for subdirectorio in _listar(self._objetos):
+                if not subdirectorio.is_dir():
+                    continue
+                for entrada in os.scandir(subdirectorio.path):
+                    if entrada.is_file() and entrada.name.endswith('.pdf'):
+                        info = entrada.stat()
+                        objetos.append((info.st_mtime, info.st_size, entrada.path))
+            total = sum(tamano for _, tamano, _ in objetos)
+            for fecha, tamano, ruta in sorted(objetos):
+                if fecha >= limite and total <= self.max_bytes:
+                    break
+                if ruta == conservar:
+                    continue
+                _borrar(ruta)
+                total -= tamano
+            # Los alias solo ocupan 64 bytes, pero tampoco se acumulan
+            for entrada in _listar(self._claves):
+                if entrada.is_file() and entrada.stat().st_mtime < limite:
+                    _borrar(entrada.path)
+
+    def estadisticas(self):
+        with self._lock:
+            tamanos = [
+                entrada.stat().st_size
+                for subdirectorio in _listar(self._objetos) if subdirectorio.is_dir()
+                for entrada in os.scandir(subdirectorio.path) if entrada.name.endswith('.pdf')
+            ]
+        return {'pdfs': len(tamanos), 'bytes_usados': sum(tamanos), 'max_bytes': self.max_bytes}
+
+
+def _escribir_atomico(ruta, datos):
+    """Escritura atómica: otra sesión nunca lee un archivo a medias"""
+    fd, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def _listar(directorio):
+    """Entradas del directorio, o ninguna si aún no se ha creado"""
+    try:
+        return list(os.scandir(directorio))
+    except FileNotFoundError:
+        return []
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+almacen_pdfs = AlmacenPDF(DIRECTORIO_ALMACEN, ALMACEN_PDF_MB * 1024 * 1024, ALMACEN_PDF_HORAS * 3600)
@@ -0,0 +1,90 @@
+"""
+Cachés compartidas por todas las sesiones del proceso.
+
+Streamlit atiende cada sesión en su propio hilo, así que todas las operaciones
+se protegen con un cerrojo. El cálculo de un valor ausente se hace fuera del
+cerrojo para no bloquear al resto de sesiones mientras tanto.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def hash_contenido(datos):
+    """Hash estable de unos bytes, usado como clave de caché"""
+    return hashlib.sha256(datos).hexdigest()
+
+
+class CacheLRU:
+    """Caché LRU limitada por memoria (bytes) y segura entre hilos
+
+    `medir` calcula el tamaño en bytes de cada valor. Un valor mayor que todo
+    el presupuesto no se guarda.
+    """
+
+    def __init__(self, max_bytes, medir=len):
+        self.max_bytes = max_bytes
+        self.medir = medir
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def __contains__(self, clave):
+        with self._lock:
+            return clave in self._entradas
+
+    def obtener(self, clave, defecto=None):
+        """Devuelve el valor guardado (marcándolo como reciente) o `defecto`"""
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave][0]
+            self.fallos += 1
+            return defecto
+
+    def guardar(self, clave, valor):
+        """Guarda un valor y expulsa los menos usados hasta respetar el presupuesto"""
+        tamano = self.medir(valor)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                self.bytes_usados -= self._entradas.pop(clave)[1]
+            self._entradas[clave] = (valor, tamano)
+            self.bytes_usados += tamano
+            while self.bytes_usados > self.max_bytes:
+                _, (_, tamano_expulsado) = self._entradas.popitem(last=False)
+                self.bytes_usados -= tamano_expulsado
+
+    def obtener_o_calcular(self, clave, calcular):
+        """Devuelve el valor de `clave`, calculándolo con `calcular()` si no está"""
+        valor = self.obtener(clave, _AUSENTE)
+        if valor is _AUSENTE:
+            valor = calcular()
+            self.guardar(clave, valor)
+        return valor
+
+    def vaciar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.bytes_usados = 0
+
+    def estadisticas(self):
+        """Contadores para mostrar en la interfaz o en los logs"""
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'bytes_usados': self.bytes_usados,
+                'max_bytes': self.max_bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+            }
+
+
+_AUSENTE = object()
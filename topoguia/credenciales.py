@@ -0,0 +1,335 @@
+"""
+Usuarios y contraseñas: config.yaml y almacenes de credenciales escalables.
+
+Streamlit vuelve a ejecutar app.py con cada interacción. En lugar de leer y
+validar el YAML en cada rerun, la configuración se guarda en memoria del
+proceso y solo se vuelve a leer cuando cambia la fecha de modificación (o el
+tamaño) del archivo. Las contraseñas tienen que llegar ya hasheadas: bcrypt es
+deliberadamente lento y se ejecuta una sola vez, en `setup_config.py`, nunca
+durante una petición.
+
+Con cientos o miles de usuarios, config.yaml deja de escalar: cada rerun
+copiaría el diccionario entero. Para eso están los almacenes de credenciales
+(`abrir_almacen`), que consultan un único usuario por su nombre. El primero es
+SQLite. La comprobación de la contraseña se hace en un pool pequeño de hilos y,
+tras un login correcto, la sesión guarda un token firmado con HMAC: los reruns
+siguientes solo verifican la firma, sin bcrypt.
+"""
+import copy
+from abc import ABC, abstractmethod
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import bcrypt
+import yaml
+
+RUTA_CONFIG = 'config.yaml'
+COSTE_BCRYPT = 12
+# Almacén de credenciales, p. ej. sqlite:///var/lib/topoguias/usuarios.db (vacío: config.yaml)
+URL_CREDENCIALES = os.environ.get('TOPOGUIA_CREDENCIALES', '')
+HILOS_BCRYPT = int(os.environ.get('TOPOGUIA_HILOS_BCRYPT', '2'))
+DURACION_SESION = int(os.environ.get('TOPOGUIA_DURACION_SESION_H', '12')) * 3600
+
+# Hashes precalculados de las contraseñas de demostración (admin123 y demo123),
+# para crear la configuración inicial sin ejecutar bcrypt en la aplicación
+USUARIOS_DEMO = {
+    'admin': {
+        'email': 'admin@topoguias.es',
+        'name': 'Administrador',
+        'password': '$2b$12$Ncyt84jsLb7zbzoFyGRaPuMI4JDOudr1Q70CJG3V/0Hp3SvvZWQjq',
+    },
+    'usuario1': {
+        'email': 'usuario1@example.com',
+        'name': 'Usuario Demo',
+        'password': '$2b$12$zEW7nyOBDWwetdBBXulbEuJqj5pH4I6A0nqvIFyGd1RBIbZcjJUX6',
+    },
+}
+
+_PATRON_BCRYPT = re.compile(r'^\$2[aby]\$\d+\$.{53}$')
+_configs = {}
+_lock = threading.Lock()
+
+
+class ConfigInvalida(ValueError):
+    """config.yaml no tiene la estructura esperada o guarda contraseñas sin hashear"""
+
+
+def hashear_password(password, coste=COSTE_BCRYPT):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(coste)).decode('utf-8')
+
+
+def es_hash(valor):
+    return isinstance(valor, str) and bool(_PATRON_BCRYPT.match(valor))
+
+
+def config_por_defecto(usuarios=None):
+    """Estructura de config.yaml con una clave de cookie aleatoria"""
+    return {
+        'credentials': {'usernames': copy.deepcopy(usuarios or USUARIOS_DEMO)},
+        'cookie': {
+            'expiry_days': 30,
+            'key': secrets.token_hex(32),
+            'name': 'topoguias_auth_cookie',
+        },
+        'preauthorized': {'emails': []},
+    }
+
+
+def guardar_config(config, ruta=RUTA_CONFIG):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        yaml.dump(config, f, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+
+def sin_hashear(config):
+    """Usuarios cuya contraseña está en texto plano"""
+    usuarios = (config.get('credentials') or {}).get('usernames') or {}
+    return [u for u, datos in usuarios.items() if not es_hash((datos or {}).get('password'))]
+
+
+def _validar(config):
+    if not isinstance(config, dict) or not isinstance(config.get('credentials'), dict):
+        raise ConfigInvalida("falta la sección 'credentials'")
+    cookie = config.get('cookie') or {}
+    for clave in ('name', 'key', 'expiry_days'):
+        if clave not in cookie:
+            raise ConfigInvalida(f"falta 'cookie.{clave}'")
+    pendientes = sin_hashear(config)
+    if pendientes:
+        raise ConfigInvalida(
+            f"contraseñas sin hashear para {', '.join(pendientes)}: "
+            "ejecuta `python setup_config.py --hashear`"
+        )
+
+
+def cargar_config(ruta=RUTA_CONFIG):
+    """Devuelve una copia de la configuración, leyendo el archivo solo si ha cambiado
+
+    Lanza FileNotFoundError si no existe y ConfigInvalida si no es utilizable.
+    Se devuelve una copia porque streamlit-authenticator modifica las
+    credenciales que recibe (intentos fallidos, sesión iniciada...).
+    """
+    info = os.stat(ruta)
+    firma = (info.st_mtime_ns, info.st_size)
+    with _lock:
+        guardada = _configs.get(ruta)
+    if guardada is None or guardada[0] != firma:
+        with open(ruta, encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+        _validar(config)
+        guardada = (firma, config)
+        with _lock:
+            _configs[ruta] = guardada
+    return copy.deepcopy(guardada[1])
+
+
+# --- Almacenes de credenciales ---
+
+class AlmacenCredenciales(ABC):
+    """Interfaz de un almacén de usuarios consultable por nombre de usuario
+
+    Los usuarios se devuelven como diccionarios con las claves usuario, nombre,
+    email, password (hash bcrypt) y roles. Los nombres de usuario se guardan en
+    minúsculas, como hace streamlit-authenticator.
+    """
+
+    @abstractmethod
+    def obtener_usuario(self, usuario):
+        ...
+
+    @abstractmethod
+    def guardar_usuario(self, usuario, nombre, email, password, roles=None):
+        ...
+
+    def guardar_usuarios(self, usuarios):
+        """Guarda tuplas (usuario, nombre, email, password, roles); los almacenes pueden agruparlas"""
+        for usuario in usuarios:
+            self.guardar_usuario(*usuario)
+
+    @abstractmethod
+    def eliminar_usuario(self, usuario):
+        ...
+
+    @abstractmethod
+    def contar_usuarios(self):
+        ...
+
+    @abstractmethod
+    def clave_sesion(self):
+        """Secreto con el que se firman los tokens de sesión"""
+
+    def importar_config(self, config):
+        """Copia los usuarios de una configuración de config.yaml y devuelve cuántos"""
+        pendientes = sin_hashear(config)
+        if pendientes:
+            raise ConfigInvalida(f"contraseñas sin hashear para {', '.join(pendientes)}")
+        usuarios = (config.get('credentials') or {}).get('usernames') or {}
+        self.guardar_usuarios(
+            (usuario, datos.get('name', ''), datos.get('email', ''), datos['password'], datos.get('roles'))
+            for usuario, datos in usuarios.items()
+        )
+        return len(usuarios)
+
+
+class AlmacenSqlite(AlmacenCredenciales):
+    """Usuarios en una base de datos SQLite indexada por nombre de usuario
+
+    Cada hilo usa su propia conexión. El modo WAL permite que las sesiones
+    lean mientras otra escribe.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._clave_sesion = None
+        with self._conexion() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute("""
+                CREATE TABLE IF NOT EXISTS usuarios (
+                    usuario TEXT PRIMARY KEY,
+                    nombre TEXT NOT NULL DEFAULT '',
+                    email TEXT NOT NULL DEFAULT '',
+                    password TEXT NOT NULL,
+                    roles TEXT,
+                    actualizado REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conexion.execute('CREATE TABLE IF NOT EXISTS ajustes (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)')
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=10)
+            conexion.row_factory = sqlite3.Row
+            self._local.conexion = conexion
+        return conexion
+
+    def obtener_usuario(self, usuario):
+        fila = self._conexion().execute(
+            'SELECT usuario, nombre, email, password, roles FROM usuarios WHERE usuario = ?',
+            (str(usuario).lower(),),
+        ).fetchone()
+        if fila is None:
+            return None
+        datos = dict(fila)
+        datos['roles'] = json.loads(datos['roles']) if datos['roles'] else None
+        return datos
+
+    def guardar_usuario(self, usuario, nombre, email, password, roles=None):
+        self.guardar_usuarios([(usuario, nombre, email, password, roles)])
+
+    def guardar_usuarios(self, usuarios):
+        filas = []
+        for usuario, nombre, email, password, roles in usuarios:
+            if not es_hash(password):
+                raise ConfigInvalida(f"la contraseña de '{usuario}' no es un hash bcrypt")
+            filas.append((str(usuario).lower(), nombre or '', email or '', password,
+                          json.dumps(roles) if roles else None, time.time()))
+        # Una sola transacción aunque se importen miles de usuarios
+        with self._conexion() as conexion:
+            conexion.executemany(
+                'INSERT OR REPLACE INTO usuarios (usuario, nombre, email, password, roles, actualizado) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                filas,
+            )
+
+    def eliminar_usuario(self, usuario):
+        with self._conexion() as conexion:
+            conexion.execute('DELETE FROM usuarios WHERE usuario = ?', (str(usuario).lower(),))
+
+    def contar_usuarios(self):
+        return self._conexion().execute('SELECT COUNT(*) FROM usuarios').fetchone()[0]
+
+    def clave_sesion(self):
+        """Se lee una vez por proceso: app.py la pide en cada rerun"""
+        if self._clave_sesion is None:
+            self._clave_sesion = self._leer_clave_sesion()
+            if self._clave_sesion is None:
+                with self._conexion() as conexion:
+                    # INSERT OR IGNORE: si dos procesos la crean a la vez, gana la primera
+                    conexion.execute('INSERT OR IGNORE INTO ajustes (clave, valor) VALUES (?, ?)',
+                                     ('clave_sesion', secrets.token_hex(32)))
+                self._clave_sesion = self._leer_clave_sesion()
+        return self._clave_sesion
+
+    def _leer_clave_sesion(self):
+        fila = self._conexion().execute("SELECT valor FROM ajustes WHERE clave = 'clave_sesion'").fetchone()
+        return fila[0] if fila else None
+
+
+# Esquemas de URL soportados por `abrir_almacen`
+ALMACENES = {
+    'sqlite': AlmacenSqlite,
+}
+
+
+@lru_cache(maxsize=None)
+def abrir_almacen(url):
+    """Almacén de credenciales de una URL (`sqlite:///ruta/usuarios.db`), uno por proceso"""
+    esquema, separador, ruta = url.partition('://')
+    if not separador or esquema not in ALMACENES:
+        raise ValueError(f"almacén de credenciales no soportado: {url!r} (esquemas: {', '.join(ALMACENES)})")
+    # sqlite:///ruta/absoluta y sqlite://ruta/relativa
+    return ALMACENES[esquema](ruta)
+
+
+def almacen_configurado():
+    """Almacén de TOPOGUIA_CREDENCIALES, o None si se usa config.yaml"""
+    return abrir_almacen(URL_CREDENCIALES) if URL_CREDENCIALES else None
+
+
+# --- Verificación de contraseñas y tokens de sesión ---
+
+_pool_bcrypt = ThreadPoolExecutor(max_workers=HILOS_BCRYPT, thread_name_prefix='topoguia-bcrypt')
+# Hash de una contraseña cualquiera: un usuario inexistente tarda lo mismo que uno real
+_HASH_SENUELO = USUARIOS_DEMO['usuario1']['password']
+
+
+def _comprobar_password(password, hash_guardado):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hash_guardado.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def verificar_credenciales(almacen, usuario, password):
+    """Datos del usuario si la contraseña es correcta; None en caso contrario
+
+    bcrypt se ejecuta en un pool de HILOS_BCRYPT hilos: libera el GIL, así que
+    el resto de sesiones siguen respondiendo, y el pool acota la CPU que puede
+    consumir una ráfaga de intentos de login.
+    """
+    datos = almacen.obtener_usuario(usuario) if usuario else None
+    hash_guardado = datos['password'] if datos else _HASH_SENUELO
+    correcta = _pool_bcrypt.submit(_comprobar_password, password or '', hash_guardado).result()
+    return datos if datos is not None and correcta else None
+
+
+def emitir_token(usuario, clave, duracion=DURACION_SESION):
+    """Token `usuario|caducidad|firma` firmado con HMAC-SHA256"""
+    carga = f"{usuario}|{int(time.time() + duracion)}"
+    firma = hmac.new(clave.encode('utf-8'), carga.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{carga}|{firma}"
+
+
+def validar_token(token, clave):
+    """Usuario del token si la firma es válida y no ha caducado; None en caso contrario"""
+    if not token:
+        return None
+    try:
+        usuario, caducidad, firma = token.rsplit('|', 2)
+        caducidad = int(caducidad)
+    except ValueError:
+        return None
+    esperada = hmac.new(clave.encode('utf-8'), f"{usuario}|{caducidad}".encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(firma, esperada) or caducidad < time.time():
+        return None
+    return usuario
@@ -0,0 +1,141 @@
+"""
+Fuentes TrueType de la topoguía, analizadas una sola vez por proceso.
+
+Con las fuentes core (Helvetica) fpdf2 solo admite windows-1252. Con una TTF
+el texto es Unicode, pero `add_font` analiza el archivo entero con fontTools
+cada vez (unos 50 ms por estilo) y el documento se queda con él: al generar el
+PDF fpdf2 recorta la fuente al subconjunto de glifos usados y la cierra.
+
+Aquí cada estilo se analiza una vez y sus métricas (anchos, cmap, descriptor)
+se comparten entre documentos. Cada documento recibe una copia ligera con su
+propio subconjunto y un TTFont perezoso abierto sobre los bytes en memoria,
+que es lo único que fpdf2 modifica al incrustar. Cada PDF incrusta solo los
+glifos que usa. La copia usa la estructura interna de `TTFFont` y `SubsetMap`
+de fpdf2 2.8, que no es API pública: requirements.txt fija esa versión menor.
+
+Se prefiere Liberation Sans, con las mismas métricas que Helvetica (la
+maquetación no cambia), y después DejaVu Sans. TOPOGUIA_FUENTES_DIR añade un
+directorio donde buscarlas antes que en los del sistema. Sin ninguna de las
+dos se usa Helvetica.
+"""
+import io
+import os
+import threading
+from dataclasses import dataclass
+
+from fontTools import ttLib
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap, TTFFont
+
+FAMILIA = 'TopoSans'
+FUENTE_CORE = 'Helvetica'
+ESTILOS = ('', 'B', 'I')
+
+# Familias por orden de preferencia. Si falta la cursiva se usa la regular.
+CANDIDATAS = (
+    {'': 'LiberationSans-Regular.ttf', 'B': 'LiberationSans-Bold.ttf', 'I': 'LiberationSans-Italic.ttf'},
+    {'': 'DejaVuSans.ttf', 'B': 'DejaVuSans-Bold.ttf', 'I': 'DejaVuSans-Oblique.ttf'},
+)
+
+DIRECTORIO_FUENTES = os.environ.get('TOPOGUIA_FUENTES_DIR')
+DIRECTORIOS_SISTEMA = (
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    os.path.expanduser('~/.local/share/fonts'),
+    os.path.expanduser('~/.fonts'),
+    '/Library/Fonts',
+    '/System/Library/Fonts',
+    os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+)
+
+
+@dataclass(frozen=True)
+class FuenteAnalizada:
+    """Estilo ya analizado: la fuente de fpdf2 que sirve de modelo y el archivo en memoria"""
+    modelo: TTFFont
+    datos: bytes
+
+
+_analizadas = None
+_lock = threading.Lock()
+
+
+def _indexar_archivos():
+    """Nombre de archivo -> ruta de todas las TTF de los directorios de fuentes"""
+    encontrados = {}
+    for raiz in (DIRECTORIO_FUENTES, *DIRECTORIOS_SISTEMA):
+        if not raiz or not os.path.isdir(raiz):
+            continue
+        for directorio, _, archivos in os.walk(raiz):
+            for archivo in archivos:
+                if archivo.lower().endswith('.ttf'):
+                    encontrados.setdefault(archivo, os.path.join(directorio, archivo))
+    return encontrados
+
+
+def rutas_fuentes():
+    """Ruta de cada estilo de la primera familia instalada (diccionario vacío si no hay ninguna)"""
+    encontrados = _indexar_archivos()
+    for familia in CANDIDATAS:
+        if familia[''] in encontrados:
+            regular = encontrados[familia['']]
+            return {estilo: encontrados.get(familia[estilo], regular) for estilo in ESTILOS}
+    return {}
+
+
+def _analizar(ruta, estilo):
+    with open(ruta, 'rb') as f:
+        datos = f.read()
+    # El documento auxiliar solo sirve para construir la fuente
+    modelo = TTFFont(FPDF(), ruta, f'{FAMILIA.lower()}{estilo}', estilo)
+    modelo.close()
+    return FuenteAnalizada(modelo, datos)
+
+
+def fuentes_analizadas():
+    """Estilos analizados de la familia TTF, la primera vez que se piden en el proceso"""
+    global _analizadas
+    if _analizadas is None:
+        with _lock:
+            if _analizadas is None:
+                _analizadas = {estilo: _analizar(ruta, estilo) for estilo, ruta in rutas_fuentes().items()}
+    return _analizadas
+
+
+def nombre_fuente():
+    """Archivo de la fuente regular en uso (o Helvetica), para las claves de caché de PDFs"""
+    analizadas = fuentes_analizadas()
+    return os.path.basename(analizadas[''].modelo.ttffile) if analizadas else FUENTE_CORE
+
+
+def _copia_para(pdf, analizada):
+    """Fuente para un documento: comparte las métricas y tiene su propio subconjunto"""
+    modelo = analizada.modelo
+    fuente = TTFFont.__new__(TTFFont)
+    for atributo in TTFFont.__slots__:
+        if hasattr(modelo, atributo):  # fpdf2 no rellena todos los slots
+            setattr(fuente, atributo, getattr(modelo, atributo))
+    fuente.i = len(pdf.fonts) + 1
+    # fpdf2 recorta y cierra el TTFont al generar el PDF: cada documento abre el
+    # suyo sobre los bytes en memoria (perezoso, solo lee el índice de tablas)
+    fuente.ttfont = ttLib.TTFont(
+        io.BytesIO(analizada.datos), recalcTimestamp=False, lazy=True,
+        fontNumber=modelo.collection_font_number,
+    )
+    fuente._hbfont = None
+    fuente.missing_glyphs = []
+    fuente.biggest_size_pt = 0
+    fuente.subset = SubsetMap(fuente)
+    return fuente
+
+
+def registrar_fuentes(pdf):
+    """Añade la familia TTF a `pdf` sin volver a analizarla; devuelve la familia para `set_font`"""
+    analizadas = fuentes_analizadas()
+    if not analizadas:
+        return FUENTE_CORE
+    for estilo, analizada in analizadas.items():
+        clave = f'{FAMILIA.lower()}{estilo}'
+        if clave not in pdf.fonts:
+            pdf.fonts[clave] = _copia_para(pdf, analizada)
+    return FAMILIA
@@ -0,0 +1,193 @@
+"""
+Preprocesado de imágenes antes de incrustarlas en el PDF.
+
+Cada imagen se remuestrea a los píxeles que necesita la caja (en mm) donde se
+dibuja, según la resolución de impresión elegida, y se recomprime con Pillow:
+JPEG para fotografías y PNG con paleta para dibujos de líneas como la tabla MIDE.
+"""
+import io
+import logging
+import os
+from dataclasses import dataclass
+
+from PIL import Image
+
+from .cache import CacheLRU, hash_contenido
+
+logger = logging.getLogger(__name__)
+
+MM_POR_PULGADA = 25.4
+DPI_POR_DEFECTO = 200
+CALIDAD_JPEG = 85
+MAX_COLORES_LINEAL = 256
+
+# Caja (ancho, alto) en mm donde se dibuja cada imagen del folleto.
+# None indica que esa dimensión se calcula manteniendo la proporción.
+CAJAS_IMAGEN = {
+    'logo': (None, 15),
+    'banner': (259, 80),
+    'mapa': (180, 110),
+    'perfil': (180, 45),
+    'mide': (92, None),
+}
+
+# Tipo de contenido conocido de antemano; el resto se detecta automáticamente
+TIPOS_IMAGEN = {
+    'mide': 'lineal',
+}
+
+# Imágenes ya procesadas, compartidas por todas las sesiones del proceso
+CACHE_IMAGENES_MB = int(os.environ.get('TOPOGUIA_CACHE_IMAGENES_MB', '256'))
+cache_imagenes = CacheLRU(CACHE_IMAGENES_MB * 1024 * 1024, medir=lambda p: len(p.datos))
+
+# Miniaturas para la vista previa de la interfaz, por hash del contenido
+ANCHO_MINIATURA = 640
+cache_miniaturas = CacheLRU(32 * 1024 * 1024)
+
+
+@dataclass
+class ImagenPreparada:
+    """Imagen lista para incrustar y estadísticas de la optimización"""
+    datos: bytes
+    formato: str
+    bytes_originales: int
+    px_originales: tuple
+    px_finales: tuple
+
+    @property
+    def bytes_ahorrados(self):
+        return max(self.bytes_originales - len(self.datos), 0)
+
+    def resumen(self):
+        """Texto breve con el ahorro conseguido"""
+        return (
+            f"{self.px_originales[0]}x{self.px_originales[1]} → "
+            f"{self.px_finales[0]}x{self.px_finales[1]} px, "
+            f"{self.bytes_originales / 1024:.0f} KB → {len(self.datos) / 1024:.0f} KB "
+            f"({self.formato})"
+        )
+
+
+def pixeles_necesarios(tamano, ancho_mm, alto_mm, dpi):
+    """Calcula los píxeles que necesita una imagen para su caja sin ampliarla nunca"""
+    ancho, alto = tamano
+    escalas = []
+    if ancho_mm:
+        escalas.append(ancho_mm / MM_POR_PULGADA * dpi / ancho)
+    if alto_mm:
+        escalas.append(alto_mm / MM_POR_PULGADA * dpi / alto)
+    # Si la caja fija ancho y alto, la imagen se estira: manda la dimensión más exigente
+    escala = min(max(escalas), 1.0) if escalas else 1.0
+    return max(1, round(ancho * escala)), max(1, round(alto * escala))
+
+
+def _tiene_transparencia(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+
+def _es_lineal(img):
+    """Detecta dibujos de líneas: pocos colores distintos en una muestra reducida"""
+    if img.mode in ('1', 'P'):
+        return True
+    muestra = img.copy()
+    muestra.thumbnail((256, 256), Image.Resampling.NEAREST)
+    return muestra.getcolors(MAX_COLORES_LINEAL) is not None
+
+
+def leer_origen(archivo):
+    """Devuelve bytes o una imagen Pillow a partir de un UploadedFile, BytesIO, bytes o Image"""
+    if isinstance(archivo, (bytes, Image.Image)):
+        return archivo
+    return archivo.getvalue()
+
+
+def preparar_imagen(datos, ancho_mm=None, alto_mm=None, dpi=DPI_POR_DEFECTO, tipo=None):
+    """
+    Remuestrea y recomprime una imagen para la caja donde se va a dibujar.
+
+    `datos` son los bytes de un JPEG/PNG o una imagen Pillow ya decodificada.
+    `tipo` puede ser 'foto', 'lineal' o None para detectarlo automáticamente.
+    Si la recompresión no reduce el tamaño se conservan los bytes originales.
+    """
+    if isinstance(datos, Image.Image):
+        img = datos
+        datos = b''
+        formato_original = None
+    else:
+        img = Image.open(io.BytesIO(datos))
+        formato_original = img.format
+    px_originales = img.size
+    # Para imágenes ya decodificadas el tamaño de partida es el mapa de bits sin comprimir
+    bytes_originales = len(datos) or len(img.getbands()) * px_originales[0] * px_originales[1]
+    px_finales = pixeles_necesarios(img.size, ancho_mm, alto_mm, dpi)
+
+    if tipo is None:
+        tipo = 'lineal' if _es_lineal(img) else 'foto'
+
+    if img.mode == 'P':
+        img = img.convert('RGBA' if _tiene_transparencia(img) else 'RGB')
+    if px_finales != img.size:
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGB')
+        img = img.resize(px_finales, Image.Resampling.LANCZOS)
+
+    salida = io.BytesIO()
+    if _tiene_transparencia(img):
+        # Logos con fondo transparente: PNG sin pérdida conservando el canal alfa
+        img.convert('RGBA').save(salida, format='PNG', optimize=True)
+        formato = 'PNG'
+    elif tipo == 'lineal':
+        img.convert('RGB').quantize(MAX_COLORES_LINEAL).save(salida, format='PNG', optimize=True)
+        formato = 'PNG'
+    else:
+        img.convert('RGB').save(salida, format='JPEG', quality=CALIDAD_JPEG, optimize=True)
+        formato = 'JPEG'
+
+    if px_finales == px_originales and salida.tell() >= len(datos) and formato_original in ('JPEG', 'PNG'):
+        preparada = ImagenPreparada(datos, formato_original, bytes_originales, px_originales, px_originales)
+    else:
+        preparada = ImagenPreparada(salida.getvalue(), formato, bytes_originales, px_originales, px_finales)
+
+    logger.info("Imagen preparada: %s, ahorro %d KB", preparada.resumen(), preparada.bytes_ahorrados // 1024)
+    return preparada
+
+
+def preparar_para_caja(clave, archivo, dpi=DPI_POR_DEFECTO, huella=None):
+    """Prepara la imagen de una de las cajas conocidas del folleto (ver CAJAS_IMAGEN)
+
+    Las subidas en bytes se buscan primero en `cache_imagenes`, por hash del
+    contenido, caja y resolución: el mismo logo subido por distintos usuarios
+    solo se decodifica y recomprime una vez. `huella` es ese hash, si quien
+    llama ya lo ha calculado.
+    """
+    ancho_mm, alto_mm = CAJAS_IMAGEN[clave]
+    tipo = TIPOS_IMAGEN.get(clave)
+    origen = leer_origen(archivo)
+    if isinstance(origen, Image.Image):
+        return preparar_imagen(origen, ancho_mm, alto_mm, dpi, tipo)
+    clave_cache = (huella or hash_contenido(origen), ancho_mm, alto_mm, dpi, tipo)
+    return cache_imagenes.obtener_o_calcular(
+        clave_cache, lambda: preparar_imagen(origen, ancho_mm, alto_mm, dpi, tipo)
+    )
+
+
+def crear_miniatura(datos, ancho_px=ANCHO_MINIATURA):
+    """Miniatura ligera (JPEG, o PNG si hay transparencia) para previsualizar una subida"""
+    img = Image.open(io.BytesIO(datos))
+    # En JPEG, draft() decodifica directamente a escala reducida: mucho más rápido
+    img.draft('RGB', (ancho_px, ancho_px))
+    img.thumbnail((ancho_px, ancho_px * 4), Image.Resampling.LANCZOS)
+
+    salida = io.BytesIO()
+    if _tiene_transparencia(img):
+        img.convert('RGBA').save(salida, format='PNG', optimize=True)
+    else:
+        img.convert('RGB').save(salida, format='JPEG', quality=80)
+    return salida.getvalue()
+
+
+def miniatura_cacheada(huella, leer_datos, ancho_px=ANCHO_MINIATURA):
+    """Miniatura de la imagen con hash `huella`; `leer_datos()` solo se llama si no está en caché"""
+    return cache_miniaturas.obtener_o_calcular(
+        (huella, ancho_px), lambda: crear_miniatura(leer_datos(), ancho_px)
+    )
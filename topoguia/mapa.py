@@ -0,0 +1,281 @@
+"""
+Mapa topográfico compuesto a partir de un almacén local de teselas MBTiles.
+
+Sustituye a la imagen del mapa cuando hay track y TOPOGUIA_MBTILES apunta a un
+MBTiles ráster (SQLite con teselas PNG/JPEG/WebP). Se elige el zoom con el que
+el track, más un margen, cabe en la caja del mapa a los ppp del PDF, se leen de
+una sola consulta las teselas que tocan la caja y se pegan en una imagen del
+tamaño exacto de la caja. Todo es local: no se descarga nada.
+
+Las teselas decodificadas se guardan en una caché LRU del proceso, así que al
+generar en lote varias rutas de la misma sierra solo se decodifican una vez.
+El recorrido no se pinta en la imagen: se simplifica (Ramer-Douglas-Peucker)
+a lo que se distingue impreso y se traza como línea vectorial del PDF.
+"""
+import io
+import math
+import os
+import pathlib
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from .cache import CacheLRU, hash_contenido
+from .imagenes import CAJAS_IMAGEN, CALIDAD_JPEG, MM_POR_PULGADA, leer_origen
+from .maqueta import VERDE
+from .traza import leer_traza_cacheada
+
+# Fracción de la caja que se deja libre alrededor del track por cada lado
+MARGEN_MAPA = 0.08
+TOLERANCIA_TRAZADO_MM = 0.1
+FONDO_SIN_TESELA = (235, 235, 235)
+AMARILLO_TRAZADO = (255, 205, 0)
+LATITUD_MAXIMA = 85.05112878  # límite de la proyección Web Mercator
+
+# Teselas decodificadas por (almacén, zoom, columna, fila), compartidas por todas las sesiones
+CACHE_TESELAS_MB = int(os.environ.get('TOPOGUIA_CACHE_TESELAS_MB', '128'))
+cache_teselas = CacheLRU(
+    CACHE_TESELAS_MB * 1024 * 1024,
+    medir=lambda img: img.width * img.height * len(img.getbands()),
+)
+
+# Mapas ya compuestos por (hash del track, ppp, almacén)
+cache_mapas = CacheLRU(64 * 1024 * 1024, medir=lambda m: len(m.imagen) + 16 * len(m.trazado))
+
+_almacenes = {}
+_lock_almacenes = threading.Lock()
+
+
+@dataclass(frozen=True)
+class MapaTeselas:
+    """Mapa listo para la caja: la imagen y el recorrido en mm desde su esquina"""
+    imagen: bytes  # JPEG con los píxeles exactos de la caja
+    trazado: tuple  # vértices (x, y) en mm
+    atribucion: str
+    zoom: int
+
+
+def _decodificar(datos):
+    """Tesela en RGB; las transparentes se apoyan sobre blanco"""
+    img = Image.open(io.BytesIO(datos))
+    img.load()
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        fondo = Image.new('RGB', img.size, 'white')
+        fondo.paste(img.convert('RGBA'), mask=img.convert('RGBA'))
+        return fondo
+    return img.convert('RGB')
+
+
+class AlmacenTeselas:
+    """MBTiles ráster abierto en solo lectura
+
+    Las filas de un MBTiles siguen el esquema TMS (la 0 es la del sur); aquí
+    se trabaja con filas XYZ (la 0 es la del norte) y se invierten al consultar.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.clave = (os.path.abspath(ruta), os.path.getmtime(ruta))
+        self._lock = threading.Lock()
+        try:
+            uri = pathlib.Path(ruta).absolute().as_uri() + '?mode=ro'
+            self._conexion = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            try:
+                metadatos = dict(self._conexion.execute('SELECT name, value FROM metadata'))
+            except sqlite3.OperationalError:
+                metadatos = {}
+            minimo, maximo = self._conexion.execute(
+                'SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles').fetchone()
+            if maximo is not None:
+                muestra = self._conexion.execute(
+                    'SELECT tile_data FROM tiles WHERE zoom_level = ? LIMIT 1', (maximo,)).fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"{ruta} no es un MBTiles válido: {e}") from e
+        if maximo is None:
+            raise ValueError(f"{ruta} no contiene teselas")
+        if str(metadatos.get('format', '')).lower() == 'pbf':
+            raise ValueError(f"{ruta} es un MBTiles vectorial; solo se admiten teselas ráster")
+        self.zoom_minimo, self.zoom_maximo = int(minimo), int(maximo)
+        self.tamano_tesela = _decodificar(muestra).width
+        self.atribucion = re.sub(r'<[^>]+>', '', str(metadatos.get('attribution', ''))).strip()
+
+    def teselas(self, zoom, x0, x1, y0, y1):
+        """Teselas decodificadas del rango de columnas y filas (XYZ) que existan, por (columna, fila)"""
+        encontradas, faltan = {}, False
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                img = cache_teselas.obtener((self.clave, zoom, x, y))
+                if img is None:
+                    faltan = True
+                else:
+                    encontradas[(x, y)] = img
+        if not faltan:
+            return encontradas
+        ultima = 2 ** zoom - 1
+        with self._lock:
+            filas = self._conexion.execute(
+                'SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level = ? '
+                'AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?',
+                (zoom, x0, x1, ultima - y1, ultima - y0),
+            ).fetchall()
+        for x, fila_tms, datos in filas:
+            y = ultima - fila_tms
+            if (x, y) not in encontradas:
+                encontradas[(x, y)] = img = _decodificar(datos)
+                cache_teselas.guardar((self.clave, zoom, x, y), img)
+        return encontradas
+
+
+def ruta_mbtiles():
+    """Ruta del MBTiles configurado en TOPOGUIA_MBTILES, o None si no hay o no existe"""
+    ruta = os.environ.get('TOPOGUIA_MBTILES')
+    return ruta if ruta and os.path.isfile(ruta) else None
+
+
+def hay_teselas():
+    """Indica si el mapa se puede componer a partir del track"""
+    return ruta_mbtiles() is not None
+
+
+def huella_teselas():
+    """(ruta absoluta, fecha de modificación) del MBTiles configurado, o None"""
+    ruta = ruta_mbtiles()
+    return (os.path.abspath(ruta), os.path.getmtime(ruta)) if ruta else None
+
+
+def almacen_teselas():
+    """Almacén de TOPOGUIA_MBTILES, abierto una vez por proceso (y de nuevo si el archivo cambia)"""
+    clave = huella_teselas()
+    if clave is None:
+        return None
+    with _lock_almacenes:
+        almacen = _almacenes.get(clave)
+        if almacen is None:
+            almacen = _almacenes[clave] = AlmacenTeselas(clave[0])
+        return almacen
+
+
+def _mercator(lat, lon):
+    """Coordenadas Web Mercator normalizadas: x e y entre 0 y 1, y creciendo hacia el sur"""
+    lat = np.radians(np.clip(lat, -LATITUD_MAXIMA, LATITUD_MAXIMA))
+    return (lon + 180) / 360, (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2
+
+
+def simplificar(x, y, tolerancia):
+    """Índices de los vértices que conserva Ramer-Douglas-Peucker con la tolerancia dada"""
+    total = len(x)
+    conservar = np.zeros(total, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pendientes = [(0, total - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+        dx, dy = x[fin] - x[inicio], y[fin] - y[inicio]
+        rx, ry = x[inicio + 1:fin] - x[inicio], y[inicio + 1:fin] - y[inicio]
+        longitud = math.hypot(dx, dy)
+        # En un tramo que vuelve a su origen (ruta circular) cuenta la distancia al punto
+        distancias = np.abs(dy * rx - dx * ry) / longitud if longitud else np.hypot(rx, ry)
+        mayor = int(np.argmax(distancias))
+        if distancias[mayor] > tolerancia:
+            medio = inicio + 1 + mayor
+            conservar[medio] = True
+            pendientes += [(inicio, medio), (medio, fin)]
+    return np.flatnonzero(conservar)
+
+
+def componer_mapa(traza, almacen, dpi, caja=CAJAS_IMAGEN['mapa']):
+    """Compone el mapa de una Traza para la caja (ancho, alto) en mm a los ppp indicados"""
+    ancho_mm, alto_mm = caja
+    ancho_px = round(ancho_mm / MM_POR_PULGADA * dpi)
+    alto_px = round(alto_mm / MM_POR_PULGADA * dpi)
+    tamano = almacen.tamano_tesela
+
+    x, y = _mercator(traza.lat, traza.lon)
+    centro_x, centro_y = (x.min() + x.max()) / 2, (y.min() + y.max()) / 2
+    # Unidades Mercator por mm: el track con su margen cabe en la caja, y nunca
+    # se acerca más de lo que dan las teselas del zoom máximo sin ampliarlas
+    util = 1 - 2 * MARGEN_MAPA
+    escala = max(
+        (x.max() - x.min()) / (ancho_mm * util),
+        (y.max() - y.min()) / (alto_mm * util),
+        ancho_px / ancho_mm / (tamano * 2 ** almacen.zoom_maximo),
+    )
+    # El primer zoom con al menos un píxel de tesela por píxel impreso
+    zoom_ideal = math.log2(ancho_px / (ancho_mm * escala * tamano))
+    zoom = min(max(math.ceil(zoom_ideal - 1e-6), almacen.zoom_minimo), almacen.zoom_maximo)
+
+    mundo = tamano * 2 ** zoom
+    izquierda = (centro_x - escala * ancho_mm / 2) * mundo
+    arriba = (centro_y - escala * alto_mm / 2) * mundo
+    ancho_fuente = max(1, round(escala * ancho_mm * mundo))
+    alto_fuente = max(1, round(escala * alto_mm * mundo))
+    origen_x, origen_y = math.floor(izquierda), math.floor(arriba)
+
+    ultima = 2 ** zoom - 1
+    x0, x1 = max(origen_x // tamano, 0), min((origen_x + ancho_fuente - 1) // tamano, ultima)
+    y0, y1 = max(origen_y // tamano, 0), min((origen_y + alto_fuente - 1) // tamano, ultima)
+    teselas = almacen.teselas(zoom, x0, x1, y0, y1)
+    if not teselas:
+        raise ValueError(f"El almacén de teselas no cubre la zona del track (zoom {zoom})")
+
+    lienzo = Image.new('RGB', (ancho_fuente, alto_fuente), FONDO_SIN_TESELA)
+    for (columna, fila), tesela in teselas.items():
+        if tesela.width != tamano:
+            tesela = tesela.resize((tamano, tamano), Image.Resampling.LANCZOS)
+        lienzo.paste(tesela, (columna * tamano - origen_x, fila * tamano - origen_y))
+    if lienzo.size != (ancho_px, alto_px):
+        lienzo = lienzo.resize((ancho_px, alto_px), Image.Resampling.LANCZOS)
+    salida = io.BytesIO()
+    lienzo.save(salida, 'JPEG', quality=CALIDAD_JPEG, optimize=True)
+
+    trazado_x = (x - centro_x) / escala + ancho_mm / 2
+    trazado_y = (y - centro_y) / escala + alto_mm / 2
+    elegidos = simplificar(trazado_x, trazado_y, TOLERANCIA_TRAZADO_MM)
+    trazado = tuple(zip(np.round(trazado_x[elegidos], 2).tolist(), np.round(trazado_y[elegidos], 2).tolist()))
+    return MapaTeselas(salida.getvalue(), trazado, almacen.atribucion, zoom)
+
+
+def mapa_de_track(archivo, dpi):
+    """Mapa de un track GPX/GeoJSON con las teselas de TOPOGUIA_MBTILES; se compone una vez por track y ppp
+
+    Devuelve None si no hay almacén de teselas. Lanza ValueError si el track no
+    se puede leer o el almacén no cubre su zona.
+    """
+    almacen = almacen_teselas()
+    if almacen is None:
+        return None
+    datos = leer_origen(archivo)
+    clave = (hash_contenido(datos), dpi, almacen.clave)
+    mapa = cache_mapas.obtener(clave)
+    if mapa is None:
+        mapa = componer_mapa(leer_traza_cacheada(datos), almacen, dpi)
+        cache_mapas.guardar(clave, mapa)
+    return mapa
+
+
+def dibujar_trazado(pdf, mapa, x, y, ancho, alto):
+    """Dibuja el recorrido (amarillo con borde negro), el inicio y la atribución sobre el mapa
+
+    `pdf` es un PDF_Landscape o el lienzo de la vista previa.
+    """
+    vertices = [(x + vx, y + vy) for vx, vy in mapa.trazado]
+    with pdf.local_context(stroke_join_style='round', stroke_cap_style='round'):
+        pdf.set_draw_color(0, 0, 0)
+        pdf.set_line_width(1.1)
+        pdf.polyline(vertices)
+        pdf.set_draw_color(*AMARILLO_TRAZADO)
+        pdf.set_line_width(0.6)
+        pdf.polyline(vertices)
+    inicio_x, inicio_y = vertices[0]
+    pdf.set_fill_color(*VERDE)
+    pdf.rect(inicio_x - 1.2, inicio_y - 1.2, 2.4, 2.4, 'F')
+    if mapa.atribucion:
+        pdf.set_font(pdf.familia, '', 5)
+        pdf.set_text_color(60, 60, 60)
+        pdf.set_xy(x, y + alto - 3)
+        pdf.cell(ancho - 1, 3, mapa.atribucion, align='R')
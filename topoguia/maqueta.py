@@ -0,0 +1,68 @@
+"""
+Coordenadas fijas (en mm) del diseño de la topoguía.
+
+Las comparten el PDF (`pdf.py`) y la vista previa (`vista_previa.py`): cambiar
+aquí una posición mueve el elemento en los dos sitios a la vez.
+"""
+
+# A4 horizontal
+ANCHO_PAGINA = 297
+ALTO_PAGINA = 210
+MARGEN = 10
+VERDE = (0, 122, 51)  # #007A33
+
+# --- Página 1 ---
+Y_BANNER = 25
+ALTO_BANNER = 80
+X_TEXTO = 15
+Y_TITULO = 110
+Y_PARRAFOS = Y_TITULO + 25
+ANCHO_COLUMNA = 180
+TAM_PARRAFO = 9
+ALTO_LINEA_PARRAFO = 4
+SEPARACION_PARRAFOS = 2
+Y_RECOM = 185
+ALTO_RECOM = 15
+Y_TEXTO_RECOM = Y_RECOM + 7
+TAM_RECOM = 8
+ALTO_LINEA_RECOM = 3.5
+# Límites del ajuste automático cuando el texto no cabe con el tamaño de diseño
+TAM_PARRAFO_MIN = 6.5
+ALTO_LINEA_PARRAFO_MIN = 2.7
+TAM_RECOM_MIN = 6
+ALTO_LINEA_RECOM_MIN = 2.4
+
+# --- Página 2 ---
+Y_PERFIL = 125
+X_PANEL = 195
+Y_PANEL = 10
+ANCHO_PANEL = 92
+Y_DATOS = Y_PANEL + 12
+ALTO_DATOS = 35
+Y_MIDE = Y_DATOS + 40
+ALTO_MIDE = 35
+ALTO_LINEA_PANEL = 3
+TEXTO_SENALIZACION = 'Marcas blancas y amarillas:\n• Continuidad\n• Cambio de dirección\n• Dirección equivocada'
+
+# Esquina superior izquierda de cada imagen; su tamaño está en imagenes.CAJAS_IMAGEN
+POSICIONES_IMAGEN = {
+    'logo': (MARGEN, 5),
+    'banner': (28, Y_BANNER),
+    'mapa': (MARGEN, MARGEN),
+    'perfil': (MARGEN, Y_PERFIL),
+    'mide': (X_PANEL, Y_MIDE),
+}
+
+
+def posiciones_panel(hay_mide):
+    """Y de las secciones del panel lateral de la página 2 (dependen de si hay MIDE)"""
+    y_mide = Y_MIDE + (ALTO_MIDE if hay_mide else 0)
+    y_consejos = y_mide + 28
+    y_telefonos = y_consejos + 28
+    return {
+        'senalizacion': y_mide + 5,
+        'consejos': y_consejos,
+        'telefonos': y_telefonos,
+        'qr': y_telefonos + 18,
+        'url': y_telefonos + 45,
+    }
@@ -0,0 +1,182 @@
+"""
+Ajuste automático del texto a su hueco en la maqueta.
+
+La descripción de la página 1 tiene sitio fijo entre el título y el recuadro de
+RECOMENDACIONES, y las recomendaciones el alto del recuadro. Si un texto no
+cabe con su tamaño de diseño, `ajustar_texto` busca (por bisección) el mayor
+tamaño de letra que cabe, manteniendo la proporción del interlineado; si ni el
+tamaño mínimo cabe, reduce después el interlineado hasta su mínimo.
+
+Para que la búsqueda tarde milisegundos, las líneas no se cortan con fpdf2 (que
+recorre el texto carácter a carácter) sino con el mismo criterio a partir del
+ancho de cada palabra. El ancho es proporcional al tamaño de letra, así que se
+mide una sola vez por fuente y palabra y queda en caché para todo el proceso,
+también entre las rutas de un lote.
+"""
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+
+from fpdf import FPDF
+
+from .fuentes import registrar_fuentes
+from .maqueta import (
+    ALTO_LINEA_PARRAFO, ALTO_LINEA_PARRAFO_MIN, ALTO_LINEA_RECOM, ALTO_LINEA_RECOM_MIN, ALTO_RECOM,
+    ANCHO_COLUMNA, SEPARACION_PARRAFOS, TAM_PARRAFO, TAM_PARRAFO_MIN, TAM_RECOM, TAM_RECOM_MIN,
+    Y_PARRAFOS, Y_RECOM, Y_TEXTO_RECOM,
+)
+
+# Tamaños en puntos; la bisección trabaja sobre múltiplos de PASO_TAMANO
+PASO_TAMANO = 0.25
+PASO_INTERLINEADO = 0.05  # mm por punto
+TAMANO_MEDIDA = 100  # las palabras se miden a este tamaño y se escalan
+
+_medidor = None
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Ajuste:
+    """Tamaño de letra (pt) e interlineado (mm) elegidos y alto (mm) que ocupa el texto"""
+    tam_pt: float
+    alto_linea: float
+    alto: float
+    cabe: bool
+
+
+def _documento_medidor():
+    global _medidor
+    if _medidor is None:
+        medidor = FPDF(orientation='L', unit='mm', format='A4')
+        medidor.core_fonts_encoding = 'windows-1252'
+        medidor.familia = registrar_fuentes(medidor)
+        _medidor = medidor
+    return _medidor
+
+
+@lru_cache(maxsize=20000)
+def _ancho_unitario(estilo, palabra):
+    """Ancho en mm de `palabra` a 1 pt con la fuente del PDF"""
+    with _lock:
+        medidor = _documento_medidor()
+        medidor.set_font(medidor.familia, estilo, TAMANO_MEDIDA)
+        return medidor.get_string_width(palabra) / TAMANO_MEDIDA
+
+
+def margen_celda():
+    """Margen interior (mm) que fpdf2 descuenta a cada lado de una celda"""
+    return _documento_medidor().c_margin
+
+
+def contar_lineas(texto, ancho, estilo, tam_pt):
+    """Líneas en que `multi_cell(ancho, ...)` parte `texto` con la fuente del PDF a `tam_pt`
+
+    Mismo criterio que fpdf2: se corta en el último espacio que cabe y una
+    palabra más ancha que la línea se parte por caracteres.
+    """
+    disponible = (ancho - 2 * margen_celda()) / tam_pt
+    espacio = _ancho_unitario(estilo, ' ')
+    total = 0
+    for renglon in texto.split('\n'):
+        lineas = 1
+        ocupado = None  # ancho de la línea en curso (None: línea vacía)
+        for palabra in renglon.split(' '):
+            ancho_palabra = _ancho_unitario(estilo, palabra)
+            if ocupado is not None:
+                if ocupado + espacio + ancho_palabra <= disponible:
+                    ocupado += espacio + ancho_palabra
+                    continue
+                # El espacio donde se corta no ocupa sitio en ninguna línea
+                lineas += 1
+                ocupado = None
+            if ancho_palabra <= disponible:
+                ocupado = ancho_palabra
+                continue
+            # Palabra más ancha que la línea: fpdf2 la parte por caracteres
+            ocupado = 0.0
+            for caracter in palabra:
+                ancho_caracter = _ancho_unitario(estilo, caracter)
+                if ocupado and ocupado + ancho_caracter > disponible:
+                    lineas += 1
+                    ocupado = 0.0
+                ocupado += ancho_caracter
+        total += lineas
+    return total
+
+
+def _alto(textos, ancho, estilo, tam_pt, alto_linea, separacion):
+    lineas = sum(contar_lineas(texto, ancho, estilo, tam_pt) for texto in textos)
+    return lineas * alto_linea + separacion * (len(textos) - 1)
+
+
+def _biseccion(pasos, cabe):
+    """Mayor índice de `range(pasos)` que cumple `cabe`, suponiendo que es monótono (None si ninguno)"""
+    bajo, alto = 0, pasos - 1
+    if not cabe(bajo):
+        return None
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        if cabe(medio):
+            bajo = medio
+        else:
+            alto = medio - 1
+    return bajo
+
+
+def ajustar_texto(textos, ancho, alto_disponible, estilo, tam_max, alto_linea_max, tam_min,
+                  alto_linea_min=None, separacion=0):
+    """Mayor tamaño (y después interlineado) con que `textos` caben en `alto_disponible` mm
+
+    Los textos se apilan como párrafos de `multi_cell` separados `separacion`
+    mm. Con el tamaño de diseño (`tam_max`) el resultado es exactamente el de
+    diseño, de modo que un texto que ya cabía no cambia.
+    """
+    textos = list(textos)
+    proporcion = alto_linea_max / tam_max
+    alto = _alto(textos, ancho, estilo, tam_max, alto_linea_max, separacion)
+    if alto <= alto_disponible:
+        return Ajuste(tam_max, alto_linea_max, alto, True)
+
+    # 1. Tamaño de letra, con el interlineado proporcional al de diseño
+    pasos = int(round((tam_max - tam_min) / PASO_TAMANO))
+
+    def tam(indice):
+        return tam_min + indice * PASO_TAMANO
+
+    def cabe_tam(indice):
+        return _alto(textos, ancho, estilo, tam(indice), tam(indice) * proporcion, separacion) <= alto_disponible
+
+    indice = _biseccion(pasos, cabe_tam)
+    if indice is not None:
+        t = tam(indice)
+        return Ajuste(t, t * proporcion, _alto(textos, ancho, estilo, t, t * proporcion, separacion), True)
+
+    # 2. Con el tamaño mínimo, interlineado más apretado
+    proporcion_min = (alto_linea_min if alto_linea_min is not None else tam_min * proporcion) / tam_min
+    lineas = sum(contar_lineas(texto, ancho, estilo, tam_min) for texto in textos)
+    pasos = int(round((proporcion - proporcion_min) / PASO_INTERLINEADO)) + 1
+    separaciones = separacion * (len(textos) - 1)
+
+    def alto_linea(indice):
+        return tam_min * (proporcion_min + indice * PASO_INTERLINEADO)
+
+    indice = _biseccion(pasos, lambda i: lineas * alto_linea(i) + separaciones <= alto_disponible)
+    # Si ni así cabe, se queda con el mínimo y el llamador avisa del desbordamiento
+    elegido = alto_linea(indice or 0)
+    return Ajuste(tam_min, elegido, lineas * elegido + separaciones, indice is not None)
+
+
+def ajustar_descripcion(datos):
+    """Tamaño de los cuatro párrafos para que no invadan el recuadro de RECOMENDACIONES"""
+    return ajustar_texto(
+        datos.parrafos, ANCHO_COLUMNA, Y_RECOM - Y_PARRAFOS, '', TAM_PARRAFO, ALTO_LINEA_PARRAFO,
+        TAM_PARRAFO_MIN, ALTO_LINEA_PARRAFO_MIN, separacion=SEPARACION_PARRAFOS,
+    )
+
+
+def ajustar_recomendaciones(datos):
+    """Tamaño de las recomendaciones para que quepan en su recuadro"""
+    return ajustar_texto(
+        [datos.recomendaciones], ANCHO_COLUMNA - 4, Y_RECOM + ALTO_RECOM - Y_TEXTO_RECOM, '', TAM_RECOM,
+        ALTO_LINEA_RECOM, TAM_RECOM_MIN, ALTO_LINEA_RECOM_MIN,
+    )
@@ -0,0 +1,139 @@
+"""
+Tiempos y memoria de cada etapa de la generación de un PDF.
+
+Se activa con TOPOGUIA_METRICAS=1. Cada generación escribe una línea JSON en
+el log `topoguia.metricas` (en stderr, o en TOPOGUIA_METRICAS_ARCHIVO si se
+indica) y se guarda en `ultimas_mediciones` para el panel de administración.
+Desactivadas, `nueva_medicion` devuelve una medición nula cuyas etapas son un
+contexto vacío: el coste es una llamada a función por etapa.
+
+La memoria es la RSS del proceso entero, así que con varias generaciones
+simultáneas el incremento de cada etapa es orientativo.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ACTIVADAS = os.environ.get('TOPOGUIA_METRICAS', '').lower() in ('1', 'true', 'si', 'sí', 'yes')
+ARCHIVO_METRICAS = os.environ.get('TOPOGUIA_METRICAS_ARCHIVO')
+MAX_MEDICIONES_GUARDADAS = 50
+
+logger = logging.getLogger(__name__)
+if ACTIVADAS:
+    _manejador = logging.FileHandler(ARCHIVO_METRICAS, encoding='utf-8') if ARCHIVO_METRICAS else logging.StreamHandler(sys.stderr)
+    _manejador.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_manejador)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Últimas generaciones medidas en este proceso (para la interfaz)
+ultimas_mediciones = deque(maxlen=MAX_MEDICIONES_GUARDADAS)
+
+try:
+    _BYTES_PAGINA = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _BYTES_PAGINA = 4096
+_MB = 1024 * 1024
+
+
+def rss_actual_mb():
+    """Memoria residente actual del proceso (solo Linux; None en otros sistemas)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _BYTES_PAGINA / _MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def rss_pico_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KB y macOS en bytes
+    return pico / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+class Medicion:
+    """Acumula el tiempo y la variación de RSS de las etapas de una generación
+
+    Las etapas pueden anidarse (`pagina_1` incluye `preparar_banner`) y una
+    etapa repetida suma sus tiempos y cuenta las veces.
+    """
+
+    def __init__(self, nombre, **contexto):
+        self.nombre = nombre
+        self.contexto = contexto
+        self.etapas = {}
+        self.inicio = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def etapa(self, nombre):
+        with self._lock:
+            # Se da de alta al empezar: las etapas quedan en orden de inicio
+            etapa = self.etapas.setdefault(nombre, {'etapa': nombre, 'veces': 0, 'segundos': 0.0, 'delta_rss_mb': 0.0})
+        rss_inicio = rss_actual_mb()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            rss_fin = rss_actual_mb()
+            with self._lock:
+                etapa['veces'] += 1
+                etapa['segundos'] += segundos
+                if rss_inicio is not None and rss_fin is not None:
+                    etapa['delta_rss_mb'] += rss_fin - rss_inicio
+                    etapa['rss_mb'] = rss_fin
+
+    def resultado(self):
+        """Diccionario serializable con el total y cada etapa en orden de aparición"""
+        pico = rss_pico_mb()
+        return {
+            'evento': self.nombre,
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            **self.contexto,
+            'segundos': round(time.perf_counter() - self.inicio, 4),
+            'rss_pico_mb': round(pico, 1) if pico is not None else None,
+            'etapas': [
+                {clave: round(valor, 4) if isinstance(valor, float) else valor for clave, valor in etapa.items()}
+                for etapa in self.etapas.values()
+            ],
+        }
+
+    def registrar(self):
+        """Escribe la medición como una línea JSON y la guarda para la interfaz"""
+        resultado = self.resultado()
+        ultimas_mediciones.append(resultado)
+        logger.info(json.dumps(resultado, ensure_ascii=False))
+        return resultado
+
+
+class _MedicionNula:
+    """Sustituto sin coste cuando las métricas están desactivadas"""
+    _contexto_vacio = nullcontext()
+
+    def etapa(self, nombre):
+        return self._contexto_vacio
+
+    def registrar(self):
+        return None
+
+
+MEDICION_NULA = _MedicionNula()
+
+
+def nueva_medicion(nombre, **contexto):
+    """Medición real si TOPOGUIA_METRICAS está activado; si no, la medición nula"""
+    return Medicion(nombre, **contexto) if ACTIVADAS else MEDICION_NULA
@@ -0,0 +1,56 @@
+"""
+Tabla MIDE dibujada con rectángulos y texto del PDF a partir de los valores del formulario.
+
+Cada apartado (medio, orientación, desplazamiento y esfuerzo) ocupa una fila
+con su nombre y una escala de cinco casillas, rellenas en verde hasta el valor.
+Ocupa unos cientos de bytes en lugar de una imagen y siempre coincide con los
+valores de la ficha técnica.
+
+`dibujar_mide` usa solo la parte de la API de fpdf2 que también imita el lienzo
+de la vista previa, así que el PDF y la vista previa la trazan igual.
+"""
+from .maqueta import VERDE
+
+ALTO_TITULO_MIDE = 6
+LADO_CASILLA = 5
+SEPARACION_CASILLAS = 1.2
+FONDO_TABLA = (245, 245, 245)
+CASILLA_APAGADA = (222, 222, 222)
+GRIS_TEXTO = (90, 90, 90)
+
+
+def dibujar_mide(pdf, filas, x, y, ancho, alto):
+    """Dibuja la tabla MIDE en la caja (x, y, ancho, alto) en mm
+
+    `filas` son pares (apartado, valor 1-5 o None), como `DatosRuta.valores_mide`.
+    `pdf` es un PDF_Landscape o el lienzo de la vista previa.
+    """
+    pdf.set_fill_color(*FONDO_TABLA)
+    pdf.rect(x, y, ancho, alto, 'F')
+
+    pdf.set_font(pdf.familia, 'B', 9)
+    pdf.set_text_color(*VERDE)
+    pdf.set_xy(x + 3, y + 1)
+    pdf.cell(20, ALTO_TITULO_MIDE - 1, 'MIDE', align='L')
+    pdf.set_font(pdf.familia, '', 6)
+    pdf.set_text_color(*GRIS_TEXTO)
+    pdf.set_xy(x + 3, y + 1)
+    pdf.cell(ancho - 6, ALTO_TITULO_MIDE - 1, 'Método de Información De Excursiones', align='R')
+
+    x_escala = x + ancho - 3 - 5 * LADO_CASILLA - 4 * SEPARACION_CASILLAS
+    alto_fila = (alto - ALTO_TITULO_MIDE - 1) / len(filas)
+    for indice, (apartado, valor) in enumerate(filas):
+        y_casilla = y + ALTO_TITULO_MIDE + indice * alto_fila + (alto_fila - LADO_CASILLA) / 2
+        pdf.set_font(pdf.familia, '', 7.5)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_xy(x + 3, y_casilla)
+        pdf.cell(x_escala - x - 5, LADO_CASILLA, apartado, align='L')
+        pdf.set_font(pdf.familia, 'B', 7)
+        for numero in range(1, 6):
+            x_casilla = x_escala + (numero - 1) * (LADO_CASILLA + SEPARACION_CASILLAS)
+            encendida = valor is not None and numero <= valor
+            pdf.set_fill_color(*(VERDE if encendida else CASILLA_APAGADA))
+            pdf.rect(x_casilla, y_casilla, LADO_CASILLA, LADO_CASILLA, 'F')
+            pdf.set_text_color(*((255, 255, 255) if encendida else GRIS_TEXTO))
+            pdf.set_xy(x_casilla, y_casilla)
+            pdf.cell(LADO_CASILLA, LADO_CASILLA, str(numero), align='C')
@@ -0,0 +1,164 @@
+"""
+Modelo de datos de una ruta: los campos del formulario que llegan al PDF,
+la plantilla institucional por defecto y la validación de obligatorios.
+"""
+from dataclasses import asdict, dataclass, fields
+
+from .mapa import hay_teselas
+
+# Apartados de la tabla MIDE, en su orden, con el campo de cada valor (1-5)
+APARTADOS_MIDE = {
+    'mide_severidad': "Severidad del medio natural",
+    'mide_orientacion': "Orientación en el itinerario",
+    'mide_desplazamiento': "Dificultad en el desplazamiento",
+    'mide_esfuerzo': "Cantidad de esfuerzo necesario",
+}
+
+
+@dataclass
+class DatosRuta:
+    """Datos de texto de una topoguía (antes, el diccionario `datos_formulario`)"""
+    # Datos básicos
+    codigo_ruta: str = ''
+    nombre_sendero: str = ''
+    lugares_interes: str = ''
+    mirador_nombre: str = 'MIRADOR DEL PICO'
+
+    # Ficha técnica
+    distancia: str = ''
+    tiempo: str = ''
+    desnivel_subida: str = ''
+    desnivel_bajada: str = ''
+    tipo_ruta: str = ''
+    mide_severidad: str = ''
+    mide_orientacion: str = ''
+    mide_desplazamiento: str = ''
+    mide_esfuerzo: str = ''
+
+    # Descripción
+    parrafo1: str = ''
+    parrafo2: str = ''
+    parrafo3: str = ''
+    parrafo4: str = ''
+    recomendaciones: str = ''
+    hito1: str = ''
+    hito2: str = ''
+    hito3: str = ''
+    hito4: str = ''
+
+    # Configuración e institucionales
+    consejos_disfruta: str = ''
+    url_qr: str = ''
+    telefono_emergencias: str = '112'
+    telefono_parque: str = ''
+    entidad_promotora: str = ''
+    parque_natural: str = ''
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Crea los datos desde un diccionario (formulario, manifiesto...) ignorando claves ajenas"""
+        conocidos = {f.name for f in fields(cls)}
+        return cls(**{
+            clave: str(valor)
+            for clave, valor in datos.items()
+            if clave in conocidos and valor is not None
+        })
+
+    def a_dict(self):
+        return asdict(self)
+
+    @property
+    def parrafos(self):
+        return [self.parrafo1, self.parrafo2, self.parrafo3, self.parrafo4]
+
+    @property
+    def hitos(self):
+        """Hitos rellenos, en orden, para etiquetar el perfil de elevación"""
+        return [hito.strip() for hito in (self.hito1, self.hito2, self.hito3, self.hito4) if hito.strip()]
+
+    @property
+    def ficha_tecnica(self):
+        """Filas (etiqueta, valor) de la tabla de datos técnicos de la página 2"""
+        return [
+            ('Horario:', self.tiempo),
+            ('Distancia:', self.distancia),
+            ('Desnivel Subida:', self.desnivel_subida),
+            ('Desnivel Bajada:', self.desnivel_bajada),
+            ('Tipo:', self.tipo_ruta)
+        ]
+
+    @property
+    def valores_mide(self):
+        """Filas (apartado, valor 1-5 o None si falta o no es válido) de la tabla MIDE"""
+        return [(apartado, _valor_mide(getattr(self, campo))) for campo, apartado in APARTADOS_MIDE.items()]
+
+    @property
+    def tiene_mide(self):
+        return any(valor is not None for _, valor in self.valores_mide)
+
+
+def _valor_mide(texto):
+    try:
+        valor = int(float(texto))
+    except (ValueError, OverflowError):  # "inf" llega a float pero no a int
+        return None
+    return valor if 1 <= valor <= 5 else None
+
+
+def cargar_plantilla():
+    """Carga datos de plantilla por defecto"""
+    return {
+        'entidad_promotora': 'Junta de Comunidades de Castilla-La Mancha',
+        'red_senderos': 'Red de Senderos de Guadalajara',
+        'parque': 'Parque Natural Sierra Norte de Guadalajara',
+        'telefono_parque': '949 88 53 00',
+        'telefono_emergencias': '112',
+        'web_institucional': 'http://areasprotegidas.castillalamancha.es'
+    }
+
+
+# Campos e imágenes obligatorios, en el orden en que se listan los errores
+CAMPOS_OBLIGATORIOS = {
+    'codigo_ruta': "Código de Ruta",
+    'nombre_sendero': "Nombre del Sendero",
+    'distancia': "Distancia",
+    'tiempo': "Tiempo Estimado",
+}
+IMAGENES_OBLIGATORIAS = {
+    'mapa': "Imagen del Mapa",
+    'perfil': "Perfil (imagen o track GPX)",
+}
+# Imágenes que no hacen falta si hay otro archivo del que se generan. El mapa
+# solo sale del track si hay un almacén de teselas (TOPOGUIA_MBTILES).
+SUSTITUTOS_IMAGEN = {
+    'perfil': 'track',
+    'mapa': 'track',
+}
+
+
+def sustituto_imagen(clave):
+    """Archivo que puede reemplazar a la imagen `clave` en este proceso, o None"""
+    if clave == 'mapa' and not hay_teselas():
+        return None
+    return SUSTITUTOS_IMAGEN.get(clave)
+
+
+def validar_campo(campo, valor, sustituto=None):
+    """Error de un solo campo o imagen (su etiqueta si es obligatorio y está vacío), o None
+
+    `sustituto` es el archivo que puede reemplazar a la imagen (ver `sustituto_imagen`).
+    """
+    etiqueta = CAMPOS_OBLIGATORIOS.get(campo) or IMAGENES_OBLIGATORIAS.get(campo)
+    return etiqueta if etiqueta and not (valor or sustituto) else None
+
+
+def validar_campos(datos, imagenes):
+    """Valida que los campos obligatorios estén completos"""
+    if isinstance(datos, dict):
+        datos = DatosRuta.desde_dict(datos)
+    errores = [validar_campo(campo, getattr(datos, campo)) for campo in CAMPOS_OBLIGATORIOS]
+    errores += [
+        validar_campo(clave, imagenes.get(clave), imagenes.get(sustituto_imagen(clave)))
+        for clave in IMAGENES_OBLIGATORIAS
+    ]
+    return [error for error in errores if error]
@@ -0,0 +1,530 @@
+"""
+Motor de generación del PDF de la topoguía (A4 horizontal, 2 páginas).
+
+No depende de Streamlit: lo usan tanto `app.py` como el generador por lotes
+(`generar_lote.py`). Los textos llegan como `DatosRuta` (o un diccionario con
+sus claves) y las imágenes como UploadedFile, BytesIO, bytes o imágenes Pillow.
+Junto a las imágenes puede llegar el `track` GPX/GeoJSON de la ruta, del que se
+dibuja el perfil de elevación vectorial en lugar de la imagen del perfil y,
+si hay un almacén de teselas MBTiles configurado, el mapa cuando no se sube.
+"""
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fpdf import FPDF
+from PIL import Image
+
+from .cache import hash_contenido
+from .fuentes import nombre_fuente, registrar_fuentes
+from .imagenes import CAJAS_IMAGEN, DPI_POR_DEFECTO, leer_origen, preparar_para_caja
+from .mapa import dibujar_trazado, huella_teselas, mapa_de_track
+from .maqueta import (
+    ALTO_BANNER, ALTO_DATOS, ALTO_LINEA_PANEL, ALTO_MIDE, ALTO_RECOM, ANCHO_COLUMNA, ANCHO_PAGINA, ANCHO_PANEL,
+    MARGEN, POSICIONES_IMAGEN, SEPARACION_PARRAFOS, TEXTO_SENALIZACION, VERDE, X_PANEL, X_TEXTO, Y_BANNER,
+    Y_DATOS, Y_PANEL, Y_PARRAFOS, Y_RECOM, Y_TEXTO_RECOM, Y_TITULO, posiciones_panel,
+)
+from .maquetacion import ajustar_descripcion, ajustar_recomendaciones
+from .metricas import nueva_medicion
+from .mide import dibujar_mide
+from .modelo import DatosRuta
+from .perfil import dibujar_perfil, perfil_de_track
+from .qr import dibujar_qr, tramos_qr
+
+try:
+    from fpdf.enums import ResourceAccessPolicy
+except ImportError:  # versiones de fpdf2 sin control de acceso a recursos
+    ResourceAccessPolicy = None
+
+# Índice de los cuadernillos: filas por página y su posición
+FILAS_INDICE = 22
+Y_INDICE = 32
+ALTO_FILA_INDICE = 7
+
+# Hilos para preparar a la vez las imágenes de un documento antes de maquetarlo.
+# Pillow suelta el GIL al decodificar, remuestrear y comprimir.
+HILOS_IMAGENES = int(os.environ.get('TOPOGUIA_HILOS_IMAGENES', str(min(6, os.cpu_count() or 1))))
+
+
+def _preparar_anticipada(clave, archivo, dpi, huella=None):
+    return [(clave, archivo, preparar_para_caja(clave, archivo, dpi, huella=huella))]
+
+
+def _preparar_track(imgs, dpi, huella_perfil=None):
+    """Perfil del track y las imágenes que dependen de él: la del perfil si el track no
+    tiene altitudes y, si no se sube mapa, la del mapa de teselas"""
+    preparadas = []
+    if perfil_de_track(imgs['track']) is None and imgs.get('perfil'):
+        preparadas += _preparar_anticipada('perfil', imgs['perfil'], dpi, huella_perfil)
+    mapa = None if imgs.get('mapa') else mapa_de_track(imgs['track'], dpi)
+    if mapa is not None:
+        preparadas += _preparar_anticipada('mapa', mapa.imagen, dpi)
+    return preparadas
+
+
+class PDF_Landscape(FPDF):
+    def __init__(self, datos, dpi=DPI_POR_DEFECTO, huellas=None):
+        super().__init__(orientation='L', unit='mm', format='A4')  # Landscape
+        # Se aceptan también diccionarios con las claves de DatosRuta
+        self.datos = datos if isinstance(datos, DatosRuta) else DatosRuta.desde_dict(datos)
+        self.dpi = dpi
+        self.informe_imagenes = {}
+        self._anticipadas = {}
+        # Hash de cada archivo de imagen, calculado una vez por trabajo (ver `_huella`)
+        self._huellas = {} if huellas is None else huellas
+        # Tiempos y memoria por etapa (sin coste si TOPOGUIA_METRICAS está desactivado)
+        self.medicion = nueva_medicion('pdf', codigo_ruta=self.datos.codigo_ruta, dpi=dpi)
+        self.set_auto_page_break(False)
+        # Familia TTF ya analizada en el proceso (solo se incrustan los glifos
+        # usados) o Helvetica si no hay ninguna instalada
+        self.familia = registrar_fuentes(self)
+        # Las fuentes core usan WinAnsiEncoding: cubre '•' además de Latin-1
+        self.core_fonts_encoding = 'windows-1252'
+        # Todas las imágenes llegan en memoria: se prohíbe a fpdf2 leer rutas o URLs
+        if ResourceAccessPolicy is not None:
+            self.resource_access_policy = ResourceAccessPolicy.NONE
+    
+    def insertar_imagen(self, clave, archivo, x, y):
+        """Remuestrea la imagen para su caja (CAJAS_IMAGEN) y la inserta en el PDF
+        
+        `archivo` puede ser un UploadedFile, BytesIO, bytes o imagen Pillow. Todo
+        ocurre en memoria: fpdf2 nombra cada BytesIO por el hash de su contenido,
+        así que una imagen repetida se incrusta una sola vez.
+        """
+        with self.medicion.etapa(f'preparar_{clave}'):
+            preparada = self._anticipada(clave, archivo) or preparar_para_caja(clave, archivo, self.dpi)
+        self.informe_imagenes[clave] = preparada
+        ancho, alto = CAJAS_IMAGEN[clave]
+        with self.medicion.etapa(f'incrustar_{clave}'):
+            self.image(io.BytesIO(preparada.datos), x=x, y=y, w=ancho or 0, h=alto or 0)
+    
+    def anticipar_imagenes(self, rutas):
+        """Prepara en un pool de hilos las imágenes de las rutas (pares datos, imgs) antes de maquetarlas
+        
+        Decodificar, remuestrear y comprimir cada imagen, leer el track (perfil y
+        mapa de teselas) y codificar el QR son independientes entre sí: en una
+        máquina con varios núcleos la espera total se acerca a la de la imagen
+        más cara en lugar de a la suma. La maquetación después solo recoge las
+        ImagenPreparada ya hechas. Si una imagen falla no se guarda: la maquetación la vuelve a
+        intentar y el error salta donde siempre.
+        
+        Las imágenes se agrupan por caja y contenido: el logo o la tabla MIDE
+        que comparten todas las rutas de un cuadernillo se preparan una sola
+        vez y su resultado sirve a cada ruta.
+        """
+        with self.medicion.etapa('anticipar_imagenes'), ThreadPoolExecutor(HILOS_IMAGENES) as pool:
+            futuros = {}
+            enlaces = []
+            
+            def enviar(contenido, funcion, *args):
+                if contenido not in futuros:
+                    futuros[contenido] = pool.submit(funcion, *args)
+                return futuros[contenido]
+            
+            for datos, imgs in rutas:
+                pendientes = [clave for clave in (*CAJAS_IMAGEN, 'track') if imgs.get(clave)]
+                if 'track' in pendientes:
+                    # Del track salen el perfil (o, sin altitudes, la imagen del perfil) y el mapa
+                    huella_perfil = _huella(imgs['perfil'], self._huellas) if imgs.get('perfil') else None
+                    contenido = ('track', _huella(imgs['track'], self._huellas), huella_perfil, bool(imgs.get('mapa')))
+                    enlaces.append((enviar(contenido, _preparar_track, imgs, self.dpi, huella_perfil), imgs))
+                for clave in pendientes:
+                    if clave != 'track' and not (clave == 'perfil' and 'track' in pendientes):
+                        huella = _huella(imgs[clave], self._huellas)
+                        enlaces.append((
+                            enviar((clave, huella), _preparar_anticipada, clave, imgs[clave], self.dpi, huella),
+                            imgs,
+                        ))
+                if datos.url_qr:
+                    enviar(('qr', datos.url_qr), tramos_qr, datos.url_qr)
+            for futuro, imgs in enlaces:
+                if futuro.exception() is None:
+                    for clave, archivo, preparada in futuro.result():
+                        # La maquetación busca por el archivo de cada ruta; el mapa de
+                        # teselas (sin archivo subido) es el mismo objeto de cache_mapas
+                        archivo = imgs.get(clave) or archivo
+                        # Se guarda también el archivo para que su id no se reutilice
+                        self._anticipadas[(clave, id(archivo))] = (archivo, preparada)
+    
+    def _anticipada(self, clave, archivo):
+        archivo_anticipado, preparada = self._anticipadas.get((clave, id(archivo)), (None, None))
+        return preparada if archivo_anticipado is archivo else None
+    
+    def pagina_1_informativa(self, imgs):
+        """PÁGINA 1: Cara informativa con descripción y foto panorámica"""
+        with self.medicion.etapa('pagina_1'):
+            self._dibujar_pagina_1(imgs)
+    
+    def _dibujar_pagina_1(self, imgs):
+        self.add_page()
+        
+        # Color verde corporativo
+        verde = VERDE
+        
+        # 1. CABECERA CON LOGO (si existe)
+        if imgs.get('logo'):
+            self.insertar_imagen('logo', imgs['logo'], *POSICIONES_IMAGEN['logo'])
+        
+        # Texto institucional en cabecera
+        self.set_font(self.familia, 'I', 8)
+        self.set_text_color(100, 100, 100)
+        self.set_xy(200, 8)
+        self.cell(0, 4, self.datos.entidad_promotora, align='R')
+        self.set_xy(200, 12)
+        self.cell(0, 4, self.datos.parque_natural, align='R')
+        
+        # 2. FOTO PANORÁMICA CON ETIQUETA VERTICAL
+        y_banner = Y_BANNER
+        if imgs.get('banner'):
+            # Etiqueta vertical izquierda
+            mirador = self.datos.mirador_nombre
+            if mirador:
+                self.set_fill_color(*verde)
+                self.rect(10, y_banner, 15, ALTO_BANNER, 'F')
+                self.set_font(self.familia, 'B', 10)
+                self.set_text_color(255, 255, 255)
+                self.set_xy(10, y_banner + 40)
+                self.rotate(90, 17.5, y_banner + 40)
+                self.cell(0, 0, mirador, align='C')
+                self.rotate(0)
+            
+            # Imagen panorámica
+            self.insertar_imagen('banner', imgs['banner'], *POSICIONES_IMAGEN['banner'])
+            
+            # Etiquetas de lugares de interés (simuladas como texto sobre la imagen)
+            self.set_font(self.familia, 'B', 7)
+            self.set_text_color(255, 255, 255)
+            lugares = self.datos.lugares_interes.split(',')
+            x_pos = 40
+            for lugar in lugares[:3]:  # Máximo 3 etiquetas
+                self.set_xy(x_pos, y_banner + 5)
+                self.set_fill_color(0, 0, 0)  # fpdf2 no admite canal alfa en set_fill_color
+                self.cell(0, 5, lugar.strip(), fill=False)
+                x_pos += 80
+        
+        # 3. TÍTULO PRINCIPAL
+        y_titulo = Y_TITULO
+        self.set_font(self.familia, 'B', 28)
+        self.set_text_color(*verde)
+        self.set_xy(X_TEXTO, y_titulo)
+        self.cell(0, 10, self.datos.codigo_ruta)
+        
+        self.set_font(self.familia, 'B', 14)
+        self.set_xy(X_TEXTO, y_titulo + 12)
+        self.cell(0, 7, f"SENDERO {self.datos.nombre_sendero}")
+        
+        # 4. COLUMNA DE TEXTO - DESCRIPCIÓN (4 párrafos)
+        # Si no caben con el tamaño de diseño se reducen letra e interlineado
+        y_texto = Y_PARRAFOS
+        self.set_text_color(0, 0, 0)
+        
+        ancho_columna = ANCHO_COLUMNA
+        
+        with self.medicion.etapa('texto_descripcion'):
+            ajuste = ajustar_descripcion(self.datos)
+            self.set_font(self.familia, '', ajuste.tam_pt)
+            for parrafo in self.datos.parrafos:
+                self.set_xy(X_TEXTO, y_texto)
+                self.multi_cell(ancho_columna, ajuste.alto_linea, parrafo, align='J')
+                y_texto = self.get_y() + SEPARACION_PARRAFOS
+        
+        # 5. BLOQUE DE RECOMENDACIONES (Inferior)
+        y_recom = Y_RECOM
+        self.set_fill_color(255, 243, 205)  # Fondo amarillo claro
+        self.rect(X_TEXTO, y_recom, ancho_columna, ALTO_RECOM, 'F')
+        
+        self.set_font(self.familia, 'B', 10)
+        self.set_text_color(*verde)
+        self.set_xy(X_TEXTO + 2, y_recom + 2)
+        self.cell(0, 5, 'RECOMENDACIONES')
+        
+        self.set_text_color(0, 0, 0)
+        self.set_xy(X_TEXTO + 2, Y_TEXTO_RECOM)
+        with self.medicion.etapa('texto_recomendaciones'):
+            ajuste = ajustar_recomendaciones(self.datos)
+            self.set_font(self.familia, '', ajuste.tam_pt)
+            self.multi_cell(ancho_columna - 4, ajuste.alto_linea, self.datos.recomendaciones)
+        
+        # PIE DE PÁGINA
+        self.set_y(-10)
+        self.set_font(self.familia, 'I', 7)
+        self.set_text_color(100, 100, 100)
+        self.cell(0, 5, f'Generado el {datetime.now().strftime("%d/%m/%Y")}', align='C')
+    
+    def pagina_2_tecnica(self, imgs):
+        """PÁGINA 2: Mapa, perfil, ficha técnica y datos adicionales"""
+        with self.medicion.etapa('pagina_2'):
+            self._dibujar_pagina_2(imgs)
+    
+    def _dibujar_pagina_2(self, imgs):
+        self.add_page()
+        
+        verde = VERDE
+        
+        # 1. MAPA TOPOGRÁFICO (Superior Izquierdo - 60% del ancho): el subido o,
+        # si no hay, compuesto con las teselas locales y el recorrido del track
+        if imgs.get('mapa'):
+            self.insertar_imagen('mapa', imgs['mapa'], *POSICIONES_IMAGEN['mapa'])
+        elif imgs.get('track'):
+            with self.medicion.etapa('mapa_teselas'):
+                mapa = mapa_de_track(imgs['track'], self.dpi)
+            if mapa is not None:
+                self.insertar_imagen('mapa', mapa.imagen, *POSICIONES_IMAGEN['mapa'])
+                dibujar_trazado(self, mapa, *POSICIONES_IMAGEN['mapa'], *CAJAS_IMAGEN['mapa'])
+        
+        # 2. PERFIL DE ELEVACIÓN (Centro - Debajo del mapa): vectorial si hay track
+        perfil = None
+        if imgs.get('track'):
+            with self.medicion.etapa('perfil'):
+                perfil = perfil_de_track(imgs['track'])
+                if perfil is not None:
+                    dibujar_perfil(self, perfil, self.datos.hitos, *POSICIONES_IMAGEN['perfil'],
+                                   *CAJAS_IMAGEN['perfil'])
+        if perfil is None and imgs.get('perfil'):
+            self.insertar_imagen('perfil', imgs['perfil'], *POSICIONES_IMAGEN['perfil'])
+        
+        # 3. PANEL LATERAL DERECHO - FICHA TÉCNICA
+        x_panel = X_PANEL
+        y_panel = Y_PANEL
+        ancho_panel = ANCHO_PANEL
+        
+        # Título del panel
+        self.set_fill_color(*verde)
+        self.rect(x_panel, y_panel, ancho_panel, 8, 'F')
+        self.set_font(self.familia, 'B', 11)
+        self.set_text_color(255, 255, 255)
+        self.set_xy(x_panel, y_panel + 2)
+        self.cell(ancho_panel, 5, 'FICHA TÉCNICA', align='C')
+        
+        # Datos técnicos en tabla
+        y_datos = Y_DATOS
+        self.set_fill_color(245, 245, 245)
+        self.rect(x_panel, y_datos, ancho_panel, ALTO_DATOS, 'F')
+        
+        self.set_font(self.familia, 'B', 9)
+        self.set_text_color(0, 0, 0)
+        
+        y_item = y_datos + 3
+        for etiqueta, valor in self.datos.ficha_tecnica:
+            self.set_xy(x_panel + 3, y_item)
+            self.set_font(self.familia, 'B', 8)
+            self.cell(35, 5, etiqueta, align='L')
+            self.set_font(self.familia, '', 8)
+            self.cell(0, 5, valor, align='L')
+            y_item += 6
+        
+        # 4. TABLA MIDE: la imagen subida o, si no hay, dibujada con los valores del formulario
+        if imgs.get('mide'):
+            self.insertar_imagen('mide', imgs['mide'], *POSICIONES_IMAGEN['mide'])
+        elif self.datos.tiene_mide:
+            with self.medicion.etapa('mide'):
+                dibujar_mide(self, self.datos.valores_mide, *POSICIONES_IMAGEN['mide'], ANCHO_PANEL, ALTO_MIDE)
+        posiciones = posiciones_panel(bool(imgs.get('mide')) or self.datos.tiene_mide)
+        
+        # 5. SECCIÓN SEÑALIZACIÓN
+        self.set_font(self.familia, 'B', 9)
+        self.set_text_color(*verde)
+        self.set_xy(x_panel, posiciones['senalizacion'])
+        self.cell(0, 5, 'SEÑALIZACIÓN')
+        
+        self.set_font(self.familia, '', 7)
+        self.set_text_color(0, 0, 0)
+        self.set_xy(x_panel, posiciones['senalizacion'] + 6)
+        self.multi_cell(ancho_panel, ALTO_LINEA_PANEL, TEXTO_SENALIZACION)
+        
+        # 6. SECCIÓN DISFRUTA DEL PARQUE
+        y_consejos = posiciones['consejos']
+        self.set_font(self.familia, 'B', 9)
+        self.set_text_color(*verde)
+        self.set_xy(x_panel, y_consejos)
+        self.cell(0, 5, 'DISFRUTA DEL PARQUE')
+        
+        self.set_font(self.familia, '', 7)
+        self.set_text_color(0, 0, 0)
+        self.set_xy(x_panel, y_consejos + 6)
+        with self.medicion.etapa('texto_panel'):
+            self.multi_cell(ancho_panel, ALTO_LINEA_PANEL, self.datos.consejos_disfruta)
+        
+        # 7. TELÉFONOS DE INTERÉS Y QR
+        y_telefonos = posiciones['telefonos']
+        self.set_font(self.familia, 'B', 9)
+        self.set_text_color(*verde)
+        self.set_xy(x_panel, y_telefonos)
+        self.cell(0, 5, 'TELÉFONOS DE INTERÉS')
+        
+        self.set_font(self.familia, '', 8)
+        self.set_text_color(0, 0, 0)
+        self.set_xy(x_panel, y_telefonos + 6)
+        self.cell(0, 4, f"Emergencias: {self.datos.telefono_emergencias}")
+        self.set_xy(x_panel, y_telefonos + 11)
+        self.cell(0, 4, f"Parque: {self.datos.telefono_parque}")
+        
+        # Código QR
+        if self.datos.url_qr:
+            with self.medicion.etapa('qr'):
+                dibujar_qr(self, self.datos.url_qr, x=x_panel + 30, y=posiciones['qr'], lado=25)
+            
+            self.set_font(self.familia, 'I', 6)
+            self.set_xy(x_panel, posiciones['url'])
+            self.multi_cell(ancho_panel, 2.5, self.datos.url_qr, align='C')
+    
+    def dibujar_indice(self, titulo, rutas, enlaces, primera_pagina):
+        """Páginas de índice de un cuadernillo: una fila por ruta, enlazada a su primera página"""
+        verde = VERDE
+        for inicio in range(0, len(rutas), FILAS_INDICE):
+            self.add_page()
+            self.set_fill_color(*verde)
+            self.rect(MARGEN, MARGEN, ANCHO_PAGINA - 2 * MARGEN, 14, 'F')
+            self.set_font(self.familia, 'B', 16)
+            self.set_text_color(255, 255, 255)
+            self.set_xy(MARGEN + 4, MARGEN + 3)
+            self.cell(0, 8, 'ÍNDICE DE SENDEROS')
+            if titulo:
+                self.set_font(self.familia, '', 10)
+                self.set_xy(MARGEN, MARGEN + 3)
+                self.cell(ANCHO_PAGINA - 2 * MARGEN - 4, 8, titulo, align='R')
+            
+            y_fila = Y_INDICE
+            for numero in range(inicio, min(inicio + FILAS_INDICE, len(rutas))):
+                datos = rutas[numero]
+                pagina = primera_pagina + 2 * numero
+                self.set_xy(X_TEXTO, y_fila)
+                self.set_font(self.familia, 'B', 10)
+                self.set_text_color(*verde)
+                self.cell(30, ALTO_FILA_INDICE, datos.codigo_ruta, link=enlaces[numero])
+                self.set_font(self.familia, '', 10)
+                self.set_text_color(0, 0, 0)
+                self.cell(150, ALTO_FILA_INDICE, datos.nombre_sendero, link=enlaces[numero])
+                self.set_font(self.familia, '', 8)
+                self.set_text_color(100, 100, 100)
+                resumen = ' · '.join(valor for valor in (datos.distancia, datos.tiempo) if valor)
+                self.cell(60, ALTO_FILA_INDICE, resumen)
+                self.set_font(self.familia, 'B', 10)
+                self.set_text_color(0, 0, 0)
+                self.cell(0, ALTO_FILA_INDICE, str(pagina), align='R', link=enlaces[numero])
+                y_fila += ALTO_FILA_INDICE
+                self.set_draw_color(220, 220, 220)
+                self.line(X_TEXTO, y_fila, ANCHO_PAGINA - X_TEXTO, y_fila)
+
+
+def crear_pdf_topoguia(datos, imgs, dpi=DPI_POR_DEFECTO, informe=None, progreso=None, huellas=None):
+    """Genera el PDF de la topoguía en formato landscape de 2 páginas
+    
+    Si se pasa un diccionario en `informe`, se rellena con la ImagenPreparada
+    de cada imagen incrustada (tamaño original, final y ahorro). `progreso` es
+    un callback opcional `progreso(fraccion, mensaje)` para mostrar el avance.
+    `huellas` es el diccionario de hashes ya usado con `clave_resultado`, para
+    no volver a calcularlos.
+    """
+    progreso = progreso or (lambda fraccion, mensaje='': None)
+    pdf = PDF_Landscape(datos, dpi=dpi, huellas=huellas)
+    pdf.anticipar_imagenes([(pdf.datos, imgs)])
+    
+    # Página 1: Informativa
+    progreso(0.05, "Página 1: descripción y foto panorámica")
+    pdf.pagina_1_informativa(imgs)
+    
+    # Página 2: Técnica
+    progreso(0.45, "Página 2: mapa, perfil y ficha técnica")
+    pdf.pagina_2_tecnica(imgs)
+    
+    if informe is not None:
+        informe.update(pdf.informe_imagenes)
+    
+    progreso(0.85, "Componiendo el PDF")
+    with pdf.medicion.etapa('output'):
+        resultado = pdf.output()
+    pdf.medicion.registrar()
+    return resultado
+
+
+def crear_cuadernillo(rutas, titulo='', dpi=DPI_POR_DEFECTO, progreso=None):
+    """Une varias topoguías en un solo PDF, con un índice enlazado al principio
+    
+    `rutas` es una lista de pares (datos, imgs) como los de `crear_pdf_topoguia`.
+    Cada imagen se prepara con la caché compartida y fpdf2 nombra cada una por
+    el hash de su contenido, así que las idénticas entre rutas (el logo
+    institucional, una misma tabla MIDE) se incrustan como un único objeto al
+    que apuntan todas las páginas. Los QR ya son vectoriales y su matriz se
+    codifica una vez por URL.
+    """
+    progreso = progreso or (lambda fraccion, mensaje='': None)
+    rutas = [
+        (datos if isinstance(datos, DatosRuta) else DatosRuta.desde_dict(datos), imgs)
+        for datos, imgs in rutas
+    ]
+    if not rutas:
+        raise ValueError("el cuadernillo necesita al menos una ruta")
+    
+    pdf = PDF_Landscape(rutas[0][0], dpi=dpi)
+    pdf.medicion = nueva_medicion('cuadernillo', rutas=len(rutas), dpi=dpi)
+    pdf.set_title(titulo or 'Topoguías')
+    
+    # Cada ruta ocupa dos páginas: las de destino del índice se conocen de antemano
+    paginas_indice = -(-len(rutas) // FILAS_INDICE)
+    enlaces = [pdf.add_link(page=paginas_indice + 1 + 2 * numero) for numero in range(len(rutas))]
+    progreso(0.02, "Preparando las imágenes")
+    pdf.anticipar_imagenes(rutas)
+    progreso(0.04, "Índice")
+    with pdf.medicion.etapa('indice'):
+        pdf.dibujar_indice(titulo, [datos for datos, _ in rutas], enlaces, paginas_indice + 1)
+    
+    for numero, (datos, imgs) in enumerate(rutas):
+        progreso(0.05 + 0.8 * numero / len(rutas), f"Ruta {numero + 1} de {len(rutas)}: {datos.codigo_ruta}")
+        pdf.datos = datos
+        pdf.pagina_1_informativa(imgs)
+        # Marcador del visor de PDF apuntando al principio de la ruta
+        pdf.set_y(0)
+        pdf.start_section(f"{datos.codigo_ruta} {datos.nombre_sendero}".strip())
+        pdf.pagina_2_tecnica(imgs)
+    
+    progreso(0.85, "Componiendo el cuadernillo")
+    with pdf.medicion.etapa('output'):
+        resultado = pdf.output()
+    pdf.medicion.registrar()
+    return resultado
+
+
+def _hash_imagen(archivo):
+    origen = leer_origen(archivo)
+    if isinstance(origen, Image.Image):
+        return hash_contenido(f"{origen.mode}{origen.size}".encode() + origen.tobytes())
+    return hash_contenido(origen)
+
+
+def _huella(archivo, huellas=None):
+    """Hash del contenido de `archivo`; con `huellas` ({id: (archivo, hash)}) se calcula una vez por archivo"""
+    if huellas is None:
+        return _hash_imagen(archivo)
+    guardada = huellas.get(id(archivo))
+    if guardada is None or guardada[0] is not archivo:
+        # Se guarda también el archivo para que su id no se reutilice
+        guardada = huellas[id(archivo)] = (archivo, _hash_imagen(archivo))
+    return guardada[1]
+
+
+def clave_resultado(datos, imgs, dpi=DPI_POR_DEFECTO, huellas=None):
+    """Clave de caché de un PDF: datos normalizados, hash de cada imagen, ppp, fuente, teselas y fecha
+
+    La fecha entra en la clave porque el pie de página muestra el día de generación.
+    Con un diccionario `huellas` los hashes quedan guardados para `crear_pdf_topoguia`.
+    """
+    if not isinstance(datos, DatosRuta):
+        datos = DatosRuta.desde_dict(datos)
+    huella = {
+        'datos': datos.a_dict(),
+        'imagenes': {clave: _huella(archivo, huellas) for clave, archivo in sorted(imgs.items()) if archivo},
+        'dpi': dpi,
+        'fuente': nombre_fuente(),
+        'teselas': huella_teselas(),
+        'fecha': datetime.now().strftime('%Y%m%d'),
+    }
+    return hash_contenido(json.dumps(huella, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+
+
+def nombre_archivo_pdf(codigo_ruta, fecha=None):
+    """Nombre de descarga del PDF: Topoguia_<código>_<AAAAMMDD>.pdf"""
+    fecha = fecha or datetime.now()
+    return f"Topoguia_{codigo_ruta.replace(' ', '_')}_{fecha.strftime('%Y%m%d')}.pdf"
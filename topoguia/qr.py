@@ -0,0 +1,55 @@
+"""
+Códigos QR dibujados como rectángulos vectoriales del PDF.
+
+La matriz de módulos se memoiza por URL y nivel de corrección, así que repetir
+una URL ya vista no vuelve a codificarla. Al dibujar, cada tramo horizontal de
+módulos negros se convierte en un único rectángulo: el QR queda nítido a
+cualquier tamaño y ocupa unos pocos cientos de bytes en lugar de una imagen.
+"""
+from functools import lru_cache
+
+import qrcode
+from qrcode.constants import ERROR_CORRECT_H, ERROR_CORRECT_L, ERROR_CORRECT_M, ERROR_CORRECT_Q
+
+NIVELES_CORRECCION = {
+    'L': ERROR_CORRECT_L,
+    'M': ERROR_CORRECT_M,
+    'Q': ERROR_CORRECT_Q,
+    'H': ERROR_CORRECT_H,
+}
+
+
+@lru_cache(maxsize=256)
+def matriz_qr(url, correccion='M'):
+    """Devuelve la matriz de módulos del QR (tupla de filas de booleanos, sin margen)"""
+    qr = qrcode.QRCode(error_correction=NIVELES_CORRECCION[correccion], border=0)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return tuple(tuple(fila) for fila in qr.get_matrix())
+
+
+@lru_cache(maxsize=256)
+def tramos_qr(url, correccion='M'):
+    """Agrupa los módulos negros de cada fila en tramos (columna, fila, longitud)"""
+    tramos = []
+    for fila, modulos in enumerate(matriz_qr(url, correccion)):
+        inicio = None
+        for columna, negro in enumerate(modulos + (False,)):
+            if negro and inicio is None:
+                inicio = columna
+            elif not negro and inicio is not None:
+                tramos.append((inicio, fila, columna - inicio))
+                inicio = None
+    return tuple(tramos)
+
+
+def dibujar_qr(pdf, url, x, y, lado, correccion='M', margen=1):
+    """Dibuja el QR de `url` en un cuadrado de `lado` mm con `margen` módulos en blanco"""
+    modulos = len(matriz_qr(url, correccion))
+    tam_modulo = lado / (modulos + 2 * margen)
+    x0 = x + margen * tam_modulo
+    y0 = y + margen * tam_modulo
+
+    pdf.set_fill_color(0, 0, 0)
+    for columna, fila, longitud in tramos_qr(url, correccion):
+        pdf.rect(x0 + columna * tam_modulo, y0 + fila * tam_modulo, longitud * tam_modulo, tam_modulo, 'F')
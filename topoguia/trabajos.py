@@ -0,0 +1,111 @@
+"""
+Cola de trabajos en segundo plano para generar PDFs sin bloquear la interfaz.
+
+Los trabajos se ejecutan en un pool de hilos compartido por todo el proceso:
+el número de hilos es el tope global de generaciones simultáneas, y la cola
+de pendientes también está limitada para que una avalancha de usuarios no
+agote la memoria del servidor. Pillow y zlib liberan el GIL, así que los
+hilos aprovechan varios núcleos en la parte costosa.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+MAX_TRABAJOS_SIMULTANEOS = int(os.environ.get('TOPOGUIA_TRABAJOS_SIMULTANEOS', '2'))
+MAX_TRABAJOS_PENDIENTES = int(os.environ.get('TOPOGUIA_TRABAJOS_PENDIENTES', '16'))
+# Los resultados no recogidos se descartan pasado este tiempo (segundos)
+CADUCIDAD_TRABAJOS = 30 * 60
+
+EN_COLA = 'en_cola'
+EN_CURSO = 'en_curso'
+TERMINADO = 'terminado'
+ERROR = 'error'
+
+
+class ColaLlena(Exception):
+    """No se admiten más trabajos hasta que terminen algunos de los pendientes"""
+
+
+@dataclass
+class Trabajo:
+    id: str
+    estado: str = EN_COLA
+    progreso: float = 0.0
+    mensaje: str = 'En cola...'
+    resultado: object = None
+    error: str = ''
+    creado: float = field(default_factory=time.time)
+    terminado: float = None
+
+    @property
+    def activo(self):
+        return self.estado in (EN_COLA, EN_CURSO)
+
+    def informar(self, progreso, mensaje=''):
+        """Callback de progreso que reciben las funciones encoladas (0.0 a 1.0)"""
+        self.progreso = max(0.0, min(progreso, 1.0))
+        if mensaje:
+            self.mensaje = mensaje
+
+
+class ColaTrabajos:
+    """Pool de hilos acotado con registro de trabajos consultable por id"""
+
+    def __init__(self, max_simultaneos=MAX_TRABAJOS_SIMULTANEOS, max_pendientes=MAX_TRABAJOS_PENDIENTES):
+        self.max_pendientes = max_pendientes
+        self._pool = ThreadPoolExecutor(max_workers=max_simultaneos, thread_name_prefix='topoguia-trabajo')
+        self._trabajos = {}
+        self._lock = threading.Lock()
+
+    def enviar(self, funcion, *args, **kwargs):
+        """Encola `funcion(*args, progreso=callback, **kwargs)` y devuelve su Trabajo
+
+        Lanza ColaLlena si ya hay demasiados trabajos activos.
+        """
+        with self._lock:
+            self._purgar()
+            activos = sum(1 for t in self._trabajos.values() if t.activo)
+            if activos >= self.max_pendientes:
+                raise ColaLlena(f"Hay {activos} trabajos en curso o en cola")
+            trabajo = Trabajo(id=uuid.uuid4().hex)
+            self._trabajos[trabajo.id] = trabajo
+
+        self._pool.submit(self._ejecutar, trabajo, funcion, args, kwargs)
+        return trabajo
+
+    def obtener(self, trabajo_id):
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def _ejecutar(self, trabajo, funcion, args, kwargs):
+        trabajo.estado = EN_CURSO
+        trabajo.mensaje = 'Generando...'
+        # `terminado` se fija antes que el estado final: en cuanto el trabajo
+        # deja de estar activo, `_purgar` (en otro hilo) puede consultarlo
+        try:
+            resultado = funcion(*args, progreso=trabajo.informar, **kwargs)
+        except Exception as e:
+            trabajo.error = str(e)
+            trabajo.terminado = time.time()
+            trabajo.estado = ERROR
+        else:
+            trabajo.resultado = resultado
+            trabajo.progreso = 1.0
+            trabajo.terminado = time.time()
+            trabajo.estado = TERMINADO
+
+    def _purgar(self):
+        limite = time.time() - CADUCIDAD_TRABAJOS
+        caducados = [
+            t.id for t in self._trabajos.values()
+            if not t.activo and t.terminado is not None and t.terminado < limite
+        ]
+        for trabajo_id in caducados:
+            del self._trabajos[trabajo_id]
+
+
+# Cola única del proceso: el tope de concurrencia es global a todas las sesiones
+cola_trabajos = ColaTrabajos()
@@ -0,0 +1,312 @@
+"""
+Lectura de tracks GPX/GeoJSON y cálculo de la ficha técnica a partir de ellos.
+
+El GPX se lee en streaming, por bloques, sin construir el árbol XML: cada
+bloque se recorre con una sola expresión regular (puntos y altitudes en orden
+de documento) y pasa a arrays de floats. Todos los cálculos (distancias
+haversine, suavizado de altitudes, desniveles, altitudes extremas) se hacen
+con NumPy sobre la traza completa. Un track de 100.000 puntos se procesa en unas
+décimas de segundo.
+
+Los desniveles acumulados se calculan sobre la altitud suavizada y con
+histéresis: un cambio de sentido solo cuenta cuando supera HISTERESIS_M, de
+modo que el ruido del GPS no infla la subida ni la bajada. El horario sigue
+el criterio MIDE: el mayor de los tiempos horizontal y vertical más la mitad
+del menor.
+"""
+import io
+import json
+import re
+from dataclasses import dataclass
+from xml.sax.saxutils import unescape
+
+import numpy as np
+
+from .cache import CacheLRU, hash_contenido
+
+RADIO_TIERRA_M = 6371008.8
+VENTANA_SUAVIZADO_M = 50  # media móvil de la altitud, en metros de recorrido
+HISTERESIS_M = 5
+DISTANCIA_CIRCULAR_M = 200  # inicio y final más cerca que esto: ruta circular
+TAMANO_BLOQUE = 1 << 16
+
+# Criterio MIDE para el horario
+VELOCIDAD_HORIZONTAL_KMH = 5
+VELOCIDAD_SUBIDA_MH = 400
+VELOCIDAD_BAJADA_MH = 600
+REDONDEO_HORARIO_MIN = 5
+
+# Trazas ya leídas por hash del archivo, compartidas por todas las sesiones
+cache_trazas = CacheLRU(32 * 1024 * 1024, medir=lambda t: t.lat.nbytes + t.lon.nbytes + t.ele.nbytes + 256)
+
+
+@dataclass(frozen=True)
+class Traza:
+    """Puntos de un track: latitud y longitud en grados, altitud en m (NaN si falta)
+
+    `waypoints` son los puntos con nombre del archivo: tuplas (nombre, lat, lon).
+    """
+    lat: np.ndarray
+    lon: np.ndarray
+    ele: np.ndarray
+    waypoints: tuple = ()
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def tiene_altitud(self):
+        return bool(np.isfinite(self.ele).any())
+
+    def distancias(self):
+        """Distancia acumulada (m) desde el inicio hasta cada punto"""
+        tramos = haversine(self.lat[:-1], self.lon[:-1], self.lat[1:], self.lon[1:])
+        return np.concatenate(([0.0], np.cumsum(tramos)))
+
+    def altitud_suavizada(self, distancias=None):
+        """Altitud sin huecos ni ruido: media móvil de VENTANA_SUAVIZADO_M metros"""
+        if distancias is None:
+            distancias = self.distancias()
+        validos = np.isfinite(self.ele)
+        ele = np.interp(distancias, distancias[validos], self.ele[validos])
+        if len(ele) < 3:
+            return ele
+        separacion = np.median(np.diff(distancias))
+        puntos = int(VENTANA_SUAVIZADO_M / separacion) if separacion > 0 else 1
+        puntos = max(1, min(puntos, len(ele))) | 1  # impar, para que la ventana quede centrada
+        if puntos == 1:
+            return ele
+        relleno = np.pad(ele, puntos // 2, mode='edge')
+        return np.convolve(relleno, np.ones(puntos) / puntos, mode='valid')
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distancia en metros entre pares de puntos (arrays en grados)"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# Etiqueta de apertura de un punto (con sus atributos) o valor de una altitud,
+# en el orden del documento; admite prefijos de espacio de nombres
+_ELEMENTO_GPX = re.compile(rb'<(?:[\w.-]+:)?(?:(trkpt|rtept)\b([^>]*)>|ele\s*>\s*([^<\s]*))')
+_LAT = re.compile(rb'\blat\s*=\s*["\']\s*([^"\'\s]*)')
+_LON = re.compile(rb'\blon\s*=\s*["\']\s*([^"\'\s]*)')
+_WAYPOINT = re.compile(rb'<(?:[\w.-]+:)?wpt\b([^>]*)>(.*?)</(?:[\w.-]+:)?wpt\s*>', re.S)
+_NOMBRE = re.compile(rb'<(?:[\w.-]+:)?name\s*>\s*(?:<!\[CDATA\[)?([^<\]]*)')
+
+
+def _numeros(valores):
+    return np.array([float(valor) if valor else np.nan for valor in valores], dtype=np.float64)
+
+
+def _escanear_gpx(texto):
+    """Puntos completos de un trozo de GPX: (es_track, lat, lon, ele) como arrays"""
+    elementos = _ELEMENTO_GPX.findall(texto)
+    if not elementos:
+        return None
+    tipos, atributos, altitudes = zip(*elementos)
+    es_punto = np.array([bool(tipo) for tipo in tipos])
+    puntos = np.flatnonzero(es_punto)
+    atributos_puntos = b'\n'.join(atributos[i] for i in puntos)
+    lat, lon = _numeros(_LAT.findall(atributos_puntos)), _numeros(_LON.findall(atributos_puntos))
+    if len(lat) != len(puntos) or len(lon) != len(puntos):
+        raise ValueError("punto sin lat/lon")
+
+    # Cada <ele> pertenece al último punto abierto antes que él; los de los
+    # waypoints, anteriores al primer punto, se descartan
+    ele = np.full(len(puntos), np.nan)
+    indice_punto = np.cumsum(es_punto) - 1
+    filas_ele = np.flatnonzero(~es_punto & (indice_punto >= 0))
+    ele[indice_punto[filas_ele]] = _numeros(altitudes[i] for i in filas_ele)
+    es_track = np.array([tipos[i] == b'trkpt' for i in puntos], dtype=bool)
+    return es_track, lat, lon, ele
+
+
+def _escanear_waypoints(texto):
+    """Waypoints con nombre de un trozo de GPX"""
+    if b'wpt' not in texto:
+        return []
+    waypoints = []
+    for atributos, contenido in _WAYPOINT.findall(texto):
+        nombre, lat, lon = _NOMBRE.search(contenido), _LAT.search(atributos), _LON.search(atributos)
+        if nombre and lat and lon and nombre.group(1).strip():
+            texto_nombre = unescape(nombre.group(1).decode('utf-8', 'replace').strip())
+            waypoints.append((texto_nombre, float(lat.group(1)), float(lon.group(1))))
+    return waypoints
+
+
+def _leer_gpx(flujo, primer_bloque):
+    """Lee el GPX por bloques: cada bloque se procesa hasta el último punto cerrado"""
+    trozos = []
+    waypoints = []
+    pendiente = primer_bloque
+    while True:
+        bloque = flujo.read(TAMANO_BLOQUE)
+        pendiente += bloque
+        corte = len(pendiente) if not bloque else max(pendiente.rfind(b'trkpt>'), pendiente.rfind(b'rtept>')) + 6
+        if corte > 6:
+            waypoints += _escanear_waypoints(pendiente[:corte])
+            trozo = _escanear_gpx(pendiente[:corte])
+            if trozo is not None:
+                trozos.append(trozo)
+            pendiente = pendiente[corte:]
+        if not bloque:
+            break
+    if not trozos:
+        return Traza(np.empty(0), np.empty(0), np.empty(0))
+    es_track, lat, lon, ele = (np.concatenate(columna) for columna in zip(*trozos))
+    # Si hay track se usan sus puntos; si no, los de la ruta
+    seleccion = es_track if es_track.any() else slice(None)
+    return Traza(lat[seleccion], lon[seleccion], ele[seleccion], tuple(waypoints))
+
+
+def _leer_geojson(contenido):
+    """Primera LineString (o MultiLineString, unida) de un GeoJSON; coordenadas [lon, lat, ele]
+
+    Los Point con la propiedad `name` se devuelven como waypoints.
+    """
+    objeto = json.loads(contenido)
+    pendientes = [objeto]
+    linea = None
+    waypoints = []
+    while pendientes:
+        objeto = pendientes.pop(0)
+        tipo = objeto.get('type')
+        if tipo == 'FeatureCollection':
+            pendientes.extend(objeto.get('features') or [])
+        elif tipo == 'Feature':
+            geometria = objeto.get('geometry') or {}
+            nombre = (objeto.get('properties') or {}).get('name')
+            if geometria.get('type') == 'Point' and nombre:
+                lon, lat = geometria['coordinates'][:2]
+                waypoints.append((str(nombre), float(lat), float(lon)))
+            else:
+                pendientes.append(geometria)
+        elif tipo == 'GeometryCollection':
+            pendientes.extend(objeto.get('geometries') or [])
+        elif tipo in ('LineString', 'MultiLineString') and linea is None:
+            linea = objeto['coordinates'] if tipo == 'MultiLineString' else [objeto['coordinates']]
+    if linea is None:
+        return Traza(np.empty(0), np.empty(0), np.empty(0))
+
+    puntos = [punto[:3] for tramo in linea for punto in tramo]
+    coordenadas = np.full((len(puntos), 3), np.nan)
+    try:
+        valores = np.asarray(puntos, dtype=np.float64)
+        coordenadas[:, :valores.shape[1]] = valores
+    except (ValueError, IndexError):
+        # Puntos con y sin altitud mezclados
+        for i, punto in enumerate(puntos):
+            coordenadas[i, :len(punto)] = punto
+    return Traza(coordenadas[:, 1].copy(), coordenadas[:, 0].copy(), coordenadas[:, 2].copy(), tuple(waypoints))
+
+
+def leer_traza_cacheada(datos):
+    """`leer_traza` de unos bytes, una sola vez por contenido: el perfil y el mapa salen del mismo track"""
+    return cache_trazas.obtener_o_calcular(hash_contenido(datos), lambda: leer_traza(datos))
+
+
+def leer_traza(origen):
+    """Lee un track GPX o GeoJSON desde bytes, un archivo abierto en binario o una ruta
+
+    El formato se detecta por el contenido. Lanza ValueError si el archivo no
+    se puede leer o tiene menos de dos puntos.
+    """
+    if isinstance(origen, (bytes, bytearray, memoryview)):
+        flujo = io.BytesIO(origen)
+    elif isinstance(origen, str):
+        flujo = open(origen, 'rb')
+    else:
+        flujo = origen
+    try:
+        primer_bloque = flujo.read(TAMANO_BLOQUE)
+        if primer_bloque.lstrip()[:1] == b'{':
+            traza = _leer_geojson(primer_bloque + flujo.read())
+        else:
+            traza = _leer_gpx(flujo, primer_bloque)
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        raise ValueError(f"No se puede leer el track: {e}") from e
+    finally:
+        if isinstance(origen, str):
+            flujo.close()
+    if len(traza) < 2:
+        raise ValueError("El track no tiene al menos dos puntos")
+    return traza
+
+
+def desniveles(altitud, umbral=HISTERESIS_M):
+    """Subida y bajada acumuladas (m) con histéresis: se ignoran oscilaciones menores que `umbral`"""
+    # Solo importan los puntos donde cambia el sentido de la pendiente
+    pendiente = np.sign(np.diff(altitud))
+    con_pendiente = np.flatnonzero(pendiente)
+    if len(con_pendiente) == 0:
+        return 0.0, 0.0
+    sentido = pendiente[con_pendiente]
+    giros = con_pendiente[1:][sentido[1:] != sentido[:-1]]
+    extremos = altitud[np.concatenate(([0], giros, [len(altitud) - 1]))].tolist()
+
+    subida = bajada = 0.0
+    base = extremo = extremos[0]
+    sube = None  # sentido del tramo en curso, aún sin decidir
+    for valor in extremos[1:]:
+        if sube is None:
+            if abs(valor - base) >= umbral:
+                sube, extremo = valor > base, valor
+        elif sube:
+            if valor > extremo:
+                extremo = valor
+            elif extremo - valor >= umbral:
+                subida += extremo - base
+                base, extremo, sube = extremo, valor, False
+        else:
+            if valor < extremo:
+                extremo = valor
+            elif valor - extremo >= umbral:
+                bajada += base - extremo
+                base, extremo, sube = extremo, valor, True
+    if sube:
+        subida += extremo - base
+    elif sube is False:
+        bajada += base - extremo
+    return subida, bajada
+
+
+def horario_mide(distancia_m, subida_m, bajada_m):
+    """Horas de marcha según MIDE, sin paradas"""
+    horizontal = distancia_m / 1000 / VELOCIDAD_HORIZONTAL_KMH
+    vertical = subida_m / VELOCIDAD_SUBIDA_MH + bajada_m / VELOCIDAD_BAJADA_MH
+    return max(horizontal, vertical) + min(horizontal, vertical) / 2
+
+
+def formatear_horario(horas):
+    """Horas decimales como '2h 35m', redondeadas a REDONDEO_HORARIO_MIN minutos"""
+    minutos = int(round(horas * 60 / REDONDEO_HORARIO_MIN)) * REDONDEO_HORARIO_MIN
+    return f"{minutos // 60}h {minutos % 60:02d}m"
+
+
+def ficha_tecnica(traza):
+    """Valores de la ficha técnica con el formato del formulario
+
+    Devuelve distancia, tipo_ruta y, si el track tiene altitudes,
+    desnivel_subida, desnivel_bajada, altitud_rango y tiempo (sin altitudes el
+    horario solo tiene en cuenta la distancia).
+    """
+    distancias = traza.distancias()
+    total = float(distancias[-1])
+    cierre = haversine(traza.lat[0], traza.lon[0], traza.lat[-1], traza.lon[-1])
+    ficha = {
+        'distancia': f"{total / 1000:.1f} Km".replace('.', ','),
+        'tipo_ruta': "Circular" if cierre <= DISTANCIA_CIRCULAR_M else "Lineal",
+    }
+    subida = bajada = 0.0
+    if traza.tiene_altitud:
+        altitud = traza.altitud_suavizada(distancias)
+        subida, bajada = desniveles(altitud)
+        ficha.update(
+            desnivel_subida=f"{subida:.0f} m",
+            desnivel_bajada=f"{bajada:.0f} m",
+            altitud_rango=f"{np.min(altitud):.0f}-{np.max(altitud):.0f} m",
+        )
+    ficha['tiempo'] = formatear_horario(horario_mide(total, subida, bajada))
+    return ficha
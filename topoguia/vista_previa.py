@@ -0,0 +1,427 @@
+"""
+Vista previa rápida de la maqueta, dibujada con Pillow sin generar el PDF.
+
+Las dos páginas se trazan con las mismas coordenadas que `PDF_Landscape`
+(`maqueta.py`) y el texto se corta en líneas con el propio fpdf2 (`dry_run`),
+así que los saltos de línea coinciden con los del PDF final. Las imágenes se
+sustituyen por sus miniaturas, de modo que redibujar tarda unas decenas de
+milisegundos y se puede repetir con cada cambio del formulario.
+
+Además de las imágenes, se devuelven los avisos de maquetación: textos que no
+caben en su hueco o que invaden el recuadro de RECOMENDACIONES.
+"""
+import io
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .fuentes import FUENTE_CORE, fuentes_analizadas
+from .imagenes import CAJAS_IMAGEN, MM_POR_PULGADA
+from .maqueta import (
+    ALTO_BANNER, ALTO_DATOS, ALTO_LINEA_PANEL, ALTO_MIDE, ALTO_PAGINA, ALTO_RECOM, ANCHO_COLUMNA,
+    ANCHO_PAGINA, ANCHO_PANEL, MARGEN, POSICIONES_IMAGEN, SEPARACION_PARRAFOS, TEXTO_SENALIZACION,
+    VERDE, X_PANEL, X_TEXTO, Y_BANNER, Y_DATOS, Y_PANEL, Y_PARRAFOS, Y_RECOM, Y_TEXTO_RECOM,
+    Y_TITULO, posiciones_panel,
+)
+from .maquetacion import ajustar_descripcion, ajustar_recomendaciones
+from .mapa import dibujar_trazado, mapa_de_track
+from .mide import dibujar_mide
+from .modelo import DatosRuta
+from .pdf import PDF_Landscape
+from .perfil import dibujar_perfil, perfil_de_track
+from .qr import dibujar_qr
+
+# Píxeles por mm de la vista previa (4 px/mm ≈ 100 ppp: 1188 x 840 px por página)
+ESCALA_POR_DEFECTO = 4
+MM_POR_PUNTO = 25.4 / 72
+COLOR_AVISO = (220, 30, 30)
+
+
+@dataclass
+class Aviso:
+    """Problema de maquetación localizado en una página (caja en mm: x, y, ancho, alto)"""
+    pagina: int
+    zona: str
+    mensaje: str
+    caja: tuple
+
+
+@dataclass
+class VistaPrevia:
+    paginas: list
+    avisos: list = field(default_factory=list)
+
+
+@lru_cache(maxsize=64)
+def _fuente(estilo, tam_px):
+    """Fuente Pillow para pintar: la misma TTF que el PDF si hay una instalada"""
+    analizadas = fuentes_analizadas()
+    for analizada in (analizadas.get(estilo), analizadas.get('')):
+        if analizada is None:
+            continue
+        try:
+            return ImageFont.truetype(io.BytesIO(analizada.datos), tam_px)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(tam_px)
+    except TypeError:  # Pillow < 10.1 solo trae la fuente bitmap de tamaño fijo
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=32)
+def _proxy_en_caja(datos, ancho_px, alto_px):
+    """Decodifica una miniatura y la escala a su caja en la vista previa"""
+    img = Image.open(io.BytesIO(datos))
+    img.draft('RGB', (ancho_px, alto_px))
+    return img.convert('RGBA').resize((ancho_px, alto_px), Image.Resampling.BILINEAR)
+
+
+def _nuevo_medidor():
+    """Documento vacío solo para medir con las métricas exactas del PDF"""
+    medidor = PDF_Landscape(DatosRuta())
+    medidor.add_page()
+    return medidor
+
+
+@lru_cache(maxsize=256)
+def _cortar_lineas(texto, ancho, alto_linea, estilo, tam_pt, alineacion):
+    """Líneas en que fpdf2 parte un multi_cell
+
+    Es lo más lento de la vista previa (fpdf2 recorre el texto carácter a
+    carácter), así que se memoiza: al editar un párrafo solo se vuelve a cortar
+    ese. Cada llamada usa su propio documento para poder ejecutarse en paralelo.
+    """
+    medidor = _nuevo_medidor()
+    medidor.set_font(medidor.familia, estilo, tam_pt)
+    lineas = medidor.multi_cell(ancho, alto_linea, texto, align=alineacion, dry_run=True, output='LINES')
+    if medidor.familia != FUENTE_CORE:
+        return tuple(lineas)
+    # Con fuentes core fpdf2 devuelve las líneas ya codificadas en windows-1252
+    return tuple(linea.encode('latin-1', 'replace').decode('windows-1252', 'replace') for linea in lineas)
+
+
+class _Lienzo:
+    """Página de Pillow con coordenadas en mm y la parte de la API de fpdf2 que necesitan
+    `dibujar_qr`, `dibujar_perfil`, `dibujar_trazado` y `dibujar_mide`"""
+
+    familia = None  # set_font solo usa el estilo y el tamaño: la fuente es la del PDF
+
+    def __init__(self, escala):
+        self.escala = escala
+        self.img = Image.new('RGB', (self._px(ANCHO_PAGINA), self._px(ALTO_PAGINA)), 'white')
+        self.draw = ImageDraw.Draw(self.img)
+        self.relleno = (0, 0, 0)
+        self.trazo = (0, 0, 0)
+        self.grosor = 0.2
+        self.color_texto = (0, 0, 0)
+        self.fuente = ('', 8)
+        self.x = self.y = 0
+
+    def _px(self, mm):
+        return round(mm * self.escala)
+
+    def _pxs(self, puntos):
+        return [(self._px(x), self._px(y)) for x, y in puntos]
+
+    def set_fill_color(self, r, g, b):
+        self.relleno = (r, g, b)
+
+    def set_draw_color(self, r, g, b):
+        self.trazo = (r, g, b)
+
+    def set_line_width(self, ancho):
+        self.grosor = ancho
+
+    def set_text_color(self, r, g, b):
+        self.color_texto = (r, g, b)
+
+    def set_font(self, familia, estilo='', tam_pt=8):
+        self.fuente = (estilo, tam_pt)
+
+    def set_xy(self, x, y):
+        self.x, self.y = x, y
+
+    @contextmanager
+    def local_context(self, **estilo):
+        # Las uniones de las líneas ya son redondeadas (joint='curve')
+        yield
+
+    def cell(self, w, h, texto, align='L'):
+        self.texto(self.x, self.y, h, texto, *self.fuente, self.color_texto, align, w)
+
+    def line(self, x1, y1, x2, y2):
+        self.draw.line(self._pxs([(x1, y1), (x2, y2)]), fill=self.trazo, width=max(1, self._px(self.grosor)))
+
+    def polyline(self, puntos):
+        self.draw.line(self._pxs(puntos), fill=self.trazo, width=max(1, self._px(self.grosor)), joint='curve')
+
+    def polygon(self, puntos, style='D'):
+        self.draw.polygon(self._pxs(puntos), fill=self.relleno if 'F' in style else None,
+                          outline=self.trazo if 'D' in style else None)
+
+    def rect(self, x, y, w, h, style='F'):
+        self.draw.rectangle(
+            [self._px(x), self._px(y), self._px(x + w) - 1, self._px(y + h) - 1], fill=self.relleno
+        )
+
+    def texto(self, x, y, alto, texto, estilo, tam_pt, color, alineacion='L', ancho=0):
+        """Escribe una línea como `cell` de fpdf2: centrada en vertical dentro de `alto` mm"""
+        tam_mm = tam_pt * MM_POR_PUNTO
+        fuente = _fuente(estilo, max(self._px(tam_mm), 6))
+        base = y + alto / 2 + 0.3 * tam_mm
+        ancho = ancho or (ANCHO_PAGINA - MARGEN - x)
+        anclas = {'L': (x, 'ls'), 'C': (x + ancho / 2, 'ms'), 'R': (x + ancho, 'rs')}
+        x_texto, ancla = anclas.get(alineacion, anclas['L'])
+        self.draw.text((self._px(x_texto), self._px(base)), texto, fill=color, font=fuente, anchor=ancla)
+
+    def imagen(self, datos, x, y, w, h):
+        if datos is None:
+            # Sin miniatura: un hueco gris marca dónde irá la imagen
+            self.draw.rectangle(
+                [self._px(x), self._px(y), self._px(x + w) - 1, self._px(y + h) - 1],
+                fill=(225, 225, 225), outline=(170, 170, 170),
+            )
+            return
+        proxy = _proxy_en_caja(datos, self._px(w), self._px(h))
+        self.img.paste(proxy, (self._px(x), self._px(y)), proxy)
+
+    def resaltar(self, avisos):
+        """Superpone en rojo translúcido las cajas de los avisos"""
+        if not avisos:
+            return
+        capa = Image.new('RGBA', self.img.size, (0, 0, 0, 0))
+        dibujo = ImageDraw.Draw(capa)
+        for aviso in avisos:
+            x, y, w, h = aviso.caja
+            dibujo.rectangle(
+                [self._px(x), self._px(y), self._px(x + w), self._px(y + h)],
+                fill=COLOR_AVISO + (60,), outline=COLOR_AVISO + (255,), width=2,
+            )
+        self.img = Image.alpha_composite(self.img.convert('RGBA'), capa).convert('RGB')
+
+
+def _tamano_caja(clave, datos):
+    """Tamaño en mm con que fpdf2 dibujará la imagen (completa la dimensión libre)"""
+    ancho, alto = CAJAS_IMAGEN[clave]
+    if ancho and alto:
+        return ancho, alto
+    if datos is None:
+        return ancho or alto * 2, alto or ancho / 2
+    px_ancho, px_alto = Image.open(io.BytesIO(datos)).size
+    if ancho:
+        return ancho, ancho * px_alto / px_ancho
+    return alto * px_ancho / px_alto, alto
+
+
+class _Maquetador:
+    """Reproduce el trazado de PDF_Landscape sobre dos lienzos de Pillow"""
+
+    def __init__(self, datos, proxies, escala):
+        self.datos = datos
+        self.proxies = proxies
+        self.escala = escala
+        self.avisos = []
+        self.medidor = _nuevo_medidor()
+
+    def lineas(self, texto, ancho, alto_linea, estilo, tam_pt, alineacion='L'):
+        return _cortar_lineas(texto, ancho, alto_linea, estilo, tam_pt, alineacion)
+
+    def ancho_texto(self, texto, estilo, tam_pt):
+        self.medidor.set_font(self.medidor.familia, estilo, tam_pt)
+        return self.medidor.get_string_width(texto)
+
+    def avisar(self, pagina, zona, mensaje, x, y, w, h):
+        self.avisos.append(Aviso(pagina, zona, mensaje, (x, y, w, h)))
+
+    def parrafo(self, lienzo, x, y, ancho, alto_linea, texto, estilo, tam_pt, color, alineacion='L'):
+        """Dibuja un multi_cell y devuelve la Y donde termina"""
+        for linea in self.lineas(texto, ancho, alto_linea, estilo, tam_pt, alineacion):
+            lienzo.texto(x, y, alto_linea, linea, estilo, tam_pt, color)
+            y += alto_linea
+        return y
+
+    def linea_unica(self, pagina, zona, lienzo, x, y, alto, texto, estilo, tam_pt, color, ancho=0, alineacion='L'):
+        """Dibuja un `cell` y avisa si el texto se sale de su ancho disponible"""
+        lienzo.texto(x, y, alto, texto, estilo, tam_pt, color, alineacion, ancho)
+        disponible = ancho or (ANCHO_PAGINA - MARGEN - x)
+        necesario = self.ancho_texto(texto, estilo, tam_pt)
+        if necesario > disponible:
+            self.avisar(pagina, zona, f"{zona}: el texto no cabe en una línea "
+                        f"({necesario:.0f} mm de {disponible:.0f} mm)", x, y, disponible, alto)
+
+    def imagen(self, lienzo, clave):
+        datos = self.proxies.get(clave)
+        x, y = POSICIONES_IMAGEN[clave]
+        w, h = _tamano_caja(clave, datos)
+        lienzo.imagen(datos, x, y, w, h)
+        return w, h
+
+    def pagina_1(self):
+        lienzo = _Lienzo(self.escala)
+        datos = self.datos
+
+        if 'logo' in self.proxies:
+            self.imagen(lienzo, 'logo')
+        gris = (100, 100, 100)
+        lienzo.texto(200, 8, 4, datos.entidad_promotora, 'I', 8, gris, 'R')
+        lienzo.texto(200, 12, 4, datos.parque_natural, 'I', 8, gris, 'R')
+
+        if 'banner' in self.proxies:
+            if datos.mirador_nombre:
+                lienzo.set_fill_color(*VERDE)
+                lienzo.rect(10, Y_BANNER, 15, ALTO_BANNER)
+                # Texto girado 90º como en el PDF
+                tam_px = max(lienzo._px(10 * MM_POR_PUNTO), 6)
+                fuente = _fuente('B', tam_px)
+                caja = fuente.getbbox(datos.mirador_nombre)
+                etiqueta = Image.new('RGBA', (caja[2] + 2, tam_px + 4), (0, 0, 0, 0))
+                ImageDraw.Draw(etiqueta).text((0, 0), datos.mirador_nombre, fill='white', font=fuente)
+                etiqueta = etiqueta.rotate(90, expand=True)
+                centro = (lienzo._px(17.5), lienzo._px(Y_BANNER + 40))
+                lienzo.img.paste(etiqueta, (centro[0] - etiqueta.width // 2, centro[1] - etiqueta.height // 2), etiqueta)
+                if self.ancho_texto(datos.mirador_nombre, 'B', 10) > ALTO_BANNER:
+                    self.avisar(1, 'Mirador', "Mirador: el nombre es más largo que la franja vertical",
+                                10, Y_BANNER, 15, ALTO_BANNER)
+            self.imagen(lienzo, 'banner')
+            x_pos = 40
+            for lugar in datos.lugares_interes.split(',')[:3]:
+                lienzo.texto(x_pos, Y_BANNER + 5, 5, lugar.strip(), 'B', 7, (255, 255, 255))
+                x_pos += 80
+
+        self.linea_unica(1, 'Código de ruta', lienzo, X_TEXTO, Y_TITULO, 10, datos.codigo_ruta, 'B', 28, VERDE)
+        self.linea_unica(1, 'Nombre del sendero', lienzo, X_TEXTO, Y_TITULO + 12, 7,
+                         f"SENDERO {datos.nombre_sendero}", 'B', 14, VERDE)
+
+        # Descripción: cada párrafo empieza 2 mm por debajo del anterior, con
+        # el tamaño que elige el ajuste automático igual que en el PDF
+        ajuste = ajustar_descripcion(datos)
+        y_texto = Y_PARRAFOS
+        y_fin = y_texto
+        for parrafo in datos.parrafos:
+            y_fin = self.parrafo(lienzo, X_TEXTO, y_texto, ANCHO_COLUMNA, ajuste.alto_linea,
+                                 parrafo, '', ajuste.tam_pt, (0, 0, 0), 'J')
+            y_texto = y_fin + SEPARACION_PARRAFOS
+
+        # El recuadro se pinta encima, igual que en el PDF
+        lienzo.set_fill_color(255, 243, 205)
+        lienzo.rect(X_TEXTO, Y_RECOM, ANCHO_COLUMNA, ALTO_RECOM)
+        lienzo.texto(X_TEXTO + 2, Y_RECOM + 2, 5, 'RECOMENDACIONES', 'B', 10, VERDE)
+        ajuste_recom = ajustar_recomendaciones(datos)
+        y_fin_recom = self.parrafo(lienzo, X_TEXTO + 2, Y_TEXTO_RECOM, ANCHO_COLUMNA - 4, ajuste_recom.alto_linea,
+                                   datos.recomendaciones, '', ajuste_recom.tam_pt, (0, 0, 0))
+
+        # Solo quedan avisos si el texto no cabe ni con el tamaño mínimo
+        if y_fin > Y_RECOM:
+            sobrante = y_fin - Y_RECOM
+            self.avisar(1, 'Descripción', f"Descripción: aun a {ajuste.tam_pt:g} pt invade el recuadro de "
+                        f"RECOMENDACIONES en {sobrante:.0f} mm (unas {sobrante / ajuste.alto_linea:.0f} líneas)",
+                        X_TEXTO, Y_RECOM, ANCHO_COLUMNA, min(sobrante, ALTO_PAGINA - Y_RECOM))
+        if y_fin_recom > Y_RECOM + ALTO_RECOM:
+            sobrante = y_fin_recom - (Y_RECOM + ALTO_RECOM)
+            self.avisar(1, 'Recomendaciones', f"Recomendaciones: aun a {ajuste_recom.tam_pt:g} pt el texto se "
+                        f"sale del recuadro en {sobrante:.0f} mm", X_TEXTO, Y_RECOM + ALTO_RECOM, ANCHO_COLUMNA,
+                        min(sobrante, ALTO_PAGINA - Y_RECOM - ALTO_RECOM))
+
+        lienzo.texto(MARGEN, ALTO_PAGINA - 10, 5, f'Generado el {datetime.now().strftime("%d/%m/%Y")}',
+                     'I', 7, (100, 100, 100), 'C', ANCHO_PAGINA - 2 * MARGEN)
+        lienzo.resaltar([a for a in self.avisos if a.pagina == 1])
+        return lienzo.img
+
+    def pagina_2(self):
+        lienzo = _Lienzo(self.escala)
+        datos = self.datos
+
+        if 'mapa' in self.proxies:
+            self.imagen(lienzo, 'mapa')
+        elif 'track' in self.proxies:
+            try:
+                mapa = mapa_de_track(self.proxies['track'], round(self.escala * MM_POR_PULGADA))
+            except ValueError:
+                mapa = None
+            if mapa is not None:
+                lienzo.imagen(mapa.imagen, *POSICIONES_IMAGEN['mapa'], *CAJAS_IMAGEN['mapa'])
+                dibujar_trazado(lienzo, mapa, *POSICIONES_IMAGEN['mapa'], *CAJAS_IMAGEN['mapa'])
+        perfil = None
+        if 'track' in self.proxies:
+            try:
+                perfil = perfil_de_track(self.proxies['track'])
+            except ValueError:
+                perfil = None
+            if perfil is not None:
+                dibujar_perfil(lienzo, perfil, datos.hitos, *POSICIONES_IMAGEN['perfil'], *CAJAS_IMAGEN['perfil'])
+        if perfil is None and 'perfil' in self.proxies:
+            self.imagen(lienzo, 'perfil')
+
+        lienzo.set_fill_color(*VERDE)
+        lienzo.rect(X_PANEL, Y_PANEL, ANCHO_PANEL, 8)
+        lienzo.texto(X_PANEL, Y_PANEL + 2, 5, 'FICHA TÉCNICA', 'B', 11, (255, 255, 255), 'C', ANCHO_PANEL)
+
+        lienzo.set_fill_color(245, 245, 245)
+        lienzo.rect(X_PANEL, Y_DATOS, ANCHO_PANEL, ALTO_DATOS)
+        y_item = Y_DATOS + 3
+        for etiqueta, valor in datos.ficha_tecnica:
+            lienzo.texto(X_PANEL + 3, y_item, 5, etiqueta, 'B', 8, (0, 0, 0))
+            self.linea_unica(2, etiqueta.rstrip(':'), lienzo, X_PANEL + 38, y_item, 5, valor, '', 8, (0, 0, 0))
+            y_item += 6
+
+        posiciones = posiciones_panel('mide' in self.proxies or datos.tiene_mide)
+        if 'mide' in self.proxies:
+            _, alto_mide = self.imagen(lienzo, 'mide')
+            # La sección siguiente empieza 5 mm por debajo del hueco reservado
+            if alto_mide > ALTO_MIDE + 5:
+                self.avisar(2, 'Tabla MIDE', f"Tabla MIDE: mide {alto_mide:.0f} mm de alto y pisa "
+                            f"SEÑALIZACIÓN (hay {ALTO_MIDE + 5} mm)", X_PANEL, posiciones['senalizacion'],
+                            ANCHO_PANEL, alto_mide - ALTO_MIDE - 5)
+        elif datos.tiene_mide:
+            dibujar_mide(lienzo, datos.valores_mide, *POSICIONES_IMAGEN['mide'], ANCHO_PANEL, ALTO_MIDE)
+
+        lienzo.texto(X_PANEL, posiciones['senalizacion'], 5, 'SEÑALIZACIÓN', 'B', 9, VERDE)
+        self.parrafo(lienzo, X_PANEL, posiciones['senalizacion'] + 6, ANCHO_PANEL, ALTO_LINEA_PANEL,
+                     TEXTO_SENALIZACION, '', 7, (0, 0, 0))
+
+        y_consejos = posiciones['consejos']
+        lienzo.texto(X_PANEL, y_consejos, 5, 'DISFRUTA DEL PARQUE', 'B', 9, VERDE)
+        y_fin = self.parrafo(lienzo, X_PANEL, y_consejos + 6, ANCHO_PANEL, ALTO_LINEA_PANEL,
+                             datos.consejos_disfruta, '', 7, (0, 0, 0))
+        if y_fin > posiciones['telefonos']:
+            self.avisar(2, 'Disfruta del parque', f"Disfruta del parque: el texto pisa TELÉFONOS DE "
+                        f"INTERÉS en {y_fin - posiciones['telefonos']:.0f} mm", X_PANEL, posiciones['telefonos'],
+                        ANCHO_PANEL, y_fin - posiciones['telefonos'])
+
+        y_telefonos = posiciones['telefonos']
+        lienzo.texto(X_PANEL, y_telefonos, 5, 'TELÉFONOS DE INTERÉS', 'B', 9, VERDE)
+        lienzo.texto(X_PANEL, y_telefonos + 6, 4, f"Emergencias: {datos.telefono_emergencias}", '', 8, (0, 0, 0))
+        lienzo.texto(X_PANEL, y_telefonos + 11, 4, f"Parque: {datos.telefono_parque}", '', 8, (0, 0, 0))
+
+        if datos.url_qr:
+            dibujar_qr(lienzo, datos.url_qr, x=X_PANEL + 30, y=posiciones['qr'], lado=25)
+            y_fin = posiciones['url']
+            for linea in self.lineas(datos.url_qr, ANCHO_PANEL, 2.5, 'I', 6, 'C'):
+                lienzo.texto(X_PANEL, y_fin, 2.5, linea, 'I', 6, (0, 0, 0), 'C', ANCHO_PANEL)
+                y_fin += 2.5
+            if y_fin > ALTO_PAGINA:
+                self.avisar(2, 'URL del QR', "URL del QR: se sale por el borde inferior de la página",
+                            X_PANEL, posiciones['url'], ANCHO_PANEL, ALTO_PAGINA - posiciones['url'])
+
+        lienzo.resaltar([a for a in self.avisos if a.pagina == 2])
+        return lienzo.img
+
+
+def renderizar_vista_previa(datos, proxies, escala=ESCALA_POR_DEFECTO):
+    """Dibuja las dos páginas y devuelve una VistaPrevia con sus avisos de maquetación
+
+    `proxies` asocia cada clave de imagen (logo, banner, mapa, perfil, mide) con
+    los bytes de su miniatura; las claves ausentes se omiten como en el PDF. Con
+    `track` (los bytes del GPX/GeoJSON) el perfil, y el mapa si hay teselas
+    locales, se dibujan como en el PDF.
+    """
+    if not isinstance(datos, DatosRuta):
+        datos = DatosRuta.desde_dict(datos)
+    proxies = {clave: valor for clave, valor in proxies.items() if valor}
+    maquetador = _Maquetador(datos, proxies, escala)
+    paginas = [maquetador.pagina_1(), maquetador.pagina_2()]
+    return VistaPrevia(paginas=paginas, avisos=maquetador.avisos)